@@ -0,0 +1,353 @@
+"""
+Benchmark de ponta a ponta do projeto, todo local (sem rede).
+
+Gera uma base sintética (gerar_mock.py --sintetico) num diretório temporário, roda cada
+etapa do ETL num processo separado medindo tempo, pico de memória (RSS) e linhas/s, sobe
+a API com uvicorn numa porta local e dispara requisições concorrentes, medindo p50/p95/p99
+por endpoint. O resultado vai para um JSON, que pode ser comparado com um anterior.
+
+Uso:
+    python benchmarks/benchmark.py --escala pequena
+    python benchmarks/benchmark.py --operadoras 2000 --linhas 500000 --anos 2021-2024 --comparar resultados/anterior.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import sqlite3
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import quote
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows: sem pico de RSS
+    resource = None
+
+# configurações
+DIR_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIR_SRC = os.path.join(DIR_REPO, "src")
+DIR_RESULTADOS = os.path.join(DIR_REPO, "benchmarks", "resultados")
+ESCALAS = {
+    "pequena": {"operadoras": 300, "linhas": 50_000, "anos": "2023"},
+    "media": {"operadoras": 1_000, "linhas": 300_000, "anos": "2022-2023"},
+    "grande": {"operadoras": 1_500, "linhas": 1_000_000, "anos": "2019-2024"},
+}
+ETAPAS = ["normalizar", "consolidacao", "transformacao", "carga"]
+REQUISICOES = 2_000  # por rodada de carga na API
+CONCORRENCIA = 16  # clientes simultâneos
+TIMEOUT_API = 30  # segundos esperando o uvicorn subir
+
+# ---------------------------------------------------------------------------
+# Etapas (executadas no processo filho, com cwd no diretório temporário)
+# ---------------------------------------------------------------------------
+
+def etapa_normalizar():
+    import main
+    linhas = 0
+    for caminho in main.listar_arquivos_csv(main.DIR_RAW):
+        df = main.normalizar_arquivo(caminho)
+        linhas += 0 if df is None else len(df)
+    return linhas
+
+def etapa_consolidacao():
+    import main
+    import particoes
+    # começa do zero: a consolidação incremental pularia tudo numa segunda rodada
+    shutil.rmtree(main.DIR_PROCESSED, ignore_errors=True)
+    os.makedirs(main.DIR_PROCESSED, exist_ok=True)
+    controle = particoes.abrir_controle()
+    main.atualizar_particoes(main.listar_arquivos_csv(main.DIR_RAW), controle)
+    linhas = main.juntar_particoes(controle, os.path.join(main.DIR_PROCESSED, "consolidado_despesas.csv"))
+    controle.close()
+    return linhas
+
+def etapa_transformacao():
+    import transformacao
+    import particoes
+    transformacao.main()
+    controle = particoes.abrir_controle()
+    linhas = sum(p["linhas"] for p in particoes.listar(controle, "consolidacao"))
+    controle.close()
+    return linhas
+
+def etapa_carga():
+    import banco_de_dados
+    for arquivo in os.listdir("."):
+        if arquivo.startswith(banco_de_dados.DB_NAME):
+            os.remove(arquivo)
+    banco_de_dados.main()
+    conn = sqlite3.connect(banco_de_dados.DB_NAME)
+    linhas = conn.execute("SELECT COUNT(*) FROM despesas").fetchone()[0]
+    conn.close()
+    return linhas
+
+def rss_pico_mb():
+    """ Maior RSS entre este processo e os filhos já encerrados (workers dos pools) """
+    if resource is None:
+        return None
+    proprio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    filhos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024  # macOS em bytes, Linux em KB
+    return round(max(proprio, filhos) / divisor, 1)
+
+def executar_etapa_filho(nome):
+    sys.path.insert(0, DIR_SRC)
+    funcao = globals()[f"etapa_{nome}"]
+    # a saída das etapas vai para stderr; o stdout fica só com o JSON do resultado
+    saida = sys.stdout
+    sys.stdout = sys.stderr
+    linhas = funcao()
+    sys.stdout = saida
+    print(json.dumps({"linhas": linhas, "rss_pico_mb": rss_pico_mb()}))
+
+# ---------------------------------------------------------------------------
+# Processo principal
+# ---------------------------------------------------------------------------
+
+def rodar(comando, cwd, log):
+    inicio = time.perf_counter()
+    resultado = subprocess.run(comando, cwd=cwd, stdout=subprocess.PIPE, stderr=log, text=True)
+    duracao = time.perf_counter() - inicio
+    if resultado.returncode != 0:
+        raise RuntimeError(f"Falhou ({resultado.returncode}): {' '.join(comando)}. Veja {log.name}")
+    return duracao, resultado.stdout
+
+def medir_etapa(nome, diretorio, log):
+    print(f"-> Etapa {nome}...", end=" ", flush=True)
+    duracao, saida = rodar([sys.executable, os.path.abspath(__file__), "--etapa-filho", nome], diretorio, log)
+    dados = json.loads(saida.strip().splitlines()[-1])
+    dados["segundos"] = round(duracao, 3)
+    dados["linhas_por_segundo"] = round(dados["linhas"] / duracao, 1) if duracao else None
+    print(f"{dados['segundos']}s, {dados['linhas']} linhas, pico {dados['rss_pico_mb']} MB")
+    return dados
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def esperar_api(porta, processo):
+    limite = time.monotonic() + TIMEOUT_API
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError("O uvicorn terminou antes de responder")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", porta, timeout=2)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("A API não respondeu a tempo")
+
+def montar_requisicoes(diretorio, quantidade, rng):
+    """ Mistura de endpoints parecida com o uso do dashboard, com registros reais do banco """
+    conn = sqlite3.connect(os.path.join(diretorio, "intuitive_care.db"))
+    registros = [r[0] for r in conn.execute("SELECT registro_ans FROM operadoras")]
+    nomes = [r[0].split()[0] for r in conn.execute("SELECT razao_social FROM operadoras LIMIT 50")]
+    conn.close()
+
+    geradores = {
+        "listar_operadoras": lambda: f"/api/operadoras?page={rng.randint(1, 20)}&limit=10",
+        "buscar_operadoras": lambda: f"/api/operadoras?busca={quote(rng.choice(nomes)[:4])}&limit=10",
+        "detalhes_operadora": lambda: f"/api/operadoras/{rng.choice(registros)}",
+        "despesas_operadora": lambda: f"/api/operadoras/{rng.choice(registros)}/despesas",
+        "estatisticas": lambda: "/api/estatisticas",
+    }
+    pesos = {"listar_operadoras": 3, "buscar_operadoras": 2, "detalhes_operadora": 2,
+             "despesas_operadora": 2, "estatisticas": 1}
+    nomes_endpoints = rng.choices(list(pesos), weights=list(pesos.values()), k=quantidade)
+    return [(nome, geradores[nome]()) for nome in nomes_endpoints]
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    baixo = int(k)
+    alto = min(baixo + 1, len(ordenados) - 1)
+    return ordenados[baixo] + (ordenados[alto] - ordenados[baixo]) * (k - baixo)
+
+def carga_api(porta, requisicoes, concorrencia):
+    """ Dispara as requisições com `concorrencia` clientes (conexão keep-alive por cliente) """
+    fila = list(requisicoes)
+    trava = threading.Lock()
+    medidas = []  # (endpoint, ms, status, cache)
+
+    def cliente():
+        conn = http.client.HTTPConnection("127.0.0.1", porta, timeout=30)
+        while True:
+            with trava:
+                if not fila:
+                    break
+                endpoint, caminho = fila.pop()
+            inicio = time.perf_counter()
+            try:
+                conn.request("GET", caminho, headers={"Accept-Encoding": "gzip"})
+                resposta = conn.getresponse()
+                resposta.read()
+                status, cache = resposta.status, resposta.getheader("x-cache")
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", porta, timeout=30)
+                status, cache = None, None
+            ms = (time.perf_counter() - inicio) * 1000
+            with trava:
+                medidas.append((endpoint, ms, status, cache))
+        conn.close()
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=cliente) for _ in range(concorrencia)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duracao = time.perf_counter() - inicio
+
+    resultado = {"requisicoes": len(medidas), "segundos": round(duracao, 3),
+                 "requisicoes_por_segundo": round(len(medidas) / duracao, 1), "endpoints": {}}
+    for endpoint in sorted({m[0] for m in medidas}):
+        do_endpoint = [m for m in medidas if m[0] == endpoint]
+        tempos = [m[1] for m in do_endpoint]
+        resultado["endpoints"][endpoint] = {
+            "requisicoes": len(do_endpoint),
+            "erros": sum(1 for m in do_endpoint if m[2] != 200 and m[2] != 404),
+            "cache_hit": round(sum(1 for m in do_endpoint if m[3] == "HIT") / len(do_endpoint), 3),
+            "p50_ms": round(percentil(tempos, 50), 2),
+            "p95_ms": round(percentil(tempos, 95), 2),
+            "p99_ms": round(percentil(tempos, 99), 2),
+        }
+    return resultado
+
+def medir_api(diretorio, log, requisicoes, concorrencia, semente):
+    porta = porta_livre()
+    ambiente = dict(os.environ, PYTHONPATH=DIR_REPO + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.api:app", "--host", "127.0.0.1", "--port", str(porta),
+         "--log-level", "warning"],
+        cwd=diretorio, env=ambiente, stdout=log, stderr=log
+    )
+    try:
+        esperar_api(porta, processo)
+        rng = random.Random(semente)
+        print(f"-> API em 127.0.0.1:{porta}: {requisicoes} requisições, {concorrencia} clientes...")
+        return carga_api(porta, montar_requisicoes(diretorio, requisicoes, rng), concorrencia)
+    finally:
+        processo.terminate()
+        processo.wait(timeout=10)
+
+def versao_git():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=DIR_REPO,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def comparar(atual, caminho_anterior):
+    """ Imprime a variação de tempo/memória/latência em relação a um JSON anterior """
+    with open(caminho_anterior, "r", encoding="utf-8") as f:
+        anterior = json.load(f)
+
+    def variacao(novo, velho):
+        if novo is None or not velho:
+            return "   n/d"
+        return f"{(novo - velho) / velho * 100:+6.1f}%"
+
+    print(f"\n--- Comparação com {caminho_anterior} ---")
+    for nome, dados in atual["etapas"].items():
+        velho = anterior.get("etapas", {}).get(nome)
+        if velho:
+            print(f"{nome:15s} tempo {variacao(dados['segundos'], velho['segundos'])}  "
+                  f"rss {variacao(dados['rss_pico_mb'], velho['rss_pico_mb'])}")
+    for nome, dados in (atual.get("api") or {}).get("endpoints", {}).items():
+        velho = ((anterior.get("api") or {}).get("endpoints") or {}).get(nome)
+        if velho:
+            print(f"{nome:20s} p50 {variacao(dados['p50_ms'], velho['p50_ms'])}  "
+                  f"p95 {variacao(dados['p95_ms'], velho['p95_ms'])}  p99 {variacao(dados['p99_ms'], velho['p99_ms'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark local das etapas do ETL e da API")
+    parser.add_argument("--escala", choices=list(ESCALAS), default="pequena")
+    parser.add_argument("--operadoras", type=int)
+    parser.add_argument("--linhas", type=int, help="linhas de despesa por trimestre")
+    parser.add_argument("--anos", help="ex: 2019-2024")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--etapas", default=",".join(ETAPAS), help="etapas do ETL a medir")
+    parser.add_argument("--sem-api", action="store_true", help="não mede a API")
+    parser.add_argument("--requisicoes", type=int, default=REQUISICOES)
+    parser.add_argument("--concorrencia", type=int, default=CONCORRENCIA)
+    parser.add_argument("--saida", help="arquivo JSON do resultado (padrão: benchmarks/resultados/<data>.json)")
+    parser.add_argument("--comparar", help="JSON de uma rodada anterior para comparar")
+    parser.add_argument("--manter", action="store_true", help="não apaga o diretório temporário")
+    parser.add_argument("--etapa-filho", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.etapa_filho:
+        executar_etapa_filho(args.etapa_filho)
+        return
+
+    config = dict(ESCALAS[args.escala])
+    for chave in ("operadoras", "linhas", "anos"):
+        if getattr(args, chave):
+            config[chave] = getattr(args, chave)
+
+    diretorio = tempfile.mkdtemp(prefix="bench_intuitive_")
+    os.symlink(os.path.join(DIR_REPO, "sql"), os.path.join(diretorio, "sql"))
+    log = open(os.path.join(diretorio, "benchmark.log"), "w", encoding="utf-8")
+    print(f"--- BENCHMARK ({args.escala}: {config}) em {diretorio} ---")
+
+    resultado = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "commit": versao_git(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": dict(config, semente=args.semente),
+        "etapas": {},
+        "api": None,
+    }
+    try:
+        print("-> Gerando base sintética...", end=" ", flush=True)
+        duracao, _ = rodar(
+            [sys.executable, os.path.join(DIR_SRC, "gerar_mock.py"), "--sintetico",
+             "--operadoras", str(config["operadoras"]), "--linhas", str(config["linhas"]),
+             "--anos", str(config["anos"]), "--semente", str(args.semente)],
+            diretorio, log
+        )
+        resultado["geracao_segundos"] = round(duracao, 3)
+        print(f"{duracao:.1f}s")
+
+        for nome in args.etapas.split(","):
+            resultado["etapas"][nome] = medir_etapa(nome, diretorio, log)
+
+        if not args.sem_api and os.path.exists(os.path.join(diretorio, "intuitive_care.db")):
+            resultado["api"] = medir_api(diretorio, log, args.requisicoes, args.concorrencia, args.semente)
+            for nome, dados in resultado["api"]["endpoints"].items():
+                print(f"   {nome:20s} p50 {dados['p50_ms']:8.2f} ms  p95 {dados['p95_ms']:8.2f} ms  "
+                      f"p99 {dados['p99_ms']:8.2f} ms  hit {dados['cache_hit']:.0%}  erros {dados['erros']}")
+    finally:
+        log.close()
+        if not args.manter:
+            shutil.rmtree(diretorio, ignore_errors=True)
+
+    saida = args.saida or os.path.join(DIR_RESULTADOS, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(saida) or ".", exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Resultado salvo em {saida}")
+
+    if args.comparar:
+        comparar(resultado, args.comparar)
+
+if __name__ == "__main__":
+    main()
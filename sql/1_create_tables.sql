@@ -12,10 +12,89 @@ CREATE TABLE IF NOT EXISTS despesas (
     trimestre TEXT,
     ano INTEGER,
     valor_despesa REAL,
+    valor_centavos INTEGER, -- mesmo valor em centavos inteiros: as somas não acumulam erro de float
     descricao TEXT,
     arquivo_origem TEXT,
     FOREIGN KEY (registro_ans) REFERENCES operadoras(registro_ans)
 );
 
-CREATE INDEX IF NOT EXISTS idx_operadora_uf ON operadoras(uf);
-CREATE INDEX IF NOT EXISTS idx_despesa_ano_tri ON despesas(ano, trimestre);
\ No newline at end of file
+-- Agregados materializados pela carga (banco_de_dados.py), lidos pela API
+CREATE TABLE IF NOT EXISTS resumo_operadora_trimestre (
+    registro_ans INTEGER,
+    ano INTEGER,
+    trimestre TEXT,
+    total REAL,
+    total_centavos INTEGER,
+    qtd INTEGER,
+    PRIMARY KEY (registro_ans, ano, trimestre)
+);
+
+CREATE TABLE IF NOT EXISTS resumo_uf (
+    uf TEXT PRIMARY KEY,
+    total REAL,
+    qtd INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS resumo_geral (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total_geral REAL,
+    media_despesa REAL,
+    qtd INTEGER
+);
+
+-- Pivô dos trimestres de cada operadora/ano (centavos; NULL se não houve despesa no trimestre).
+-- Base do crescimento entre trimestres, sem CASE sobre a tabela despesas inteira.
+CREATE TABLE IF NOT EXISTS resumo_operadora_ano (
+    registro_ans INTEGER,
+    ano INTEGER,
+    centavos_1t INTEGER,
+    centavos_2t INTEGER,
+    centavos_3t INTEGER,
+    centavos_4t INTEGER,
+    PRIMARY KEY (registro_ans, ano)
+);
+
+-- Mercado em cada (ano, trimestre): base das comparações "acima da média"
+CREATE TABLE IF NOT EXISTS resumo_mercado_trimestre (
+    ano INTEGER,
+    trimestre TEXT,
+    total_centavos INTEGER,
+    qtd INTEGER,
+    operadoras INTEGER,
+    media_despesa REAL, -- por lançamento
+    media_operadora REAL, -- total do trimestre / operadoras com despesa no trimestre
+    PRIMARY KEY (ano, trimestre)
+);
+
+-- Cada carga incrementa a geração; a API usa isso para invalidar o cache
+CREATE TABLE IF NOT EXISTS metadados_carga (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    geracao INTEGER,
+    carregado_em TEXT
+);
+
+-- Índice de busca textual das operadoras (FTS5), mantido por triggers.
+-- remove_diacritics ignora acentos; prefix acelera a busca por prefixo (search-as-you-type).
+-- O CNPJ é guardado só com os dígitos.
+CREATE VIRTUAL TABLE IF NOT EXISTS operadoras_busca USING fts5(
+    razao_social,
+    cnpj,
+    registro_ans,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3 4'
+);
+
+CREATE TRIGGER IF NOT EXISTS operadoras_busca_insert AFTER INSERT ON operadoras BEGIN
+    INSERT INTO operadoras_busca (rowid, razao_social, cnpj, registro_ans)
+    VALUES (new.registro_ans, new.razao_social, replace(replace(replace(new.cnpj, '.', ''), '/', ''), '-', ''), new.registro_ans);
+END;
+
+CREATE TRIGGER IF NOT EXISTS operadoras_busca_delete AFTER DELETE ON operadoras BEGIN
+    DELETE FROM operadoras_busca WHERE rowid = old.registro_ans;
+END;
+
+CREATE TRIGGER IF NOT EXISTS operadoras_busca_update AFTER UPDATE ON operadoras BEGIN
+    DELETE FROM operadoras_busca WHERE rowid = old.registro_ans;
+    INSERT INTO operadoras_busca (rowid, razao_social, cnpj, registro_ans)
+    VALUES (new.registro_ans, new.razao_social, replace(replace(replace(new.cnpj, '.', ''), '/', ''), '-', ''), new.registro_ans);
+END;
\ No newline at end of file
@@ -56,4 +56,46 @@ SELECT
 FROM performance p
 JOIN operadoras o ON p.registro_ans = o.registro_ans
 GROUP BY p.registro_ans, o.razao_social
-HAVING qtd_trimestres_acima >= 2;
\ No newline at end of file
+HAVING qtd_trimestres_acima >= 2;
+
+-- ---------------------------------------------------------------------------
+-- As mesmas análises sobre os resumos mantidos pela carga (banco_de_dados.py).
+-- Leem só os resumos (uma linha por operadora/ano ou operadora/trimestre), sem
+-- varrer despesas. A API serve estas versões em /api/analises/*.
+-- ---------------------------------------------------------------------------
+
+-- Crescimento 1T -> 3T (troque as colunas centavos_Nt para outro par de trimestres)
+SELECT
+    o.razao_social,
+    r.centavos_1t / 100.0 as despesa_t1,
+    COALESCE(r.centavos_3t, 0) / 100.0 as despesa_t3,
+    (COALESCE(r.centavos_3t, 0) - r.centavos_1t) * 100.0 / r.centavos_1t as crescimento_percentual
+FROM resumo_operadora_ano r
+JOIN operadoras o ON r.registro_ans = o.registro_ans
+WHERE r.ano = 2023 AND r.centavos_1t > 0
+ORDER BY crescimento_percentual DESC
+LIMIT 5;
+
+-- Distribuição por UF (total, média por despesa e média por operadora)
+SELECT
+    o.uf,
+    SUM(r.total_centavos) / 100.0 as total_despesas,
+    SUM(r.total_centavos) / 100.0 / SUM(r.qtd) as media_por_despesa,
+    SUM(r.total_centavos) / 100.0 / COUNT(DISTINCT r.registro_ans) as media_por_operadora
+FROM resumo_operadora_trimestre r
+JOIN operadoras o ON r.registro_ans = o.registro_ans
+GROUP BY o.uf
+ORDER BY total_despesas DESC
+LIMIT 5;
+
+-- Operadoras acima da média do mercado (por operadora, em cada ano/trimestre) em 2 ou mais trimestres
+SELECT
+    r.registro_ans,
+    o.razao_social,
+    COUNT(*) as qtd_trimestres_acima
+FROM resumo_operadora_trimestre r
+JOIN resumo_mercado_trimestre m ON m.ano = r.ano AND m.trimestre = r.trimestre
+JOIN operadoras o ON r.registro_ans = o.registro_ans
+WHERE r.total_centavos / 100.0 > m.media_operadora
+GROUP BY r.registro_ans, o.razao_social
+HAVING qtd_trimestres_acima >= 2;
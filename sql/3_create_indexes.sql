@@ -0,0 +1,13 @@
+-- Índices criados depois da carga (banco_de_dados.py).
+-- Em cargas grandes os índices de despesas são removidos antes dos INSERTs e recriados aqui no final.
+CREATE INDEX IF NOT EXISTS idx_operadora_uf ON operadoras(uf);
+CREATE INDEX IF NOT EXISTS idx_despesa_ano_tri ON despesas(ano, trimestre);
+-- Índice de cobertura para a listagem/paginação por cursor (razao_social, registro_ans)
+CREATE INDEX IF NOT EXISTS idx_operadora_razao ON operadoras(razao_social, registro_ans, cnpj, uf);
+
+-- Histórico de uma operadora (/api/operadoras/{registro_ans}/despesas): filtra por registro_ans
+-- e já devolve as linhas em ordem de ano/trimestre (o id entra implícito no índice)
+CREATE INDEX IF NOT EXISTS idx_despesa_operadora ON despesas(registro_ans, ano, trimestre);
+
+-- Análises por ano (/api/analises/crescimento) sobre o pivô de trimestres
+CREATE INDEX IF NOT EXISTS idx_resumo_ano ON resumo_operadora_ano(ano);
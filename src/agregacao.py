@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+# Estatísticas "combináveis": cada parcial guarda qtd, soma e m2 (soma dos quadrados
+# dos desvios em relação à média do próprio parcial). Parciais de partições diferentes
+# podem ser juntados sem reler os dados (fórmula de Chan para variância).
+COLUNAS_PARCIAIS = ["qtd", "soma", "m2"]
+
+def agregar_parcial(df, chaves, col_valor):
+    """ Calcula qtd/soma/m2 por grupo para um pedaço dos dados """
+    grupos = df.groupby(chaves, observed=True, dropna=False)[col_valor]
+    parcial = grupos.agg(qtd="count", soma="sum", var="var").reset_index()
+    parcial["m2"] = parcial["var"].fillna(0.0) * (parcial["qtd"] - 1)
+    parcial = parcial[parcial["qtd"] > 0]
+    return parcial[chaves + COLUNAS_PARCIAIS]
+
+def combinar_parciais(parciais, chaves):
+    """ Junta parciais com as mesmas chaves (ou chaves mais grossas) em um único parcial por grupo """
+    parciais = parciais[parciais["qtd"] > 0]
+    grupos = parciais.groupby(chaves, observed=True, dropna=False)
+    media_grupo = grupos["soma"].transform("sum") / grupos["qtd"].transform("sum")
+    desvio = parciais["soma"] / parciais["qtd"] - media_grupo
+    parciais = parciais.assign(m2=parciais["m2"] + parciais["qtd"] * desvio ** 2)
+
+    combinado = parciais.groupby(chaves, observed=True, dropna=False)[COLUNAS_PARCIAIS].sum().reset_index()
+    return combinado
+
+def finalizar(parcial, escala=1):
+    """
+    Converte qtd/soma/m2 em Total_Despesas, Media_Trimestral e Desvio_Padrao (ddof=1, como o pandas).
+    escala: divisor da unidade dos parciais (ex: 100 quando a soma está em centavos).
+    """
+    resultado = parcial.drop(columns=COLUNAS_PARCIAIS)
+    resultado["Total_Despesas"] = parcial["soma"] / escala
+    resultado["Media_Trimestral"] = parcial["soma"] / parcial["qtd"] / escala
+    variancia = parcial["m2"] / (parcial["qtd"] - 1) / escala ** 2
+    resultado["Desvio_Padrao"] = np.sqrt(variancia.where(parcial["qtd"] > 1))
+    return resultado
+
+class AgregadorStreaming:
+    """
+    Estado combinável (qtd/soma/m2 por grupo) alimentado bloco a bloco: só o estado
+    por grupo fica na memória, nunca os dados. O estado de outro agregador (ou um
+    parcial vindo de outro processo) entra com combinar(), pela mesma fórmula de Chan.
+    """
+
+    def __init__(self, chaves, col_valor, juntar_a_cada=16):
+        self.chaves = list(chaves)
+        self.col_valor = col_valor
+        self.juntar_a_cada = juntar_a_cada  # parciais de blocos acumulados antes de compactar
+        self.linhas = 0
+        self._estado = None
+        self._pendentes = []
+
+    def adicionar(self, bloco):
+        if bloco.empty:
+            return
+        self._pendentes.append(agregar_parcial(bloco, self.chaves, self.col_valor))
+        self.linhas += len(bloco)
+        if len(self._pendentes) >= self.juntar_a_cada:
+            self._compactar()
+
+    def combinar(self, outro):
+        """ Junta outro AgregadorStreaming ou um parcial (DataFrame com chaves + qtd/soma/m2) """
+        parcial = outro.parcial() if isinstance(outro, AgregadorStreaming) else outro
+        if not parcial.empty:
+            self._pendentes.append(parcial[self.chaves + COLUNAS_PARCIAIS])
+            self._compactar()
+
+    def _compactar(self):
+        partes = ([self._estado] if self._estado is not None else []) + self._pendentes
+        self._pendentes = []
+        if partes:
+            self._estado = combinar_parciais(pd.concat(partes, ignore_index=True), self.chaves)
+
+    def parcial(self):
+        self._compactar()
+        if self._estado is None:
+            return pd.DataFrame(columns=self.chaves + COLUNAS_PARCIAIS)
+        return self._estado
+
+    def finalizar(self, escala=1):
+        return finalizar(self.parcial(), escala)
@@ -1,16 +1,203 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Body
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager, contextmanager
+import anyio
+import queue
 import sqlite3
 import os
+import re
+import json
+import io
+import csv
+import base64
+import pathlib
+import threading
+from src import cache_http
+from src import metricas
+
+# pyarrow é opcional: sem ele a exportação em Parquet responde 501
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
 
 # configurações
 DB_NAME = "intuitive_care.db"
+ARQUIVO_VERSAO = "intuitive_care.versao"  # gravado pelo banco_de_dados.py a cada carga
+ARQUIVO_SNAPSHOT = "intuitive_care.atual"  # ponteiro para o snapshot publicado pela carga
+POOL_TAMANHO = 8  # conexões abertas no pool (e threads dedicadas ao banco)
+LOTE_STREAMING = 1000  # linhas buscadas por fetchmany nas respostas em streaming
+LOTE_EXPORTACAO = 5000  # linhas por fetchmany (e por row group no Parquet) nas exportações
+MAX_LOTE_OPERADORAS = 5000  # registros por chamada no /api/operadoras/lote
+MEDIR_CONSULTAS = True  # tempo, linhas e plano (scan completo) de cada consulta em /metrics
+
+# PRAGMAs aplicados em cada conexão do pool. A API só lê: query_only impede escrita
+# acidental, mmap_size deixa o SQLite ler as páginas direto do arquivo mapeado.
+PRAGMAS_CONEXAO = {
+    "journal_mode": "WAL",  # leitores não bloqueiam (nem são bloqueados) pela carga
+    "mmap_size": 268435456,  # 256 MB
+    "cache_size": -65536,  # 64 MB por conexão
+    "query_only": 1,
+}
+# Snapshots publicados não mudam nunca: abertos com immutable=1, o SQLite não usa travas
+# nem journal (sem WAL), e vários workers podem ler o mesmo arquivo sem disputa.
+PRAGMAS_SNAPSHOT = {
+    "mmap_size": 268435456,  # 256 MB
+    "cache_size": -65536,  # 64 MB por conexão
+    "query_only": 1,
+}
+
+class PoolConexoes:
+    """
+    Pool fixo de conexões SQLite, criado no lifespan da aplicação. As consultas
+    rodam em threads limitadas ao tamanho do pool (não disputam o threadpool
+    padrão do FastAPI) e cada conexão reaproveita os statements já preparados.
+    """
+
+    def __init__(self, caminho=DB_NAME, tamanho=POOL_TAMANHO, imutavel=False):
+        self.caminho = caminho
+        self.limitador = anyio.CapacityLimiter(tamanho)
+        self._livres = queue.Queue()
+        for _ in range(tamanho):
+            self._livres.put(get_db_connection(caminho, imutavel))
+        # Drenagem na troca de snapshot: cada consulta reserva o pool no mesmo passo do
+        # event loop em que o obteve, e o pool aposentado só fecha as conexões quando a
+        # última reserva é liberada. Quem já estava na fila termina no snapshot antigo.
+        self._trava = threading.Lock()
+        self._reservas = 0
+        self._aposentado = False
+
+    def _reservar(self):
+        with self._trava:
+            self._reservas += 1
+
+    def _liberar(self):
+        with self._trava:
+            self._reservas -= 1
+            if self._aposentado and self._reservas == 0:
+                self._fechar_livres()
+
+    def _fechar_livres(self):
+        while not self._livres.empty():
+            self._livres.get_nowait().close()
+
+    @contextmanager
+    def conexao(self):
+        conn = self._livres.get()
+        try:
+            yield conn
+        finally:
+            self._livres.put(conn)
+
+    async def executar(self, funcao, *args):
+        """ Roda funcao(conn, *args) numa thread do banco, sem travar o event loop """
+        def rodar():
+            with self.conexao() as conn:
+                return funcao(conn, *args)
+        self._reservar()
+        try:
+            return await anyio.to_thread.run_sync(rodar, limiter=self.limitador)
+        finally:
+            self._liberar()
+
+    def transmitir(self, funcao, *args):
+        """
+        Para respostas em streaming: funcao(conn, *args) devolve um gerador de pedaços
+        de texto. A conexão fica reservada até o gerador acabar (ou o cliente desconectar)
+        e cada pedaço é produzido numa thread do banco.
+        """
+        self._reservar()  # já na chamada: o gerador só começa a rodar depois que o endpoint retorna
+        return self._transmitir(funcao, args)
+
+    async def _transmitir(self, funcao, args):
+        try:
+            conn = await anyio.to_thread.run_sync(self._livres.get, limiter=self.limitador)
+            gerador = funcao(conn, *args)
+            try:
+                while True:
+                    # fora do limitador: quem já tem conexão precisa sempre conseguir avançar,
+                    # senão as threads paradas esperando conexão travam os streams (deadlock)
+                    pedaco = await anyio.to_thread.run_sync(next, gerador, None)
+                    if pedaco is None:
+                        break
+                    yield pedaco
+            finally:
+                gerador.close()
+                self._livres.put(conn)
+        finally:
+            self._liberar()
+
+    def fechar(self):
+        """ Aposenta o pool: as conexões são fechadas assim que não houver consulta usando o pool """
+        with self._trava:
+            self._aposentado = True
+            if self._reservas == 0:
+                self._fechar_livres()
+
+_pool = None
+_ponteiro = {"marca": None, "caminho": None}
+
+def snapshot_publicado(ponteiro=ARQUIVO_SNAPSHOT):
+    """
+    Caminho do snapshot publicado pela última carga, ou None se ainda não houver
+    (aí a API lê o DB_NAME direto). Um stat por chamada; o ponteiro só é relido quando
+    muda (o os.replace da carga sempre troca o inode).
+    """
+    try:
+        info = os.stat(ponteiro)
+    except FileNotFoundError:
+        return None
+    marca = (info.st_ino, info.st_mtime_ns, info.st_size)
+    if marca != _ponteiro["marca"]:
+        with open(ponteiro, "r", encoding="utf-8") as f:
+            nome = f.read().strip()
+        _ponteiro.update(marca=marca, caminho=os.path.join(os.path.dirname(ponteiro), nome))
+    return _ponteiro["caminho"]
+
+def criar_pool():
+    snapshot = snapshot_publicado()
+    return PoolConexoes(snapshot or DB_NAME, imutavel=snapshot is not None)
+
+@asynccontextmanager
+async def lifespan(app):
+    global _pool
+    _pool = criar_pool()
+    yield
+    _pool.fechar()
+    _pool = None
+
+def obter_pool():
+    """
+    Pool do snapshot publicado. Roda no event loop a cada consulta: quando a carga
+    publica um snapshot novo, a requisição seguinte já abre um pool nele e o antigo é
+    drenado (as consultas em andamento terminam no snapshot antigo).
+    """
+    global _pool
+    if _pool is None:
+        # app usado sem lifespan (ex: TestClient sem "with"): cria o pool na primeira consulta
+        _pool = criar_pool()
+    elif _pool.caminho != (snapshot_publicado() or DB_NAME):
+        antigo, _pool = _pool, criar_pool()
+        antigo.fechar()
+    return _pool
+
+async def executar_no_banco(funcao, *args):
+    return await obter_pool().executar(funcao, *args)
+
 app = FastAPI(
     title="API Intuitive Care - Teste Nicolas",
     description="API para consulta de despesas de operadoras de saúde.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# cache de respostas (ETag/304, gzip/brotli), invalidado quando a carga grava uma nova versão.
+# Fica por dentro do CORS para que as respostas vindas do cache também recebam os cabeçalhos.
+app.add_middleware(cache_http.CacheRespostas, arquivo_versao=ARQUIVO_VERSAO)
+
 # configuração de CORS 
 # Sem isso, o navegador bloqueia a conexão do Frontend com o Backend.
 app.add_middleware(
@@ -21,56 +208,202 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+# tempo de cada requisição por rota (histograma em /metrics). Por fora de tudo, para contar
+# também o tempo do cache e do CORS.
+app.add_middleware(metricas.MedirRequisicoes, rotas=app.routes)
+
+def get_db_connection(caminho=DB_NAME, imutavel=False):
+    # check_same_thread=False: a conexão é usada por threads diferentes do pool (uma por vez)
+    fabrica = metricas.ConexaoMedida if MEDIR_CONSULTAS else sqlite3.Connection
+    pragmas = PRAGMAS_CONEXAO
+    if imutavel:
+        # snapshot: somente leitura, sem travas nem checagem de alterações de outros processos
+        caminho = pathlib.Path(os.path.abspath(caminho)).as_uri() + "?mode=ro&immutable=1"
+        pragmas = PRAGMAS_SNAPSHOT
+    conn = sqlite3.connect(caminho, check_same_thread=False, cached_statements=256, factory=fabrica, uri=imutavel)
     conn.row_factory = sqlite3.Row # Isso permite acessar colunas pelo nome (ex: row['nome'])
+    for nome, valor in pragmas.items():
+        conn.execute(f"PRAGMA {nome} = {valor}")
     return conn
 
+def geracao_carga(cursor):
+    # a geração muda a cada carga do banco_de_dados.py; usada para invalidar caches
+    linha = cursor.execute("SELECT geracao FROM metadados_carga WHERE id = 1").fetchone()
+    return linha[0] if linha else None
+
 @app.get("/")
 def read_root():
     return {"message": "API Online! Acesse /docs para ver a documentação."}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def exportar_metricas():
+    # formato texto do Prometheus; cada worker do uvicorn responde com as próprias métricas
+    return PlainTextResponse(metricas.REGISTRO.exportar(), media_type="text/plain; version=0.0.4")
+
+def montar_busca_fts(busca):
+    """
+    Converte o texto digitado em uma consulta FTS5: cada palavra vira um prefixo
+    ("unim"* "bel"*), todos obrigatórios. CNPJ com pontuação vira só dígitos.
+    """
+    if re.fullmatch(r"[\d.\-/\s]+", busca):
+        termos = [re.sub(r"\D", "", busca)]
+    else:
+        termos = re.findall(r"\w+", busca)
+    return " ".join(f'"{t}"*' for t in termos if t)
+
+def codificar_cursor(*chave):
+    # cursor opaco: base64 da última chave da página (ex: razao_social, registro_ans)
+    bruto = json.dumps(list(chave), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(bruto).decode("ascii")
+
+def decodificar_cursor(cursor, tipos):
+    """ Devolve a chave do cursor convertida com `tipos` (ex: (str, int)); cursor malformado -> 400 """
+    try:
+        chave = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(chave, list) or len(chave) != len(tipos):
+            raise ValueError
+        return tuple(tipo(valor) for tipo, valor in zip(tipos, chave))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+# total de operadoras por termo de busca, válido enquanto a geração da carga não mudar
+_cache_totais = {}
+MAX_CACHE_TOTAIS = 1024
+
+def contar_operadoras(cursor, consulta_fts):
+    chave = (geracao_carga(cursor), consulta_fts)
+    if chave not in _cache_totais:
+        if len(_cache_totais) >= MAX_CACHE_TOTAIS:
+            _cache_totais.clear()
+        if consulta_fts:
+            total = cursor.execute(
+                "SELECT COUNT(*) FROM operadoras_busca WHERE operadoras_busca MATCH ?", (consulta_fts,)
+            ).fetchone()[0]
+        else:
+            total = cursor.execute("SELECT COUNT(*) FROM operadoras").fetchone()[0]
+        _cache_totais[chave] = total
+    return _cache_totais[chave]
+
 # listar operadoras
 @app.get("/api/operadoras")
-def listar_operadoras(
-    busca: str = Query(None, description="Buscar por Razão Social"),
+async def listar_operadoras(
+    busca: str = Query(None, description="Buscar por Razão Social, CNPJ ou Registro ANS (prefixo, sem acento)"),
     page: int = Query(1, ge=1, description="Número da página"),
-    limit: int = Query(10, ge=1, le=100, description="Itens por página")
+    limit: int = Query(10, ge=1, le=100, description="Itens por página"),
+    cursor: str = Query(None, description="Cursor devolvido em next_cursor (paginação por cursor; ignora page)"),
+    incluir_total: bool = Query(False, description="Inclui o total de operadoras e de páginas")
 ):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # lógica de Paginação (OFFSET)
-    offset = (page - 1) * limit
-    
-    # Query Base
-    query = "SELECT registro_ans, cnpj, razao_social, uf FROM operadoras"
-    params = []
-    
-    # se tiver busca, adiciona o filtro WHERE
-    if busca:
-        query += " WHERE razao_social LIKE ?"
-        params.append(f"%{busca}%") # % serve para buscar em qualquer parte do texto
-    
-    # ordenação e paginação
-    query += " ORDER BY razao_social LIMIT ? OFFSET ?"
-    params.extend([limit, offset])
+    return await executar_no_banco(consultar_operadoras, busca, page, limit, cursor, incluir_total)
+
+def consultar_operadoras(conn, busca, page, limit, cursor, incluir_total):
+    db = conn.cursor()
     
-    operadoras = cursor.execute(query, params).fetchall()
-    conn.close()
+    consulta_fts = montar_busca_fts(busca) if busca else ""
+
+    if consulta_fts:
+        # busca pelo índice FTS5, ordenada por relevância (bm25); o nome desempata
+        query = """
+            SELECT o.registro_ans, o.cnpj, o.razao_social, o.uf, b.rank AS relevancia
+            FROM operadoras_busca b
+            JOIN operadoras o ON o.registro_ans = b.rowid
+            WHERE operadoras_busca MATCH ?
+        """
+        params = [consulta_fts]
+        if cursor:
+            # keyset na mesma ordem: o bm25 é determinístico enquanto a carga não muda
+            query += " AND (b.rank, o.razao_social, o.registro_ans) > (?, ?, ?)"
+            params.extend(decodificar_cursor(cursor, (float, str, int)))
+        query += " ORDER BY b.rank, o.razao_social, o.registro_ans LIMIT ?"
+        params.append(limit)
+        if not cursor:
+            query += " OFFSET ?"
+            params.append((page - 1) * limit)
+    elif cursor:
+        # paginação por cursor (keyset): continua depois da última chave, em ordem de nome
+        ultima_razao, ultimo_registro = decodificar_cursor(cursor, (str, int))
+        query = """
+            SELECT registro_ans, cnpj, razao_social, uf FROM operadoras
+            WHERE (razao_social, registro_ans) > (?, ?)
+            ORDER BY razao_social, registro_ans LIMIT ?
+        """
+        params = [ultima_razao, ultimo_registro, limit]
+    else:
+        # lógica de Paginação (OFFSET)
+        query = """
+            SELECT registro_ans, cnpj, razao_social, uf FROM operadoras
+            ORDER BY razao_social, registro_ans LIMIT ? OFFSET ?
+        """
+        params = [limit, (page - 1) * limit]
     
-    return {
-        "data": [dict(op) for op in operadoras],
+    operadoras = [dict(op) for op in db.execute(query, params).fetchall()]
+    relevancias = [op.pop("relevancia", None) for op in operadoras]
+
+    resposta = {
+        "data": operadoras,
         "page": page,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": None
+    }
+    # o cursor leva a chave de ordenação da última linha: (relevância,) razao_social, registro_ans
+    if len(operadoras) == limit:
+        ultima = operadoras[-1]
+        chave = (ultima["razao_social"], ultima["registro_ans"])
+        if consulta_fts:
+            chave = (relevancias[-1],) + chave
+        resposta["next_cursor"] = codificar_cursor(*chave)
+
+    if incluir_total:
+        total = contar_operadoras(db, consulta_fts)
+        resposta["total"] = total
+        resposta["total_paginas"] = (total + limit - 1) // limit
+
+    return resposta
+
+# várias operadoras de uma vez (sincronizações): uma consulta só, com os registros
+# passados como JSON para o json_each, em vez de uma requisição por operadora
+@app.post("/api/operadoras/lote")
+async def operadoras_em_lote(
+    registros: list[int] = Body(..., embed=True, min_length=1, max_length=MAX_LOTE_OPERADORAS),
+    incluir_totais: bool = Body(False, embed=True, description="Inclui total e qtd de despesas de cada operadora")
+):
+    return await executar_no_banco(consultar_lote, registros, incluir_totais)
+
+def consultar_lote(conn, registros, incluir_totais):
+    chaves = json.dumps(sorted(set(registros)))
+    if incluir_totais:
+        query = """
+            SELECT o.*, COALESCE(t.total, 0) AS total_despesas, COALESCE(t.qtd, 0) AS qtd_despesas
+            FROM operadoras o
+            LEFT JOIN (
+                SELECT registro_ans, SUM(total_centavos) / 100.0 AS total, SUM(qtd) AS qtd
+                FROM resumo_operadora_trimestre
+                WHERE registro_ans IN (SELECT value FROM json_each(?1))
+                GROUP BY registro_ans
+            ) t ON t.registro_ans = o.registro_ans
+            WHERE o.registro_ans IN (SELECT value FROM json_each(?1))
+            ORDER BY o.registro_ans
+        """
+    else:
+        query = """
+            SELECT * FROM operadoras
+            WHERE registro_ans IN (SELECT value FROM json_each(?1))
+            ORDER BY registro_ans
+        """
+    operadoras = [dict(op) for op in conn.execute(query, (chaves,)).fetchall()]
+    encontrados = {op["registro_ans"] for op in operadoras}
+    return {
+        "data": operadoras,
+        "nao_encontrados": [r for r in sorted(set(registros)) if r not in encontrados],
     }
 
 # detalhes da operadora
 # banco usa registro_ans como chave principal.
 # buscar pelo registro_ans que é mais seguro.
 @app.get("/api/operadoras/{registro_ans}")
-def detalhes_operadora(registro_ans: int):
-    conn = get_db_connection()
+async def detalhes_operadora(registro_ans: int):
+    return await executar_no_banco(consultar_operadora, registro_ans)
+
+def consultar_operadora(conn, registro_ans):
     cursor = conn.cursor()
     
     operadora = cursor.execute(
@@ -78,68 +411,418 @@ def detalhes_operadora(registro_ans: int):
         (registro_ans,)
     ).fetchone()
     
-    conn.close()
-    
     if operadora is None:
         raise HTTPException(status_code=404, detail="Operadora não encontrada")
         
     return dict(operadora)
 
 # histórico de despesas
+# Usa o índice idx_despesa_operadora (registro_ans, ano, trimestre): a consulta vai direto
+# nas linhas da operadora, já na ordem pedida. A resposta é gerada em streaming, em lotes
+# de LOTE_STREAMING linhas, sem montar a lista inteira na memória.
 @app.get("/api/operadoras/{registro_ans}/despesas")
-def listar_despesas(registro_ans: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # verifica se a operadora existe primeiro
-    operadora = cursor.execute("SELECT razao_social FROM operadoras WHERE registro_ans = ?", (registro_ans,)).fetchone()
+async def listar_despesas(
+    registro_ans: int,
+    ano_inicio: int = Query(None, description="Ano inicial (inclusive)"),
+    ano_fim: int = Query(None, description="Ano final (inclusive)"),
+    trimestre: str = Query(None, pattern="^[1-4]T$", description="Somente este trimestre (ex: 1T)"),
+    limit: int = Query(None, ge=1, le=10000, description="Itens por página (sem limit, devolve tudo)"),
+    cursor: str = Query(None, description="Cursor devolvido em next_cursor"),
+    formato: str = Query("json", pattern="^(json|ndjson)$", description="json (padrão) ou ndjson (uma despesa por linha)")
+):
+    # valida antes de começar o streaming: depois disso não dá mais para responder 404/400
+    razao_social = await executar_no_banco(razao_social_operadora, registro_ans)
+    chave_cursor = decodificar_cursor(cursor, (int, str, int)) if cursor else None
+    filtros = (ano_inicio, ano_fim, trimestre, chave_cursor)
+
+    tipo = "application/x-ndjson" if formato == "ndjson" else "application/json"
+    return StreamingResponse(
+        obter_pool().transmitir(gerar_despesas, registro_ans, razao_social, filtros, limit, formato),
+        media_type=tipo
+    )
+
+def razao_social_operadora(conn, registro_ans):
+    operadora = conn.execute("SELECT razao_social FROM operadoras WHERE registro_ans = ?", (registro_ans,)).fetchone()
     if not operadora:
-        conn.close()
         raise HTTPException(status_code=404, detail="Operadora não encontrada")
+    return operadora["razao_social"]
 
-    despesas = cursor.execute(
-        """
-        SELECT ano, trimestre, valor_despesa, descricao 
-        FROM despesas 
-        WHERE registro_ans = ? 
-        ORDER BY ano DESC, trimestre DESC
-        """, 
-        (registro_ans,)
-    ).fetchall()
-    
-    conn.close()
-    
-    return {
-        "operadora": operadora['razao_social'],
-        "despesas": [dict(d) for d in despesas]
-    }
+def consulta_despesas(registro_ans, filtros, limit):
+    ano_inicio, ano_fim, trimestre, chave_cursor = filtros
+    query = "SELECT id, ano, trimestre, valor_despesa, descricao FROM despesas WHERE registro_ans = ?"
+    params = [registro_ans]
+    if ano_inicio is not None:
+        query += " AND ano >= ?"
+        params.append(ano_inicio)
+    if ano_fim is not None:
+        query += " AND ano <= ?"
+        params.append(ano_fim)
+    if trimestre:
+        query += " AND trimestre = ?"
+        params.append(trimestre)
+    if chave_cursor:
+        # keyset: continua depois da última (ano, trimestre, id) enviada, em ordem decrescente
+        query += " AND (ano, trimestre, id) < (?, ?, ?)"
+        params.extend(chave_cursor)
+    query += " ORDER BY ano DESC, trimestre DESC, id DESC"
+    if limit:
+        # uma linha a mais só para saber se existe próxima página
+        query += " LIMIT ?"
+        params.append(limit + 1)
+    return query, params
+
+def gerar_despesas(conn, registro_ans, razao_social, filtros, limit, formato):
+    """ Gera a resposta em pedaços: JSON {"operadora", "despesas", "next_cursor"} ou NDJSON """
+    query, params = consulta_despesas(registro_ans, filtros, limit)
+    db = conn.execute(query, params)
+    ndjson = formato == "ndjson"
+    enviadas = 0
+    ultima = None
+    tem_mais = False
+
+    if not ndjson:
+        yield '{"operadora": ' + json.dumps(razao_social, ensure_ascii=False) + ', "despesas": ['
+
+    try:
+        while not tem_mais:
+            linhas = db.fetchmany(LOTE_STREAMING)
+            if not linhas:
+                break
+            partes = []
+            for linha in linhas:
+                if limit and enviadas == limit:
+                    tem_mais = True
+                    break
+                despesa = {
+                    "ano": linha["ano"],
+                    "trimestre": linha["trimestre"],
+                    "valor_despesa": linha["valor_despesa"],
+                    "descricao": linha["descricao"],
+                }
+                partes.append(json.dumps(despesa, ensure_ascii=False))
+                ultima = linha
+                enviadas += 1
+            if partes:
+                if ndjson:
+                    yield "\n".join(partes) + "\n"
+                else:
+                    yield ("," if enviadas > len(partes) else "") + ",".join(partes)
+    finally:
+        db.close()
+
+    next_cursor = codificar_cursor(ultima["ano"], ultima["trimestre"], ultima["id"]) if tem_mais else None
+    if ndjson:
+        # no NDJSON o cursor da próxima página vem numa última linha separada
+        if next_cursor:
+            yield json.dumps({"next_cursor": next_cursor}) + "\n"
+    else:
+        yield '], "next_cursor": ' + json.dumps(next_cursor) + "}"
 
 # estatísticas agregadas
+# Os números vêm das tabelas de resumo calculadas na carga (banco_de_dados.py).
+# O resultado fica em cache até a geração da carga mudar.
+_cache_estatisticas = {"geracao": None, "dados": None}
+
 @app.get("/api/estatisticas")
-def obter_estatisticas():
-    conn = get_db_connection()
+async def obter_estatisticas():
+    return await executar_no_banco(consultar_estatisticas)
+
+def consultar_estatisticas(conn):
     cursor = conn.cursor()
+
+    geracao = geracao_carga(cursor)
+    if geracao is not None and _cache_estatisticas["geracao"] == geracao:
+        return _cache_estatisticas["dados"]
     
-    # Query 1: Total Geral
-    total = cursor.execute("SELECT SUM(valor_despesa) FROM despesas").fetchone()[0]
-    
-    # Query 2: Média por Trimestre
-    media = cursor.execute("SELECT AVG(valor_despesa) FROM despesas").fetchone()[0]
+    # Total Geral e Média por despesa
+    resumo = cursor.execute("SELECT total_geral, media_despesa FROM resumo_geral WHERE id = 1").fetchone()
+    total, media = (resumo["total_geral"], resumo["media_despesa"]) if resumo else (None, None)
     
-    # Query 3: Top 5 Estados mais caros
+    # Top 5 Estados mais caros
     top_estados = cursor.execute("""
-        SELECT o.uf, SUM(d.valor_despesa) as total
-        FROM despesas d
-        JOIN operadoras o ON d.registro_ans = o.registro_ans
-        GROUP BY o.uf
+        SELECT uf, total
+        FROM resumo_uf
         ORDER BY total DESC
         LIMIT 5
     """).fetchall()
     
-    conn.close()
-    
-    return {
+    dados = {
         "total_geral": total,
         "media_despesa": media,
         "top_estados": [dict(e) for e in top_estados]
-    }
\ No newline at end of file
+    }
+    _cache_estatisticas.update(geracao=geracao, dados=dados)
+    return dados
+
+# análises (sql/2_queries_analiticas.sql) servidas a partir dos resumos calculados na carga:
+# o pivô de trimestres (resumo_operadora_ano) e as médias do mercado (resumo_mercado_trimestre)
+TRIMESTRES = ("1T", "2T", "3T", "4T")
+COLUNA_TRIMESTRE = {t: f"centavos_{t.lower()}" for t in TRIMESTRES}
+PADRAO_TRIMESTRE = "^[1-4]T$"
+
+@app.get("/api/analises/crescimento")
+async def analise_crescimento(
+    ano: int = Query(None, description="Ano analisado (padrão: o mais recente carregado)"),
+    trimestre_inicio: str = Query("1T", pattern=PADRAO_TRIMESTRE),
+    trimestre_fim: str = Query("3T", pattern=PADRAO_TRIMESTRE),
+    limit: int = Query(5, ge=1, le=100, description="Quantidade de operadoras (top N)")
+):
+    if trimestre_inicio == trimestre_fim:
+        raise HTTPException(status_code=400, detail="Informe dois trimestres diferentes")
+    return await executar_no_banco(consultar_crescimento, ano, trimestre_inicio, trimestre_fim, limit)
+
+def consultar_crescimento(conn, ano, trimestre_inicio, trimestre_fim, limit):
+    if ano is None:
+        ano = conn.execute("SELECT MAX(ano) FROM resumo_operadora_ano").fetchone()[0]
+
+    # as colunas vêm do dicionário fixo, nunca do texto da requisição
+    inicio, fim = COLUNA_TRIMESTRE[trimestre_inicio], COLUNA_TRIMESTRE[trimestre_fim]
+    # como na query original, trimestre final sem despesa conta como zero
+    linhas = conn.execute(
+        f"""
+        SELECT r.registro_ans, o.razao_social, o.uf,
+               r.{inicio} / 100.0 AS despesa_inicio,
+               COALESCE(r.{fim}, 0) / 100.0 AS despesa_fim,
+               (COALESCE(r.{fim}, 0) - r.{inicio}) * 100.0 / r.{inicio} AS crescimento_percentual
+        FROM resumo_operadora_ano r
+        JOIN operadoras o ON o.registro_ans = r.registro_ans
+        WHERE r.ano = ? AND r.{inicio} > 0
+        ORDER BY crescimento_percentual DESC, r.registro_ans
+        LIMIT ?
+        """,
+        (ano, limit)
+    ).fetchall()
+    return {
+        "ano": ano,
+        "trimestre_inicio": trimestre_inicio,
+        "trimestre_fim": trimestre_fim,
+        "data": [dict(l) for l in linhas],
+    }
+
+@app.get("/api/analises/ufs")
+async def analise_ufs(
+    ano: int = Query(None, description="Ano analisado (padrão: todos)"),
+    limit: int = Query(5, ge=1, le=100, description="Quantidade de UFs (top N por total)")
+):
+    return await executar_no_banco(consultar_ufs, ano, limit)
+
+def consultar_ufs(conn, ano, limit):
+    filtro = "WHERE r.ano = ?" if ano is not None else ""
+    params = [ano] if ano is not None else []
+    linhas = conn.execute(
+        f"""
+        SELECT o.uf,
+               SUM(r.total_centavos) / 100.0 AS total_despesas,
+               SUM(r.qtd) AS qtd_despesas,
+               SUM(r.total_centavos) / 100.0 / NULLIF(SUM(r.qtd), 0) AS media_por_despesa,
+               COUNT(DISTINCT r.registro_ans) AS operadoras,
+               SUM(r.total_centavos) / 100.0 / COUNT(DISTINCT r.registro_ans) AS media_por_operadora
+        FROM resumo_operadora_trimestre r
+        JOIN operadoras o ON o.registro_ans = r.registro_ans
+        {filtro}
+        GROUP BY o.uf
+        ORDER BY total_despesas DESC
+        LIMIT ?
+        """,
+        params + [limit]
+    ).fetchall()
+    return {"ano": ano, "data": [dict(l) for l in linhas]}
+
+@app.get("/api/analises/acima-media")
+async def analise_acima_media(
+    ano: int = Query(None, description="Ano analisado (padrão: todos)"),
+    min_trimestres: int = Query(2, ge=1, description="Mínimo de trimestres acima da média do mercado"),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    return await executar_no_banco(consultar_acima_media, ano, min_trimestres, limit)
+
+def consultar_acima_media(conn, ano, min_trimestres, limit):
+    """
+    Operadoras cujo total no trimestre ficou acima da média do mercado (total do
+    trimestre / operadoras com despesa) em pelo menos `min_trimestres` trimestres.
+    """
+    filtro = "AND r.ano = ?" if ano is not None else ""
+    params = [ano] if ano is not None else []
+    linhas = conn.execute(
+        f"""
+        SELECT r.registro_ans, o.razao_social, o.uf, COUNT(*) AS qtd_trimestres_acima
+        FROM resumo_operadora_trimestre r
+        JOIN resumo_mercado_trimestre m ON m.ano = r.ano AND m.trimestre = r.trimestre
+        JOIN operadoras o ON o.registro_ans = r.registro_ans
+        WHERE r.total_centavos / 100.0 > m.media_operadora {filtro}
+        GROUP BY r.registro_ans
+        HAVING COUNT(*) >= ?
+        ORDER BY qtd_trimestres_acima DESC, o.razao_social
+        LIMIT ?
+        """,
+        params + [min_trimestres, limit]
+    ).fetchall()
+    return {"ano": ano, "min_trimestres": min_trimestres, "data": [dict(l) for l in linhas]}
+
+# exportação completa em streaming (CSV, NDJSON ou Parquet), para sincronizações que hoje
+# paginam /api/operadoras. Cada tabela exportável tem o SELECT fixo, o tipo de cada coluna
+# (esquema do Parquet) e os filtros aceitos. A leitura é por fetchmany(LOTE_EXPORTACAO),
+# então a memória não cresce com o tamanho da tabela.
+EXPORTACOES = {
+    "operadoras": {
+        "sql": "SELECT registro_ans, cnpj, razao_social, uf, modalidade FROM operadoras",
+        "ordem": "registro_ans",
+        "colunas": {"registro_ans": int, "cnpj": str, "razao_social": str, "uf": str, "modalidade": str},
+        "filtros": (),
+    },
+    "despesas": {
+        "sql": "SELECT id, registro_ans, ano, trimestre, valor_despesa, valor_centavos, descricao, arquivo_origem FROM despesas",
+        "ordem": "id",
+        # com filtro, ordena pela chave do índice filtrado (idx_despesa_operadora / idx_despesa_ano_tri);
+        # em ordem de id o SQLite varreria a tabela inteira
+        "ordem_por_filtro": (
+            ("registro_ans", "registro_ans, ano, trimestre, id"),
+            ("ano", "ano, trimestre, id"),
+            ("trimestre", "ano, trimestre, id"),
+        ),
+        "colunas": {"id": int, "registro_ans": int, "ano": int, "trimestre": str, "valor_despesa": float,
+                    "valor_centavos": int, "descricao": str, "arquivo_origem": str},
+        "filtros": ("ano", "trimestre", "registro_ans"),
+    },
+    "resumo_operadora_trimestre": {
+        "sql": "SELECT registro_ans, ano, trimestre, total, total_centavos, qtd FROM resumo_operadora_trimestre",
+        "ordem": "registro_ans, ano, trimestre",
+        "colunas": {"registro_ans": int, "ano": int, "trimestre": str, "total": float, "total_centavos": int, "qtd": int},
+        "filtros": ("ano", "trimestre", "registro_ans"),
+    },
+    "resumo_operadora_ano": {
+        "sql": "SELECT registro_ans, ano, centavos_1t, centavos_2t, centavos_3t, centavos_4t FROM resumo_operadora_ano",
+        "ordem": "registro_ans, ano",
+        "colunas": {"registro_ans": int, "ano": int, "centavos_1t": int, "centavos_2t": int,
+                    "centavos_3t": int, "centavos_4t": int},
+        "filtros": ("ano", "registro_ans"),
+    },
+    "resumo_mercado_trimestre": {
+        "sql": "SELECT ano, trimestre, total_centavos, qtd, operadoras, media_despesa, media_operadora FROM resumo_mercado_trimestre",
+        "ordem": "ano, trimestre",
+        "colunas": {"ano": int, "trimestre": str, "total_centavos": int, "qtd": int, "operadoras": int,
+                    "media_despesa": float, "media_operadora": float},
+        "filtros": ("ano", "trimestre"),
+    },
+    "resumo_uf": {
+        "sql": "SELECT uf, total, qtd FROM resumo_uf",
+        "ordem": "uf",
+        "colunas": {"uf": str, "total": float, "qtd": int},
+        "filtros": (),
+    },
+}
+TIPOS_EXPORTACAO = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+@app.get("/api/exportar/{tabela}")
+async def exportar_tabela(
+    tabela: str,
+    formato: str = Query("csv", pattern="^(csv|ndjson|parquet)$"),
+    ano: int = Query(None, description="Filtra pelo ano (tabelas com ano)"),
+    trimestre: str = Query(None, pattern=PADRAO_TRIMESTRE, description="Filtra pelo trimestre (tabelas com trimestre)"),
+    registro_ans: int = Query(None, description="Filtra pela operadora (tabelas com registro_ans)")
+):
+    # valida antes de começar o streaming: depois disso não dá mais para responder 4xx
+    exportacao = EXPORTACOES.get(tabela)
+    if exportacao is None:
+        raise HTTPException(status_code=404, detail=f"Tabela não exportável. Opções: {', '.join(EXPORTACOES)}")
+    if formato == "parquet" and pa is None:
+        raise HTTPException(status_code=501, detail="Exportação em Parquet indisponível (pyarrow não instalado)")
+
+    filtros = {"ano": ano, "trimestre": trimestre, "registro_ans": registro_ans}
+    filtros = {nome: valor for nome, valor in filtros.items() if valor is not None}
+    invalidos = [nome for nome in filtros if nome not in exportacao["filtros"]]
+    if invalidos:
+        raise HTTPException(status_code=400, detail=f"Filtro não disponível para {tabela}: {', '.join(invalidos)}")
+
+    return StreamingResponse(
+        obter_pool().transmitir(gerar_exportacao, exportacao, filtros, formato),
+        media_type=TIPOS_EXPORTACAO[formato],
+        headers={"Content-Disposition": f'attachment; filename="{tabela}.{formato}"'}
+    )
+
+def consulta_exportacao(exportacao, filtros):
+    # os nomes dos filtros já foram conferidos com a lista da tabela; os valores vão como parâmetros
+    query = exportacao["sql"]
+    if filtros:
+        query += " WHERE " + " AND ".join(f"{nome} = ?" for nome in filtros)
+    ordem = next((o for filtro, o in exportacao.get("ordem_por_filtro", ()) if filtro in filtros), exportacao["ordem"])
+    query += f" ORDER BY {ordem}"
+    return query, list(filtros.values())
+
+class _SaidaEmPedacos:
+    """
+    Arquivo só de escrita para o ParquetWriter: guarda o que foi escrito até alguém
+    retirar. O tell() continua contando desde o início, que é o que o rodapé do
+    Parquet precisa para apontar os row groups.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._partes = []
+        self._posicao = 0
+
+    def write(self, dados):
+        dados = bytes(dados)
+        self._partes.append(dados)
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self._posicao
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def retirar(self):
+        dados = b"".join(self._partes)
+        self._partes.clear()
+        return dados
+
+def gerar_exportacao(conn, exportacao, filtros, formato):
+    """ Gera a exportação em pedaços (texto no CSV/NDJSON, bytes no Parquet), um por lote """
+    query, params = consulta_exportacao(exportacao, filtros)
+    colunas = list(exportacao["colunas"])
+    db = conn.execute(query, params)
+
+    if formato == "parquet":
+        tipos = {int: pa.int64(), float: pa.float64(), str: pa.string()}
+        esquema = pa.schema([(nome, tipos[tipo]) for nome, tipo in exportacao["colunas"].items()])
+        saida = _SaidaEmPedacos()
+        escritor = pq.ParquetWriter(saida, esquema, compression="zstd")
+    elif formato == "csv":
+        texto = io.StringIO()
+        escritor = csv.writer(texto, delimiter=";", lineterminator="\n")
+        escritor.writerow(colunas)
+
+    try:
+        while True:
+            linhas = db.fetchmany(LOTE_EXPORTACAO)
+            if not linhas:
+                break
+            if formato == "parquet":
+                dados = {nome: [linha[i] for linha in linhas] for i, nome in enumerate(colunas)}
+                escritor.write_table(pa.table(dados, schema=esquema))
+                yield saida.retirar()
+            elif formato == "csv":
+                escritor.writerows(tuple(linha) for linha in linhas)
+                yield texto.getvalue()
+                texto.seek(0)
+                texto.truncate()
+            else:
+                yield "".join(json.dumps(dict(linha), ensure_ascii=False) + "\n" for linha in linhas)
+    finally:
+        db.close()
+
+    if formato == "parquet":
+        escritor.close()  # grava o rodapé (também para tabela vazia: Parquet válido, sem linhas)
+        yield saida.retirar()
+    elif formato == "csv" and texto.tell():
+        yield texto.getvalue()  # só o cabeçalho, quando não há linhas
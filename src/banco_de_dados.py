@@ -1,103 +1,469 @@
 import sqlite3
 import pandas as pd
 import os
+import json
+import glob
+from datetime import datetime
+from itertools import islice
+import intermediario
+import particoes
+import valores
+import esquema
+import metricas
 
 # configurações
 DB_NAME = "intuitive_care.db"
+ARQUIVO_VERSAO = "intuitive_care.versao"  # marca de versão lida pelo cache HTTP da API
+ARQUIVO_SNAPSHOT = "intuitive_care.atual"  # ponteiro para o snapshot publicado, lido pela API
+DIR_SNAPSHOTS = "snapshots"
+MANTER_SNAPSHOTS = 2  # o publicado e o anterior (workers da API ainda podem estar terminando consultas nele)
 DIR_SQL = "sql"
 DIR_PROCESSED = "dados_processados"
 DIR_RAW = "dados_brutos"
+COLUNAS_DESPESAS = ['registro_ans', 'trimestre', 'ano', 'valor_despesa', 'valor_centavos', 'descricao', 'arquivo_origem']
+TAMANHO_LOTE = 100_000  # linhas por executemany
+FRACAO_RECRIAR_INDICES = 0.2  # se a carga for maior que 20% da tabela, recria os índices no final
+
+# PRAGMAs usados durante a carga. synchronous=OFF troca durabilidade por velocidade:
+# se a máquina cair no meio, o banco é refeito a partir de dados_processados.
+PRAGMAS_CARGA = {
+    "journal_mode": "WAL",
+    "synchronous": "OFF",
+    "cache_size": -262144,  # 256 MB
+    "temp_store": "MEMORY",
+}
+PRAGMAS_POS_CARGA = {
+    "synchronous": "NORMAL",
+}
 
 def executar_script_sql(conn, arquivo_sql):
     with open(arquivo_sql, 'r', encoding='utf-8') as f:
         script = f.read()
         conn.executescript(script)
 
-def encontrar_coluna_inteligente(df, possiveis_nomes):
-    # busca coluna por palavra chave
-    colunas_map = {c.upper().strip(): c for c in df.columns}
-    for nome_upper in colunas_map:
-        for chave in possiveis_nomes:
-            if chave in nome_upper:
-                return colunas_map[nome_upper]
-    return None
+def esquema_declarado(conn):
+    """
+    Versões antigas da carga usavam to_sql(if_exists='replace'), que recriava as tabelas
+    sem PK, FK e índices. Nesse caso o banco não serve para carga incremental.
+    Bancos anteriores às colunas em centavos também são recriados.
+    """
+    cols_ops = {r[1]: r[5] for r in conn.execute("PRAGMA table_info(operadoras)")}
+    cols_desp = [r[1] for r in conn.execute("PRAGMA table_info(despesas)")]
+    cols_resumo = [r[1] for r in conn.execute("PRAGMA table_info(resumo_operadora_trimestre)")]
+    ops_ok = not cols_ops or cols_ops.get('registro_ans') == 1
+    desp_ok = not cols_desp or ('id' in cols_desp and 'valor_centavos' in cols_desp)
+    resumo_ok = not cols_resumo or 'total_centavos' in cols_resumo
+    return ops_ok and desp_ok and resumo_ok
 
-def main():
+def _linhas_sql(df):
+    # converte NA/NaN para None e tipos numpy para tipos nativos do Python
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+def importar_operadoras(conn, df_ops=None):
+    """
+    Upsert do cadastro: operadoras novas entram, as existentes são atualizadas. Sem
+    df_ops (cadastro já lido pelo pipeline.py), lê o Relatorio_Cadop.csv.
+    """
+    if df_ops is None:
+        caminho_ops = os.path.join(DIR_RAW, "Relatorio_Cadop.csv")
+        # separador, encoding e colunas canônicas resolvidos pelo esquema.py (mesmo mapeamento da transformação)
+        df_ops = esquema.ler_csv(caminho_ops, "cadastro")
+
+    if not {'REGISTRO_ANS', 'RAZAO_SOCIAL'}.issubset(df_ops.columns):
+        print("ERRO: Colunas não encontradas no arquivo de operadoras.")
+        return
+
+    df_ops_db = pd.DataFrame()
+    df_ops_db['registro_ans'] = pd.to_numeric(df_ops['REGISTRO_ANS'], errors='coerce').astype('Int64')
+    df_ops_db['cnpj'] = df_ops.get('CNPJ', '000000') 
+    df_ops_db['razao_social'] = df_ops['RAZAO_SOCIAL']
+    df_ops_db['uf'] = df_ops.get('UF', 'ND')
+    df_ops_db['modalidade'] = df_ops.get('MODALIDADE', 'Desconhecida')
+    df_ops_db = df_ops_db.dropna(subset=['registro_ans']).drop_duplicates('registro_ans', keep='last')
+
+    with conn:
+        conn.execute("BEGIN")  # DROP/CREATE INDEX também ficam dentro da transação
+        remover_indices(conn, "operadoras")
+        conn.executemany(
+            """
+            INSERT INTO operadoras (registro_ans, cnpj, razao_social, uf, modalidade)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(registro_ans) DO UPDATE SET
+                cnpj = excluded.cnpj,
+                razao_social = excluded.razao_social,
+                uf = excluded.uf,
+                modalidade = excluded.modalidade
+            """,
+            _linhas_sql(df_ops_db)
+        )
+        criar_indices(conn)
+        sincronizar_busca(conn)
+    print(f"-> Operadoras importadas: {len(df_ops_db)}")
+
+def sincronizar_busca(conn):
+    """
+    Os triggers mantêm operadoras_busca em dia. Se o índice foi criado depois das
+    operadoras (banco antigo) ou ficou para trás, reconstrói a partir da tabela.
+    """
+    qtd_ops = conn.execute("SELECT COUNT(*) FROM operadoras").fetchone()[0]
+    qtd_busca = conn.execute("SELECT COUNT(*) FROM operadoras_busca").fetchone()[0]
+    if qtd_ops == qtd_busca:
+        return
+    conn.execute("DELETE FROM operadoras_busca")
+    conn.execute("""
+        INSERT INTO operadoras_busca (rowid, razao_social, cnpj, registro_ans)
+        SELECT registro_ans, razao_social, replace(replace(replace(cnpj, '.', ''), '/', ''), '-', ''), registro_ans
+        FROM operadoras
+    """)
+    print(f"-> Índice de busca reconstruído: {qtd_ops} operadoras")
+
+def preparar_despesas(df_desp):
+    """ Consolidado (esquema fixo) -> colunas da tabela despesas """
+    df_desp_db = pd.DataFrame()
+    df_desp_db['registro_ans'] = df_desp['REGISTRO_ANS']
+    # Se não tiver ano/trimestre, define padrão 2023 / '1T' para não quebrar
+    df_desp_db['trimestre'] = df_desp['TRIMESTRE'].fillna('1T')
+    df_desp_db['ano'] = df_desp['ANO'].fillna(2023)
+    df_desp_db['valor_despesa'] = df_desp['VALOR']
+    df_desp_db['valor_centavos'] = valores.para_centavos(df_desp['VALOR'])
+    df_desp_db['descricao'] = df_desp['DESCRICAO'].fillna('DESPESA ASSISTENCIAL')
+    df_desp_db['arquivo_origem'] = df_desp['ARQUIVO_ORIGEM']
+    return df_desp_db
+
+def aplicar_pragmas(conn, pragmas):
+    for nome, valor in pragmas.items():
+        conn.execute(f"PRAGMA {nome} = {valor}")
+
+def carregar_em_massa(conn, tabela, colunas, linhas, lote=TAMANHO_LOTE):
+    """
+    Insere as linhas (iterável de tuplas) na tabela já declarada, com executemany em
+    lotes. Não faz commit: a transação é de quem chama. Devolve quantas linhas entraram.
+    """
+    sql = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})"
+    linhas = iter(linhas)
+    total = 0
+    while True:
+        bloco = list(islice(linhas, lote))
+        if not bloco:
+            return total
+        conn.executemany(sql, bloco)
+        total += len(bloco)
+
+def remover_indices(conn, tabela):
+    """ Remove os índices secundários da tabela (recriados depois por 3_create_indexes.sql) """
+    nomes = [
+        r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (tabela,)
+        )
+    ]
+    for nome in nomes:
+        conn.execute(f"DROP INDEX IF EXISTS {nome}")
+    return nomes
+
+def criar_indices(conn):
+    with open(os.path.join(DIR_SQL, "3_create_indexes.sql"), 'r', encoding='utf-8') as f:
+        for comando in f.read().split(';'):
+            if comando.strip():
+                conn.execute(comando)
+
+def _linhas_particao(ano, trimestre):
+    # lê a partição em blocos para não segurar tudo na memória
+    caminho = particoes.caminho_particao(ano, trimestre)
+    colunas = ["REGISTRO_ANS", "ANO", "TRIMESTRE", "DESCRICAO", "VALOR", "ARQUIVO_ORIGEM"]
+    for bloco in intermediario.ler_consolidado_em_blocos(colunas, caminho, TAMANHO_LOTE):
+        yield from _linhas_sql(preparar_despesas(bloco)[COLUNAS_DESPESAS])
+
+def sincronizar_despesas(conn, controle_etl):
+    """
+    Carga incremental: as partições (ano, trimestre) cujo hash mudou desde a última
+    carga têm só as suas linhas apagadas e reinseridas, numa única transação.
+    Partições carregadas que saíram da consolidação (trimestre removido das fontes)
+    têm as linhas apagadas e o registro removido na mesma transação. Partições iguais
+    não são tocadas. Quando a carga é grande em relação ao que já está no banco, os
+    índices de despesas são removidos e recriados no final.
+    """
+    consolidadas = particoes.listar(controle_etl, "consolidacao")
+    alteradas = []
+    for p in consolidadas:
+        registro = particoes.obter(conn, "carga", p["ano"], p["trimestre"])
+        if registro and registro["hash"] == p["hash"]:
+            print(f"-> Partição {p['trimestre']}/{p['ano']} já carregada, pulando.")
+            continue
+        alteradas.append(p)
+
+    periodos = {(p["ano"], p["trimestre"]) for p in consolidadas}
+    removidas = [p for p in particoes.listar(conn, "carga") if (p["ano"], p["trimestre"]) not in periodos]
+
+    if not alteradas and not removidas:
+        return 0
+
+    existentes = conn.execute("SELECT COUNT(*) FROM despesas").fetchone()[0]
+    novas = sum(p["linhas"] for p in alteradas)
+    reconstruir = novas > existentes * FRACAO_RECRIAR_INDICES
+
+    total = 0
+    with conn:
+        conn.execute("BEGIN")  # DROP/CREATE INDEX também ficam dentro da transação
+        if reconstruir:
+            print("-> Carga grande: índices de despesas serão recriados depois dos INSERTs.")
+            remover_indices(conn, "despesas")
+
+        chaves = json.dumps([[p["ano"], p["trimestre"]] for p in alteradas + removidas])
+        conn.execute(
+            """
+            DELETE FROM despesas
+            WHERE (ano, trimestre) IN (
+                SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+            )
+            """,
+            (chaves,)
+        )
+
+        for p in removidas:
+            particoes.remover(conn, "carga", p["ano"], p["trimestre"])
+            print(f"-> Partição {p['trimestre']}/{p['ano']} saiu da consolidação: {p['linhas']} despesas removidas")
+
+        for p in alteradas:
+            ano, trimestre = p["ano"], p["trimestre"]
+            with metricas.medir_etapa("carga.particao", ano=ano, trimestre=trimestre) as info:
+                linhas = 0
+                if p["linhas"]:
+                    linhas = carregar_em_massa(conn, "despesas", COLUNAS_DESPESAS, _linhas_particao(ano, trimestre))
+                info["linhas"] = linhas
+            particoes.registrar(conn, "carga", ano, trimestre, p["hash"], linhas)
+            print(f"-> Partição {trimestre}/{ano} carregada: {linhas} despesas")
+            total += linhas
+
+        with metricas.medir_etapa("carga.indices", recriados=reconstruir):
+            criar_indices(conn)
+        atualizar_resumo_operadora_trimestre(conn, chaves)
+    return total
+
+def atualizar_resumo_operadora_trimestre(conn, chaves=None):
+    """
+    Recalcula o resumo por (registro_ans, ano, trimestre) só das partições informadas
+    (JSON [[ano, trimestre], ...]); sem chaves, recalcula tudo.
+    """
+    filtro = ""
+    params = ()
+    if chaves is not None:
+        filtro = """
+            WHERE (ano, trimestre) IN (
+                SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+            )
+        """
+        params = (chaves,)
+
+    conn.execute(f"DELETE FROM resumo_operadora_trimestre {filtro}", params)
+    conn.execute(
+        f"""
+        INSERT INTO resumo_operadora_trimestre (registro_ans, ano, trimestre, total, total_centavos, qtd)
+        SELECT registro_ans, ano, trimestre, SUM(valor_centavos) / 100.0, SUM(valor_centavos), COUNT(valor_centavos)
+        FROM despesas
+        {filtro}
+        GROUP BY registro_ans, ano, trimestre
+        """,
+        params
+    )
+
+def atualizar_resumos(conn):
+    """
+    Recalcula os resumos globais a partir do resumo por operadora/trimestre (que é
+    pequeno) e incrementa a geração da carga. Não faz commit.
+    """
+    conn.execute("DELETE FROM resumo_uf")
+    conn.execute("""
+        INSERT INTO resumo_uf (uf, total, qtd)
+        SELECT o.uf, SUM(r.total_centavos) / 100.0, SUM(r.qtd)
+        FROM resumo_operadora_trimestre r
+        JOIN operadoras o ON r.registro_ans = o.registro_ans
+        GROUP BY o.uf
+    """)
+
+    conn.execute("DELETE FROM resumo_geral")
+    conn.execute("""
+        INSERT INTO resumo_geral (id, total_geral, media_despesa, qtd)
+        SELECT 1, SUM(total_centavos) / 100.0, SUM(total_centavos) / 100.0 / NULLIF(SUM(qtd), 0), SUM(qtd)
+        FROM resumo_operadora_trimestre
+    """)
+
+    atualizar_resumos_analiticos(conn)
+
+    conn.execute("""
+        INSERT INTO metadados_carga (id, geracao, carregado_em)
+        VALUES (1, 1, datetime('now'))
+        ON CONFLICT(id) DO UPDATE SET
+            geracao = geracao + 1,
+            carregado_em = excluded.carregado_em
+    """)
+
+def atualizar_resumos_analiticos(conn):
+    """
+    Pivô de trimestres por operadora/ano e médias do mercado por (ano, trimestre),
+    usados pelas análises da API (sql/2_queries_analiticas.sql). Saem do resumo por
+    operadora/trimestre, então custam pouco mesmo refeitos inteiros a cada carga.
+    """
+    conn.execute("DELETE FROM resumo_operadora_ano")
+    conn.execute("""
+        INSERT INTO resumo_operadora_ano (registro_ans, ano, centavos_1t, centavos_2t, centavos_3t, centavos_4t)
+        SELECT
+            registro_ans,
+            ano,
+            SUM(CASE WHEN trimestre = '1T' THEN total_centavos END),
+            SUM(CASE WHEN trimestre = '2T' THEN total_centavos END),
+            SUM(CASE WHEN trimestre = '3T' THEN total_centavos END),
+            SUM(CASE WHEN trimestre = '4T' THEN total_centavos END)
+        FROM resumo_operadora_trimestre
+        GROUP BY registro_ans, ano
+    """)
+
+    conn.execute("DELETE FROM resumo_mercado_trimestre")
+    conn.execute("""
+        INSERT INTO resumo_mercado_trimestre (ano, trimestre, total_centavos, qtd, operadoras, media_despesa, media_operadora)
+        SELECT
+            ano,
+            trimestre,
+            SUM(total_centavos),
+            SUM(qtd),
+            COUNT(*),
+            SUM(total_centavos) / 100.0 / NULLIF(SUM(qtd), 0),
+            SUM(total_centavos) / 100.0 / COUNT(*)
+        FROM resumo_operadora_trimestre
+        WHERE qtd > 0
+        GROUP BY ano, trimestre
+    """)
+
+def _gravar_atomico(caminho, texto):
+    # quem lê vê o arquivo antigo ou o novo inteiro, nunca um pela metade
+    temporario = caminho + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        f.write(texto)
+    os.replace(temporario, caminho)
+
+def gravar_versao(geracao, caminho=ARQUIVO_VERSAO):
+    """ Grava a geração da carga num arquivo pequeno; a API invalida o cache de respostas quando ele muda """
+    _gravar_atomico(caminho, f"{geracao}\n")
+
+def snapshot_publicado(ponteiro=ARQUIVO_SNAPSHOT):
+    """ Caminho do snapshot apontado pelo ponteiro (None se nenhuma carga publicou ainda) """
+    try:
+        with open(ponteiro, "r", encoding="utf-8") as f:
+            nome = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(os.path.dirname(ponteiro), nome)
+
+def publicar_snapshot(conn, geracao, dir_snapshots=DIR_SNAPSHOTS, ponteiro=ARQUIVO_SNAPSHOT,
+                      manter=MANTER_SNAPSHOTS):
+    """
+    Copia o banco da carga para um snapshot novo e o publica trocando o ponteiro.
+    O VACUUM INTO grava o arquivo compactado, com os índices e as estatísticas do
+    ANALYZE, e em modo rollback (sem WAL), pronto para ser aberto como imutável.
+    A API só abre snapshots publicados: nunca vê uma carga pela metade nem disputa
+    trava com ela. Devolve o caminho do snapshot.
+    """
+    os.makedirs(dir_snapshots, exist_ok=True)
+    nome = f"intuitive_care_{geracao:06d}_{datetime.now():%Y%m%d%H%M%S}.db"
+    destino = os.path.join(dir_snapshots, nome)
+    temporario = destino + ".tmp"
+    if os.path.exists(temporario):
+        os.remove(temporario)
+
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.execute("VACUUM INTO ?", (temporario,))
+    with open(temporario, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(temporario, destino)
+
+    # o ponteiro guarda o caminho relativo à pasta dele
+    _gravar_atomico(ponteiro, os.path.relpath(destino, os.path.dirname(os.path.abspath(ponteiro))) + "\n")
+    remover_snapshots_antigos(dir_snapshots, destino, manter)
+    return destino
+
+def remover_snapshots_antigos(dir_snapshots, publicado, manter=MANTER_SNAPSHOTS):
+    antigos = sorted(glob.glob(os.path.join(dir_snapshots, "intuitive_care_*.db")))
+    for caminho in antigos[:-manter] if manter else antigos:
+        if os.path.abspath(caminho) == os.path.abspath(publicado):
+            continue
+        try:
+            os.remove(caminho)
+        except OSError as e:
+            # no Windows, arquivo aberto por algum worker não pode ser apagado: fica para a próxima carga
+            print(f"-> Snapshot antigo {caminho} ainda em uso: {e}")
+
+def carregar_banco(df_ops=None):
+    """
+    Atualiza o intuitive_care.db (banco de trabalho da carga, incremental) e publica
+    um snapshot dele para a API. Devolve a geração publicada, ou None se alguma etapa
+    falhar: aí nada é publicado e a API continua no snapshot anterior.
+    """
     print("--- INICIANDO BANCO DE DADOS (NICOLAS) ---")
+    geracao = None
+    falhas = []  # etapas com erro; qualquer uma impede a publicação
     
     # Conexão
     conn = sqlite3.connect(DB_NAME)
+    aplicar_pragmas(conn, PRAGMAS_CARGA)
     print(f"Banco '{DB_NAME}' conectado.")
 
     # Criar Tabelas
     print("Criando tabelas...")
     try:
+        if not esquema_declarado(conn):
+            print("Tabelas sem o esquema declarado (carga antiga). Recriando...")
+            conn.executescript(
+                "DROP TABLE IF EXISTS despesas; DROP TABLE IF EXISTS operadoras; "
+                "DROP TABLE IF EXISTS controle_particoes; DROP TABLE IF EXISTS operadoras_busca; "
+                "DROP TABLE IF EXISTS resumo_operadora_trimestre;"
+            )
         executar_script_sql(conn, os.path.join(DIR_SQL, "1_create_tables.sql"))
+        particoes.garantir_tabela(conn)
+        criar_indices(conn)
+        conn.commit()
     except Exception as e:
         print(f"Erro ao criar tabelas: {e}")
-        return
+        return None
 
     # Importar Dados
     print("Importando dados...")
     
     # Importar Operadoras (Mock ou Real)
     try:
-        caminho_ops = os.path.join(DIR_RAW, "Relatorio_Cadop.csv")
-        df_ops = pd.read_csv(caminho_ops, sep=';', encoding='latin1')
-        if df_ops.shape[1] < 2: df_ops = pd.read_csv(caminho_ops, sep=',', encoding='latin1')
-        
-        # Mapeamento Inteligente
-        col_reg = encontrar_coluna_inteligente(df_ops, ["REG", "CD_OPS"])
-        col_nome = encontrar_coluna_inteligente(df_ops, ["RAZAO", "NOME", "DENOMINACAO"])
-        col_uf = encontrar_coluna_inteligente(df_ops, ["UF", "ESTADO"])
-
-        if col_reg and col_nome:
-            df_ops_db = pd.DataFrame()
-            df_ops_db['registro_ans'] = df_ops[col_reg]
-            df_ops_db['razao_social'] = df_ops[col_nome]
-            df_ops_db['uf'] = df_ops[col_uf] if col_uf else 'ND'
-            df_ops_db['cnpj'] = df_ops.get('CNPJ', '000000') 
-            df_ops_db['modalidade'] = df_ops.get('Modalidade', 'Desconhecida')
-
-            df_ops_db.to_sql('operadoras', conn, if_exists='replace', index=False)
-            print(f"-> Operadoras importadas: {len(df_ops_db)}")
-        else:
-            print("ERRO: Colunas não encontradas no arquivo de operadoras.")
-
+        with metricas.medir_etapa("carga.operadoras"):
+            importar_operadoras(conn, df_ops)
     except Exception as e:
         print(f"Erro ao importar operadoras: {e}")
+        falhas.append("operadoras")
 
-    # Importar Despesas
+    # Importar Despesas (só as partições novas ou alteradas)
     try:
-        caminho_desp = os.path.join(DIR_PROCESSED, "consolidado_despesas.csv")
-        df_desp = pd.read_csv(caminho_desp, sep=';', decimal=',')
-        
-        c_reg = encontrar_coluna_inteligente(df_desp, ["REG", "CD_OPS"])
-        c_val = encontrar_coluna_inteligente(df_desp, ["VALOR", "SALDO", "DESPESA"])
-        c_ano = encontrar_coluna_inteligente(df_desp, ["ANO"])
-        
-        if c_reg and c_val:
-            df_desp_db = pd.DataFrame()
-            df_desp_db['registro_ans'] = df_desp[c_reg]
-            df_desp_db['valor_despesa'] = df_desp[c_val]
-            df_desp_db['ano'] = df_desp[c_ano] if c_ano else 2023
-            
-            # Se não tiver trimestre, define padrão '1T' para não quebrar
-            c_tri = encontrar_coluna_inteligente(df_desp, ["TRIMESTRE", "TRI"])
-            if c_tri:
-                df_desp_db['trimestre'] = df_desp[c_tri]
-            else:
-                df_desp_db['trimestre'] = '1T'
-
-            df_desp_db['descricao'] = 'DESPESA ASSISTENCIAL'
-            
-            df_desp_db.to_sql('despesas', conn, if_exists='replace', index=False)
-            print(f"-> Despesas importadas: {len(df_desp_db)}")
-        else:
-            print(f"ERRO CRÍTICO: Não achei colunas REG ou VALOR. Colunas disponíveis: {df_desp.columns.tolist()}")
-
+        controle_etl = particoes.abrir_controle()
+        with metricas.medir_etapa("carga.despesas") as info:
+            total = sincronizar_despesas(conn, controle_etl)
+            info["linhas"] = total
+        controle_etl.close()
+        print(f"-> Despesas importadas: {total}")
     except Exception as e:
         print(f"Erro ao importar despesas: {e}")
+        falhas.append("despesas")
+
+    # Agregados materializados para a API. Com alguma importação falhando, nem a
+    # geração avança: os resumos são refeitos por inteiro na próxima carga.
+    if not falhas:
+        try:
+            with conn, metricas.medir_etapa("carga.resumos"):
+                vazio = conn.execute("SELECT 1 FROM resumo_operadora_trimestre LIMIT 1").fetchone() is None
+                if vazio:
+                    # banco carregado antes de existirem os resumos: calcula tudo uma vez
+                    atualizar_resumo_operadora_trimestre(conn)
+                atualizar_resumos(conn)
+            geracao = conn.execute("SELECT geracao FROM metadados_carga WHERE id = 1").fetchone()[0]
+            print(f"-> Resumos atualizados (geração {geracao})")
+        except Exception as e:
+            print(f"Erro ao atualizar resumos: {e}")
+            falhas.append("resumos")
 
     # Teste Rápido
     print("\n--- RESULTADO FINAL (TOP 5) ---")
@@ -115,8 +481,32 @@ def main():
     except Exception as e:
         print(f"Erro na query de teste: {e}")
 
+    aplicar_pragmas(conn, PRAGMAS_POS_CARGA)
+
+    # Publicação: só com a carga completa (todas as etapas ok). O ponteiro troca antes da
+    # versão, então quando o cache da API é limpo os workers já abrem o snapshot novo.
+    if not falhas:
+        try:
+            with metricas.medir_etapa("carga.snapshot", geracao=geracao) as info:
+                snapshot = publicar_snapshot(conn, geracao)
+                info["bytes"] = os.path.getsize(snapshot)
+            gravar_versao(geracao)
+            print(f"-> Snapshot publicado: {snapshot}")
+        except Exception as e:
+            print(f"Erro ao publicar o snapshot: {e}")
+            falhas.append("snapshot")
     conn.close()
+
+    if falhas:
+        print(f"\n❌ CARGA INCOMPLETA ({', '.join(falhas)}): nada foi publicado, a API continua no snapshot anterior.")
+        return None
     print("\n✅ BANCO DE DADOS PRONTO!")
+    return geracao
+
+def main():
+    # cadastro + carga pelo pipeline.py (o cadastro é lido uma vez e passado em memória)
+    import pipeline
+    pipeline.rodar_script(["cadastro", "carga"], dependencias=False, forcar=True, mock=False)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
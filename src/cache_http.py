@@ -0,0 +1,270 @@
+import os
+import gzip
+import time
+import zlib
+import hashlib
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+
+import anyio
+
+# brotli é opcional: sem ele as respostas saem só em gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# configurações
+CACHE_MAX_BYTES = 64 * 1024 * 1024  # memória total do cache (corpos + versões comprimidas)
+CACHE_MAX_ITEM = 4 * 1024 * 1024  # respostas maiores passam direto, sem cache (comprimidas em streaming)
+CACHE_TTL = 300  # segundos; vale mesmo se a marca de versão não mudar
+TAMANHO_MIN_COMPRESSAO = 1024  # bytes; abaixo disso comprimir não compensa
+NIVEL_GZIP = 6
+QUALIDADE_BROTLI = 5
+
+def normalizar_query(query_string):
+    # ?b=2&a=1 e ?a=1&b=2 viram a mesma chave
+    return urlencode(sorted(parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)))
+
+def codificacoes_aceitas(valor):
+    """ Codificações do Accept-Encoding, ignorando as marcadas com q=0 """
+    aceitas = set()
+    for parte in valor.split(","):
+        nome, _, parametros = parte.strip().partition(";")
+        if parametros.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if nome:
+            aceitas.add(nome.strip().lower())
+    return aceitas
+
+def escolher_codificacao(aceitas, disponiveis):
+    return next((c for c in ("br", "gzip") if c in disponiveis and c in aceitas), "identity")
+
+def comprimir(corpo, codificacao):
+    if codificacao == "br":
+        return brotli.compress(corpo, quality=QUALIDADE_BROTLI)
+    return gzip.compress(corpo, compresslevel=NIVEL_GZIP, mtime=0)
+
+class CompressorFluxo:
+    """ Comprime pedaço a pedaço as respostas que são grandes demais para o cache """
+
+    def __init__(self, codificacao):
+        self.codificacao = codificacao
+        if codificacao == "br":
+            self._compressor = brotli.Compressor(quality=QUALIDADE_BROTLI)
+        else:
+            self._compressor = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 31)  # 31 = cabeçalho gzip
+
+    def comprimir(self, dados, fim):
+        # cada pedaço sai com flush: o cliente recebe as linhas conforme a consulta avança
+        if self.codificacao == "br":
+            saida = self._compressor.process(dados)
+            return saida + (self._compressor.finish() if fim else self._compressor.flush())
+        saida = self._compressor.compress(dados)
+        return saida + self._compressor.flush(zlib.Z_FINISH if fim else zlib.Z_SYNC_FLUSH)
+
+class CacheRespostas:
+    """
+    Middleware ASGI que guarda as respostas GET da API em um LRU limitado por bytes.
+    Uma entrada vale até CACHE_TTL segundos ou até o arquivo de versão gravado pela
+    carga (banco_de_dados.py) mudar. Cada resposta sai com ETag forte (If-None-Match
+    devolve 304) e, se o cliente aceitar, comprimida em brotli ou gzip. Cada codificação
+    é gerada só quando algum cliente a pede, numa thread, e fica guardada na entrada.
+    """
+
+    def __init__(self, app, arquivo_versao, prefixos=("/api/",), max_bytes=CACHE_MAX_BYTES,
+                 max_item=CACHE_MAX_ITEM, ttl=CACHE_TTL):
+        self.app = app
+        self.arquivo_versao = arquivo_versao
+        self.prefixos = tuple(prefixos)
+        self.max_bytes = max_bytes
+        self.max_item = max_item
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._versao = None
+        self._marca_versao = None
+
+    def versao_dados(self):
+        # só relê o arquivo quando mtime/tamanho mudam; um stat por requisição
+        try:
+            info = os.stat(self.arquivo_versao)
+        except FileNotFoundError:
+            marca, versao = None, None
+        else:
+            marca = (info.st_mtime_ns, info.st_size)
+            versao = self._versao
+            if marca != self._marca_versao:
+                with open(self.arquivo_versao, "r", encoding="utf-8") as f:
+                    versao = f.read().strip()
+
+        if marca != self._marca_versao:
+            if versao != self._versao:
+                self.limpar()
+            self._versao, self._marca_versao = versao, marca
+        return self._versao
+
+    def limpar(self):
+        self._itens.clear()
+        self._bytes = 0
+
+    def _obter(self, chave):
+        item = self._itens.get(chave)
+        if item is None:
+            return None
+        if item["expira"] < time.monotonic():
+            self._remover(chave)
+            return None
+        self._itens.move_to_end(chave)
+        return item
+
+    def _remover(self, chave):
+        item = self._itens.pop(chave)
+        self._bytes -= item["tamanho"]
+
+    def _guardar(self, chave, inicio, corpo):
+        cabecalhos = [
+            (nome, valor) for nome, valor in inicio.get("headers", [])
+            if nome.lower() not in (b"content-length", b"content-encoding", b"etag")
+        ]
+        codificacoes = ["identity"]
+        if len(corpo) >= TAMANHO_MIN_COMPRESSAO:
+            codificacoes.append("gzip")
+            if brotli is not None:
+                codificacoes.append("br")
+
+        item = {
+            "status": inicio["status"],
+            "cabecalhos": cabecalhos,
+            "codificacoes": tuple(codificacoes),
+            "corpos": {"identity": corpo},  # versões comprimidas entram quando pedidas
+            "etag": hashlib.blake2b(corpo, digest_size=16).hexdigest(),
+            "expira": time.monotonic() + self.ttl,
+            "tamanho": len(corpo),
+        }
+        if item["tamanho"] <= self.max_bytes:
+            if chave in self._itens:
+                self._remover(chave)
+            self._itens[chave] = item
+            self._bytes += item["tamanho"]
+            while self._bytes > self.max_bytes:
+                self._remover(next(iter(self._itens)))
+        return item
+
+    async def _corpo_codificado(self, chave, item, codificacao):
+        corpo = item["corpos"].get(codificacao)
+        if corpo is not None:
+            return corpo
+        # comprimir vários MB trava o event loop: vai para uma thread
+        corpo = await anyio.to_thread.run_sync(comprimir, item["corpos"]["identity"], codificacao)
+        if codificacao in item["corpos"]:
+            return item["corpos"][codificacao]  # outra requisição comprimiu enquanto esta esperava
+        item["corpos"][codificacao] = corpo
+        item["tamanho"] += len(corpo)
+        if self._itens.get(chave) is item:
+            self._bytes += len(corpo)
+            while self._bytes > self.max_bytes:
+                self._remover(next(iter(self._itens)))
+        return corpo
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or not scope["path"].startswith(self.prefixos):
+            await self.app(scope, receive, send)
+            return
+
+        cabecalhos = {nome.decode("latin-1").lower(): valor.decode("latin-1") for nome, valor in scope["headers"]}
+        aceitas = codificacoes_aceitas(cabecalhos.get("accept-encoding", ""))
+        chave = (scope["path"], normalizar_query(scope["query_string"]))
+        self.versao_dados()
+
+        item = self._obter(chave)
+        origem = b"HIT"
+        if item is None:
+            origem = b"MISS"
+            item = await self._executar(scope, receive, send, chave, aceitas)
+            if item is None:
+                return  # resposta não cacheável, já enviada
+        await self._responder(chave, item, cabecalhos, aceitas, send, origem)
+
+    async def _executar(self, scope, receive, send, chave, aceitas):
+        """
+        Roda a aplicação guardando a resposta. Erros são repassados direto; respostas
+        grandes também, mas comprimidas em streaming se o cliente aceitar
+        """
+        estado = {"inicio": None, "partes": [], "tamanho": 0, "repassando": False, "compressor": None}
+
+        async def repassar(corpo, mais):
+            compressor = estado["compressor"]
+            if compressor is not None:
+                corpo = await anyio.to_thread.run_sync(compressor.comprimir, corpo, not mais)
+                if not corpo and mais:
+                    return  # o compressor ainda não tem bytes para soltar
+            await send({"type": "http.response.body", "body": corpo, "more_body": mais})
+
+        async def capturar(mensagem):
+            if mensagem["type"] == "http.response.start":
+                estado["inicio"] = mensagem
+                if mensagem["status"] != 200:
+                    estado["repassando"] = True
+                    await send(mensagem)
+                return
+            if estado["repassando"]:
+                if estado["compressor"] is None:
+                    await send(mensagem)
+                else:
+                    await repassar(mensagem.get("body", b""), mensagem.get("more_body", False))
+                return
+
+            estado["partes"].append(mensagem.get("body", b""))
+            estado["tamanho"] += len(estado["partes"][-1])
+            if estado["tamanho"] > self.max_item:
+                # grande demais para o cache (ex: exportação, histórico longo): segue em streaming
+                estado["repassando"] = True
+                inicio = estado["inicio"]
+                headers = list(inicio.get("headers", []))
+                codificacao = escolher_codificacao(aceitas, ("gzip", "br") if brotli is not None else ("gzip",))
+                ja_codificada = any(nome.lower() == b"content-encoding" for nome, _ in headers)
+                if codificacao != "identity" and not ja_codificada:
+                    estado["compressor"] = CompressorFluxo(codificacao)
+                    headers = [(nome, valor) for nome, valor in headers if nome.lower() != b"content-length"]
+                    headers += [
+                        (b"content-encoding", codificacao.encode("latin-1")),
+                        (b"vary", b"Accept-Encoding"),
+                    ]
+                    inicio = dict(inicio, headers=headers)
+                await send(inicio)
+                await repassar(b"".join(estado["partes"]), mensagem.get("more_body", False))
+                estado["partes"].clear()
+
+        await self.app(scope, receive, capturar)
+        if estado["repassando"] or estado["inicio"] is None:
+            return None
+        return self._guardar(chave, estado["inicio"], b"".join(estado["partes"]))
+
+    async def _responder(self, chave, item, cabecalhos, aceitas, send, origem):
+        codificacao = escolher_codificacao(aceitas, item["codificacoes"])
+
+        # ETag forte: cada codificação é uma representação diferente
+        sufixos = {"identity": "", "gzip": "-gzip", "br": "-br"}
+        etags = {f'"{item["etag"]}{sufixos[c]}"' for c in item["codificacoes"]}
+        etag = f'"{item["etag"]}{sufixos[codificacao]}"'
+
+        extras = [
+            (b"etag", etag.encode("latin-1")),
+            (b"vary", b"Accept-Encoding"),
+            (b"cache-control", b"no-cache"),  # o navegador guarda, mas sempre revalida com If-None-Match
+            (b"x-cache", origem),
+        ]
+
+        pedidas = {e.strip().removeprefix("W/") for e in cabecalhos.get("if-none-match", "").split(",")}
+        if "*" in pedidas or pedidas & etags:
+            await send({"type": "http.response.start", "status": 304, "headers": extras})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        corpo = await self._corpo_codificado(chave, item, codificacao)
+        headers = item["cabecalhos"] + extras + [(b"content-length", str(len(corpo)).encode("latin-1"))]
+        if codificacao != "identity":
+            headers.append((b"content-encoding", codificacao.encode("latin-1")))
+        await send({"type": "http.response.start", "status": item["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": corpo})
@@ -0,0 +1,158 @@
+import os
+import io
+import csv
+import json
+import pandas as pd
+import fontes
+
+# configurações
+DIR_PROCESSED = "dados_processados"
+ARQUIVO_ESQUEMAS = os.path.join(DIR_PROCESSED, "esquemas.json")
+TAMANHO_AMOSTRA = 64 * 1024  # bytes lidos do início do arquivo para descobrir separador e encoding
+SEPARADORES = [";", ",", "\t", "|"]
+
+# Colunas canônicas de cada tipo de arquivo e as palavras que identificam a coluna
+# original (a primeira coluna do cabeçalho que contém alguma das palavras).
+CANONICAS = {
+    # demonstrações contábeis trimestrais da ANS (1T2023.csv, ...)
+    "despesas": {
+        "DATA": ["DATA"],
+        "REGISTRO_ANS": ["REG", "CD_OPS"],
+        "CD_CONTA_CONTABIL": ["CONTA"],
+        "DESCRICAO": ["DESC"],
+        "VALOR": ["SALDO", "VALOR"],
+    },
+    # cadastro de operadoras (Relatorio_Cadop.csv)
+    "cadastro": {
+        "REGISTRO_ANS": ["REGISTRO", "REG", "CD_OPS"],
+        "CNPJ": ["CNPJ"],
+        "RAZAO_SOCIAL": ["RAZAO", "NOME", "DENOMINACAO"],
+        "MODALIDADE": ["MODALIDADE"],
+        "UF": ["UF", "ESTADO"],
+    },
+}
+
+_registro = None  # esquemas.json carregado (uma vez por processo)
+_memo = {}  # (caminho, tamanho, mtime) -> esquema, para não reler nem a amostra
+
+def resolver_colunas(colunas, canonicas):
+    """ {canonica: coluna original} para as canônicas encontradas (ignora maiúsculas e espaços) """
+    normalizadas = {c: str(c).strip().upper() for c in colunas}
+    mapa = {}
+    for canonica, palavras in canonicas.items():
+        livres = ((c, n) for c, n in normalizadas.items() if c not in mapa.values())
+        coluna = next((c for c, n in livres if any(p in n for p in palavras)), None)
+        if coluna is not None:
+            mapa[canonica] = coluna
+    return mapa
+
+def _detectar(amostra):
+    """ Encoding e separador a partir dos primeiros bytes do arquivo, e o cabeçalho já separado """
+    if amostra.startswith(b"\xef\xbb\xbf"):
+        encoding = "utf-8-sig"
+    else:
+        # corta na última quebra de linha para não partir um caractere multibyte no meio
+        inteiro = amostra[:amostra.rfind(b"\n") + 1] or amostra
+        try:
+            inteiro.decode("utf-8")
+            encoding = "utf-8"
+        except UnicodeDecodeError:
+            encoding = "latin1"  # padrão dos arquivos antigos da ANS
+
+    texto = amostra.decode(encoding, errors="replace")
+    primeira = texto.splitlines()[0] if texto else ""
+    sep = max(SEPARADORES, key=primeira.count)
+    cabecalho = next(csv.reader(io.StringIO(primeira), delimiter=sep), [])
+    return encoding, sep, cabecalho  # sem strip: o usecols do pandas precisa do nome exato
+
+def _carregar_registro():
+    global _registro
+    if _registro is None:
+        try:
+            with open(ARQUIVO_ESQUEMAS, "r", encoding="utf-8") as f:
+                _registro = json.load(f)
+        except (FileNotFoundError, ValueError):
+            _registro = {}
+    return _registro
+
+def _salvar_registro():
+    os.makedirs(os.path.dirname(ARQUIVO_ESQUEMAS) or ".", exist_ok=True)
+    # só o processo principal grava (ver preparar); o nome por processo é só precaução
+    temporario = f"{ARQUIVO_ESQUEMAS}.{os.getpid()}.tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(_registro, f, ensure_ascii=False, indent=1)
+    os.replace(temporario, ARQUIVO_ESQUEMAS)
+
+def resolver(caminho, tipo):
+    """
+    Descobre (uma vez por arquivo) encoding, separador e o mapeamento das colunas
+    canônicas do `tipo`. O resultado fica salvo em esquemas.json com a chave sendo o
+    hash do conteúdo inteiro (fontes.hash_conteudo), então as próximas etapas/execuções
+    não precisam adivinhar de novo. Devolve um dict com sep, encoding, colunas, usecols e dtype.
+    """
+    tamanho, marca = fontes.assinatura(caminho)
+    memo = (os.path.abspath(caminho), tamanho, marca, tipo)
+    if memo in _memo:
+        return _memo[memo]
+
+    chave = fontes.hash_conteudo(caminho)
+    registro = _carregar_registro()
+    item = registro.get(chave)
+    if item is None or tipo not in item["colunas"]:
+        if item is None:
+            with fontes.abrir(caminho) as f:
+                amostra = f.read(TAMANHO_AMOSTRA)
+            encoding, sep, cabecalho = _detectar(amostra)
+            item = {"arquivo": fontes.nome(caminho), "encoding": encoding, "sep": sep,
+                    "cabecalho": cabecalho, "colunas": {}}
+        item["colunas"][tipo] = resolver_colunas(item["cabecalho"], CANONICAS[tipo])
+        registro[chave] = item
+        _salvar_registro()
+
+    colunas = item["colunas"][tipo]
+    esquema = {
+        "sep": item["sep"],
+        "encoding": item["encoding"],
+        "colunas": colunas,
+        "usecols": list(colunas.values()),
+        "dtype": {c: str for c in colunas.values()},
+    }
+    _memo[memo] = esquema
+    return esquema
+
+def preparar(caminhos, tipo):
+    """
+    Resolve no processo principal o esquema de todos os arquivos antes de abrir o pool.
+    Assim os workers só leem o esquemas.json e não há gravações concorrentes (a última
+    venceria, perdendo entradas). Arquivos ilegíveis ficam para o worker, que reporta o erro.
+    """
+    for caminho in caminhos:
+        try:
+            resolver(caminho, tipo)
+        except Exception:
+            pass
+
+def _ler(arquivo, esquema, kwargs):
+    return pd.read_csv(
+        arquivo, sep=esquema["sep"], encoding=esquema["encoding"], on_bad_lines="skip",
+        usecols=esquema["usecols"], dtype=esquema["dtype"], **kwargs
+    )
+
+def ler_csv(caminho, tipo, **kwargs):
+    """
+    Lê só as colunas canônicas do arquivo, como texto, já renomeadas para os nomes
+    canônicos. `caminho` pode ser um CSV solto ou um membro de ZIP (fontes.py).
+    Com chunksize, devolve um gerador de blocos.
+    """
+    esquema = resolver(caminho, tipo)
+    renomear = {original: canonica for canonica, original in esquema["colunas"].items()}
+    if "chunksize" in kwargs:
+        return _ler_em_blocos(caminho, esquema, renomear, kwargs)
+    with fontes.abrir(caminho) as f:
+        return _ler(f, esquema, kwargs).rename(columns=renomear)
+
+def _ler_em_blocos(caminho, esquema, renomear, kwargs):
+    # o arquivo (ou o membro do ZIP) fica aberto enquanto os blocos são consumidos
+    with fontes.abrir(caminho) as f, _ler(f, esquema, kwargs) as leitor:
+        for bloco in leitor:
+            yield bloco.rename(columns=renomear)
@@ -0,0 +1,123 @@
+import os
+import zipfile
+import hashlib
+from contextlib import contextmanager
+
+# configurações
+DIR_RAW = "dados_brutos"
+SEPARADOR_MEMBRO = "::"  # "dados_brutos/zips/2023/1T2023.zip::1T2023.csv"
+EXTENSAO_CSV = ".csv"
+
+# Uma "fonte" é o caminho de um CSV solto ou de um CSV dentro de um ZIP do cache de
+# downloads (zip + SEPARADOR_MEMBRO + nome do membro). Como é só texto, passa sem custo
+# para os processos do pool e serve de chave nos logs. Os membros são lidos direto do
+# ZIP, descomprimindo em streaming: nada é extraído para o disco.
+
+def caminho_membro(caminho_zip, membro):
+    return f"{caminho_zip}{SEPARADOR_MEMBRO}{membro}"
+
+def dividir(fonte):
+    """ (caminho do arquivo, membro do ZIP ou None) """
+    if SEPARADOR_MEMBRO in fonte:
+        caminho_zip, membro = fonte.split(SEPARADOR_MEMBRO, 1)
+        return caminho_zip, membro
+    return fonte, None
+
+def nome(fonte):
+    """ Nome do CSV (sem pastas), igual ao que o arquivo teria se fosse extraído: 1T2023.csv """
+    caminho, membro = dividir(fonte)
+    return os.path.basename(membro if membro is not None else caminho)
+
+@contextmanager
+def abrir(fonte):
+    """ Arquivo binário de leitura; membros de ZIP são descomprimidos aos poucos, conforme a leitura """
+    caminho, membro = dividir(fonte)
+    if membro is None:
+        with open(caminho, "rb") as f:
+            yield f
+        return
+    with zipfile.ZipFile(caminho) as z:
+        with z.open(membro) as f:
+            yield f
+
+def info_membro(fonte):
+    caminho, membro = dividir(fonte)
+    with zipfile.ZipFile(caminho) as z:
+        return z.getinfo(membro)
+
+def assinatura(fonte):
+    """ Muda sempre que o conteúdo muda: (tamanho, mtime) do arquivo ou (tamanho, CRC) do membro """
+    caminho, membro = dividir(fonte)
+    if membro is None:
+        info = os.stat(caminho)
+        return info.st_size, info.st_mtime_ns
+    info = info_membro(fonte)
+    return info.file_size, info.CRC
+
+def hash_conteudo(fonte, bloco=1024 * 1024):
+    """
+    Identifica o conteúdo inteiro da fonte: CRC-32 e tamanho do diretório central para
+    membros de ZIP (sem descomprimir), sha256 do arquivo para CSVs soltos.
+    """
+    caminho, membro = dividir(fonte)
+    if membro is not None:
+        info = info_membro(fonte)
+        return f"crc32:{info.CRC:08x}:{info.file_size}"
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for parte in iter(lambda: f.read(bloco), b""):
+            h.update(parte)
+    return f"sha256:{h.hexdigest()}"
+
+def tamanho(fonte):
+    """ Tamanho descomprimido """
+    return assinatura(fonte)[0]
+
+def listar(diretorio=DIR_RAW):
+    """
+    CSVs de dados em `diretorio`: os soltos e os de dentro dos ZIPs (em qualquer
+    subpasta, ex: zips/ANO/). CSVs soltos com o mesmo nome de um membro de ZIP são
+    cópias extraídas por versões antigas do main.py e ficam de fora, senão o
+    trimestre entraria duas vezes.
+    """
+    soltos = []
+    membros = []
+    for raiz, _, arquivos in os.walk(diretorio):
+        for arquivo in arquivos:
+            caminho = os.path.join(raiz, arquivo)
+            if arquivo.lower().endswith(EXTENSAO_CSV):
+                soltos.append(caminho)
+            elif arquivo.lower().endswith(".zip"):
+                try:
+                    with zipfile.ZipFile(caminho) as z:
+                        membros.extend(
+                            caminho_membro(caminho, info.filename) for info in z.infolist()
+                            if not info.is_dir() and info.filename.lower().endswith(EXTENSAO_CSV)
+                        )
+                except zipfile.BadZipFile:
+                    print(f"Ignorando {caminho}: ZIP corrompido.")
+
+    nomes_membros = {nome(m) for m in membros}
+    antigos = [s for s in soltos if os.path.basename(s) in nomes_membros]
+    if antigos:
+        print(f"Ignorando {len(antigos)} CSV(s) extraído(s) por versões antigas (o ZIP é lido direto).")
+    soltos = [s for s in soltos if os.path.basename(s) not in nomes_membros]
+    return sorted(soltos + membros)
+
+def hash_fontes(fontes, bloco=1024 * 1024):
+    """
+    sha256 das fontes (em ordem de nome). Membros de ZIP entram pelo CRC-32 e tamanho
+    gravados no diretório central do ZIP, sem descomprimir nada; CSVs soltos, pelo conteúdo.
+    """
+    h = hashlib.sha256()
+    for fonte in sorted(fontes, key=nome):
+        h.update(nome(fonte).encode("utf-8"))
+        caminho, membro = dividir(fonte)
+        if membro is not None:
+            info = info_membro(fonte)
+            h.update(f"zip:{info.CRC:08x}:{info.file_size}".encode("ascii"))
+            continue
+        with open(caminho, "rb") as f:
+            for parte in iter(lambda: f.read(bloco), b""):
+                h.update(parte)
+    return h.hexdigest()
@@ -1,59 +1,231 @@
 import pandas as pd
+import numpy as np
 import os
-import random
+import argparse
+import hashlib
+import io
+import zipfile
+import intermediario
 
 # configurações
 DIR_PROCESSED = "dados_processados"
 DIR_RAW = "dados_brutos"
+DIR_ZIPS = os.path.join(DIR_RAW, "zips")  # mesmo layout do cache de downloads do main.py
 FILE_CONSOLIDADO = os.path.join(DIR_PROCESSED, "consolidado_despesas.csv")
 FILE_MOCK_CADASTRO = os.path.join(DIR_RAW, "Relatorio_Cadop.csv")
+FILE_MARCA_MOCK = os.path.join(DIR_RAW, "Relatorio_Cadop.mock")  # sha256 do cadastro tirado do consolidado
+SEMENTE = 42
+ENCODING_ANS = "latin1"
+TAMANHO_BLOCO = 500_000  # linhas geradas/gravadas por vez (memória constante)
+FRACAO_SEM_CADASTRO = 0.01  # operadoras com despesas mas fora do cadastro (viram OPERADORA DESCONHECIDA)
+FRACAO_ESTORNOS = 0.02  # lançamentos negativos
 
-def gerar_cadastro_fake():
+ESTADOS = ['SP', 'RJ', 'MG', 'RS', 'SC', 'PR', 'BA', 'PE', 'GO', 'DF', 'CE', 'ES', 'PA', 'MT', 'AM']
+PESOS_ESTADOS = [30, 12, 11, 7, 5, 6, 5, 4, 3, 3, 3, 2, 2, 2, 2]  # concentração parecida com a da ANS
+MODALIDADES = ['Cooperativa Médica', 'Medicina de Grupo', 'Autogestão', 'Seguradora Especializada em Saúde',
+               'Odontologia de Grupo', 'Filantropia']
+PREFIXOS = ['UNIMED', 'SAÚDE', 'ASSISTÊNCIA MÉDICA', 'HOSPITAL', 'SÃO LUCAS', 'CLÍNICA', 'PLANO', 'ODONTO']
+CIDADES = ['BELÉM', 'SÃO PAULO', 'CURITIBA', 'GOIÂNIA', 'RIBEIRÃO PRETO', 'VITÓRIA', 'MACEIÓ', 'CAMPINAS',
+           'FLORIANÓPOLIS', 'NATAL', 'CUIABÁ', 'MANAUS', 'PORTO ALEGRE', 'RECIFE', 'SALVADOR', 'FORTALEZA']
+# (conta, descrição, peso): os eventos/sinistros são o que o main.py filtra
+CONTAS = [
+    ('411', 'EVENTOS/SINISTROS CONHECIDOS OU AVISADOS', 45),
+    ('4111', 'EVENTOS INDENIZÁVEIS LÍQUIDOS / SINISTROS RETIDOS', 15),
+    ('412', 'VARIAÇÃO DA PROVISÃO DE EVENTOS OCORRIDOS E NÃO AVISADOS', 5),
+    ('46', 'DESPESAS ADMINISTRATIVAS', 20),
+    ('43', 'DESPESAS DE COMERCIALIZAÇÃO', 10),
+    ('31', 'CONTRAPRESTAÇÕES EFETIVAS DE PLANO DE ASSISTÊNCIA À SAÚDE', 5),
+]
+
+def gerar_cadastro_fake(semente=SEMENTE):
     print("--- GERANDO CADASTRO MOCK (FICTÍCIO) ---")
-    
+
     # lê as despesas para saber quais operadoras precisamos inventar
     if not os.path.exists(FILE_CONSOLIDADO):
         print(f"Erro: Arquivo consolidado não existe em: {FILE_CONSOLIDADO}")
         print("Rode o main.py primeiro!")
         return
 
-    df_desp = pd.read_csv(FILE_CONSOLIDADO, sep=';', decimal=',', encoding='utf-8')
-    
-    # descobre o nome da coluna de registro
-    col_reg = next((c for c in df_desp.columns if "REG" in c or "CD_OPS" in c), None)
-    
-    if not col_reg:
-        print("Erro: Não achei coluna de registro nas despesas.")
-        return
+    # o consolidado tem esquema fixo, só precisamos da coluna de registro
+    df_desp = intermediario.ler_consolidado(["REGISTRO_ANS"], FILE_CONSOLIDADO)
 
     # pega os códigos únicos que estão nas despesas
-    codigos_existentes = df_desp[col_reg].unique()
+    codigos_existentes = df_desp["REGISTRO_ANS"].dropna().unique()
     print(f"Encontrei {len(codigos_existentes)} operadoras no arquivo de despesas.")
 
-    # 2. Cria dados fake para elas
-    dados_fake = []
-    estados = ['SP', 'RJ', 'MG', 'RS', 'SC', 'PR', 'BA', 'PE']
-    
-    for i, codigo in enumerate(codigos_existentes):
-        dados_fake.append({
-            'Registro_ANS': codigo,
-            'Razao_Social': f"OPERADORA TESTE {i+1} LTDA",
-            'CNPJ': f"00.000.000/{1000+i}-00",
-            'UF': random.choice(estados),
-            'Modalidade': 'Cooperativa Médica'
-        })
+    # 2. Cria dados fake para elas (com semente: a mesma entrada gera sempre o mesmo cadastro)
+    rng = np.random.default_rng(semente)
+    n = np.arange(len(codigos_existentes))
+    df_fake = pd.DataFrame({
+        'Registro_ANS': codigos_existentes,
+        'Razao_Social': "OPERADORA TESTE " + pd.Series(n + 1).astype(str) + " LTDA",
+        'CNPJ': "00.000.000/" + pd.Series(1000 + n).astype(str) + "-00",
+        'UF': rng.choice(ESTADOS[:8], size=len(n)),
+        'Modalidade': 'Cooperativa Médica',
+    })
+
+    salvar_cadastro(df_fake)
+    # marca o cadastro como derivado do consolidado: o pipeline.py o refaz quando o consolidado muda
+    with open(FILE_MARCA_MOCK, "w", encoding="utf-8") as f:
+        f.write(_hash_arquivo(FILE_MOCK_CADASTRO))
+    print("Agora você pode rodar a transformação e o Join vai funcionar 100%.")
 
-    # 3. Salva como se fosse o arquivo oficial da ANS
-    df_fake = pd.DataFrame(dados_fake)
-    
-    # cria a pasta se não existir
+def _hash_arquivo(caminho):
+    with open(caminho, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def cadastro_derivado():
+    """ O Relatorio_Cadop.csv atual é o fictício gerado a partir do consolidado (gerar_cadastro_fake)? """
+    if not os.path.exists(FILE_MARCA_MOCK) or not os.path.exists(FILE_MOCK_CADASTRO):
+        return False
+    with open(FILE_MARCA_MOCK, "r", encoding="utf-8") as f:
+        marca = f.read().strip()
+    # o arquivo pode ter sido trocado depois (cadastro real baixado ou copiado por cima)
+    return marca == _hash_arquivo(FILE_MOCK_CADASTRO)
+
+def salvar_cadastro(df):
+    # salva com o separador e encoding do arquivo oficial da ANS
     os.makedirs(DIR_RAW, exist_ok=True)
-    
-    # salva com o separador e encoding que o script espera
-    df_fake.to_csv(FILE_MOCK_CADASTRO, sep=';', index=False, encoding='latin1')
-    
+    df.to_csv(FILE_MOCK_CADASTRO, sep=';', index=False, encoding=ENCODING_ANS)
+    if os.path.exists(FILE_MARCA_MOCK):
+        os.remove(FILE_MARCA_MOCK)  # só o gerar_cadastro_fake marca o cadastro como derivado
     print(f"SUCESSO! Arquivo MOCK criado em: {FILE_MOCK_CADASTRO}")
-    print("Agora você pode rodar a transformação e o Join vai funcionar 100%.")
+
+def formatar_decimal_br(valores):
+    """ float -> texto "1.234.567,89" para a coluna inteira, sem laço em Python """
+    centavos = np.rint(np.abs(valores) * 100).astype(np.int64)
+    # separador de milhar: vai tirando grupos de 3 dígitos da direita (no máximo 5 passadas)
+    resto = pd.Series(centavos // 100).astype(str)
+    inteiro = resto.str[-3:]
+    resto = resto.str[:-3]
+    while (resto != "").any():
+        inteiro = inteiro.where(resto == "", resto.str[-3:] + "." + inteiro)
+        resto = resto.str[:-3]
+    fracao = pd.Series(centavos % 100).astype(str).str.zfill(2)
+    sinal = pd.Series(np.where(valores < 0, "-", ""))
+    return sinal + inteiro + "," + fracao
+
+def gerar_operadoras(qtd, rng):
+    """
+    Cadastro sintético com `qtd` operadoras. O porte de cada uma segue uma Pareto:
+    poucas operadoras grandes concentram a maior parte dos lançamentos e dos valores.
+    """
+    registros = np.sort(rng.choice(np.arange(100_000, 1_000_000), size=qtd, replace=False))
+    porte = rng.pareto(1.2, size=qtd) + 1.0
+    n = pd.Series(np.arange(qtd) + 1).astype(str)
+    cnpj = pd.Series(rng.integers(10**13, 10**14, size=qtd)).astype(str)
+
+    cadastro = pd.DataFrame({
+        'Registro_ANS': registros,
+        'CNPJ': cnpj.str[:2] + "." + cnpj.str[2:5] + "." + cnpj.str[5:8] + "/" + cnpj.str[8:12] + "-" + cnpj.str[12:],
+        'Razao_Social': (
+            pd.Series(rng.choice(PREFIXOS, size=qtd)) + " " + pd.Series(rng.choice(CIDADES, size=qtd))
+            + " " + n + " LTDA"
+        ),
+        'Modalidade': rng.choice(MODALIDADES, size=qtd),
+        'UF': rng.choice(ESTADOS, size=qtd, p=np.array(PESOS_ESTADOS) / sum(PESOS_ESTADOS)),
+    })
+    return cadastro, porte / porte.sum()
+
+def gerar_linhas_trimestre(registros, probabilidades, escala, linhas, ano, trimestre, rng):
+    """ Gera as linhas de um trimestre no layout da ANS, em blocos de TAMANHO_BLOCO """
+    contas = np.array([c for c, _, _ in CONTAS])
+    descricoes = np.array([d for _, d, _ in CONTAS])
+    pesos = np.array([p for _, _, p in CONTAS], dtype=float)
+    data = f"{ano}-{(int(trimestre[0]) - 1) * 3 + 1:02d}-01"
+
+    for inicio in range(0, linhas, TAMANHO_BLOCO):
+        n = min(TAMANHO_BLOCO, linhas - inicio)
+        operadora = rng.choice(len(registros), size=n, p=probabilidades)
+        conta = rng.choice(len(contas), size=n, p=pesos / pesos.sum())
+        # valores log-normais, maiores nas operadoras grandes, com alguns estornos
+        valor = rng.lognormal(mean=np.log(escala[operadora]), sigma=1.4)
+        valor = np.where(rng.random(n) < FRACAO_ESTORNOS, -valor, valor)
+        saldo_inicial = valor * rng.uniform(0.0, 1.0, size=n)
+
+        yield pd.DataFrame({
+            'DATA': data,
+            'REG_ANS': registros[operadora],
+            'CD_CONTA_CONTABIL': contas[conta],
+            'DESCRICAO': descricoes[conta],
+            'VL_SALDO_INICIAL': formatar_decimal_br(saldo_inicial).to_numpy(),
+            'VL_SALDO_FINAL': formatar_decimal_br(valor).to_numpy(),
+        })
+
+def gerar_sintetico(operadoras=500, linhas=50_000, anos=(2023,), trimestres=("1T", "2T", "3T", "4T"),
+                    semente=SEMENTE, processados=False):
+    """
+    Gera uma base sintética completa, sem depender de downloads: cadastro de operadoras,
+    um ZIP por trimestre no cache do main.py (dados_brutos/zips/ANO/1T2023.zip), que é
+    lido direto, sem extrair. Com processados=True roda também a consolidação do
+    main.py, gerando as partições e o consolidado.
+    """
+    print(f"--- GERANDO BASE SINTÉTICA: {operadoras} operadoras, {linhas} linhas/trimestre, "
+          f"{len(anos)} ano(s), semente {semente} ---")
+    rng = np.random.default_rng(semente)
+    cadastro, probabilidades = gerar_operadoras(operadoras, rng)
+    registros = cadastro['Registro_ANS'].to_numpy()
+    escala = 2_000 * (probabilidades * operadoras) ** 0.5  # valor típico cresce com o porte
+
+    # algumas operadoras ficam fora do cadastro, como acontece com operadoras canceladas
+    fora = rng.random(operadoras) < FRACAO_SEM_CADASTRO
+    salvar_cadastro(cadastro[~fora])
+
+    for ano in anos:
+        for trimestre in trimestres:
+            nome = f"{trimestre}{ano}"
+            # cada trimestre tem a sua semente: gerar só parte dos anos dá os mesmos arquivos
+            rng_tri = np.random.default_rng([semente, int(ano), int(trimestre[0])])
+            caminho_zip = os.path.join(DIR_ZIPS, str(ano), f"{nome}.zip")
+            os.makedirs(os.path.dirname(caminho_zip), exist_ok=True)
+            # o CSV é comprimido direto para dentro do ZIP, bloco a bloco. Data fixa no membro:
+            # a mesma semente gera o mesmo ZIP (e o mesmo hash de partição no main.py)
+            membro = zipfile.ZipInfo(f"{nome}.csv", date_time=(1980, 1, 1, 0, 0, 0))
+            membro.compress_type = zipfile.ZIP_DEFLATED
+            with zipfile.ZipFile(caminho_zip, "w") as z, z.open(membro, "w", force_zip64=True) as bruto:
+                with io.TextIOWrapper(bruto, encoding=ENCODING_ANS, newline="") as f:
+                    for i, bloco in enumerate(gerar_linhas_trimestre(registros, probabilidades, escala,
+                                                                     linhas, ano, trimestre, rng_tri)):
+                        bloco.to_csv(f, sep=';', index=False, header=(i == 0))
+            print(f"-> {nome}: {linhas} linhas ({caminho_zip})")
+
+    if processados:
+        gerar_processados()
+
+def gerar_processados():
+    """ Consolida os ZIPs gerados com o próprio main.py (partições + consolidado), sem baixar nada """
+    import main
+    import particoes
+
+    print("\n--- Consolidando a base sintética ---")
+    controle = particoes.abrir_controle()
+    main.atualizar_particoes(main.listar_arquivos_csv(DIR_RAW), controle)
+    total = main.juntar_particoes(controle, FILE_CONSOLIDADO)
+    controle.close()
+    print(f"-> Consolidado: {total} linhas em {FILE_CONSOLIDADO}")
+
+def intervalo_anos(texto):
+    # "2019-2024" ou "2019,2021,2023"
+    if "-" in texto:
+        inicio, fim = texto.split("-", 1)
+        return list(range(int(inicio), int(fim) + 1))
+    return [int(a) for a in texto.split(",")]
 
 if __name__ == "__main__":
-    gerar_cadastro_fake()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Gera dados de teste (cadastro mock ou base sintética completa)")
+    parser.add_argument("--sintetico", action="store_true",
+                        help="gera a base inteira (cadastro + despesas) sem depender de downloads")
+    parser.add_argument("--operadoras", type=int, default=500, help="quantidade de operadoras")
+    parser.add_argument("--linhas", type=int, default=50_000, help="linhas de despesa por trimestre")
+    parser.add_argument("--anos", type=intervalo_anos, default=[2023], help="ex: 2019-2024 ou 2022,2023")
+    parser.add_argument("--trimestres", default="1T,2T,3T,4T", help="ex: 1T,2T,3T")
+    parser.add_argument("--semente", type=int, default=SEMENTE)
+    parser.add_argument("--processados", action="store_true",
+                        help="também gera as partições e o consolidado (roda a consolidação do main.py)")
+    args = parser.parse_args()
+
+    if args.sintetico:
+        gerar_sintetico(args.operadoras, args.linhas, args.anos, args.trimestres.split(","),
+                        args.semente, args.processados)
+    else:
+        gerar_cadastro_fake(args.semente)
@@ -0,0 +1,220 @@
+import os
+import shutil
+import pandas as pd
+import esquema
+
+# pyarrow é opcional: sem ele o pipeline continua funcionando só com CSV
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# configurações
+DIR_PROCESSED = "dados_processados"
+FILE_CONSOLIDADO = os.path.join(DIR_PROCESSED, "consolidado_despesas.csv")
+FILE_CONSOLIDADO_PARQUET = os.path.join(DIR_PROCESSED, "consolidado_despesas.parquet")  # mesmo nome, extensão .parquet
+USAR_PARQUET = True  # grava/lê o Parquet quando o pyarrow estiver instalado
+
+# Esquema fixo do consolidado. Todas as etapas depois do main.py leem essas colunas
+# pelo nome, sem precisar adivinhar as colunas de novo.
+COLUNAS = [
+    "REGISTRO_ANS",
+    "ANO",
+    "TRIMESTRE",
+    "DATA",
+    "CD_CONTA_CONTABIL",
+    "DESCRICAO",
+    "VALOR",
+    "ARQUIVO_ORIGEM",
+]
+
+# tipos usados ao ler o CSV (o Parquet já guarda os tipos)
+TIPOS_CSV = {
+    "REGISTRO_ANS": "Int32",
+    "ANO": "Int32",
+    "TRIMESTRE": "string",
+    "DATA": "string",
+    "CD_CONTA_CONTABIL": "string",
+    "DESCRICAO": "string",
+    "ARQUIVO_ORIGEM": "string",
+}
+
+if pa is not None:
+    ESQUEMA = pa.schema([
+        ("REGISTRO_ANS", pa.int32()),
+        ("ANO", pa.int32()),
+        ("TRIMESTRE", pa.string()),
+        ("DATA", pa.string()),
+        ("CD_CONTA_CONTABIL", pa.string()),
+        ("DESCRICAO", pa.string()),
+        ("VALOR", pa.float64()),
+        ("ARQUIVO_ORIGEM", pa.string()),
+    ])
+else:
+    ESQUEMA = None
+
+def parquet_disponivel():
+    return USAR_PARQUET and pa is not None
+
+def extrair_periodo(origem, data=None):
+    """ Descobre ano e trimestre pelo nome do arquivo (ex: 1T2023.csv) ou, se não der, pela coluna DATA """
+    partes = origem.astype("string").str.extract(r"([1-4])T\s*(\d{4})", expand=True)
+    ano = pd.to_numeric(partes[1], errors="coerce")
+    trimestre = (partes[0] + "T").astype("string")
+
+    if data is not None and ano.isna().any():
+        datas = pd.to_datetime(data, errors="coerce", format="%Y-%m-%d")
+        datas = datas.fillna(pd.to_datetime(data, errors="coerce", format="%d/%m/%Y"))
+        ano = ano.fillna(datas.dt.year)
+        trimestre = trimestre.fillna(((datas.dt.month - 1) // 3 + 1).astype("Int64").astype("string") + "T")
+
+    return ano.astype("Int32"), trimestre
+
+def para_esquema(df):
+    """
+    Converte um bloco do consolidado (colunas canônicas do esquema.py ou as originais
+    da ANS, com o valor limpo) para o esquema fixo.
+    """
+    mapa = esquema.resolver_colunas(df.columns, esquema.CANONICAS["despesas"])
+    saida = pd.DataFrame(index=df.index)
+
+    col_reg = mapa.get("REGISTRO_ANS")
+    col_valor = mapa.get("VALOR")
+    col_data = mapa.get("DATA")
+
+    saida["REGISTRO_ANS"] = pd.to_numeric(df[col_reg], errors="coerce").astype("Int32") if col_reg else pd.NA
+    origem = df["ARQUIVO_ORIGEM"] if "ARQUIVO_ORIGEM" in df else pd.Series("", index=df.index)
+
+    if "ANO" in df and "TRIMESTRE" in df:
+        saida["ANO"] = pd.to_numeric(df["ANO"], errors="coerce").astype("Int32")
+        saida["TRIMESTRE"] = df["TRIMESTRE"].astype("string")
+    else:
+        saida["ANO"], saida["TRIMESTRE"] = extrair_periodo(origem, df[col_data] if col_data else None)
+
+    saida["DATA"] = df[col_data].astype("string") if col_data else pd.NA
+    col_conta = mapa.get("CD_CONTA_CONTABIL")
+    saida["CD_CONTA_CONTABIL"] = df[col_conta].astype("string") if col_conta else pd.NA
+    col_desc = mapa.get("DESCRICAO")
+    saida["DESCRICAO"] = df[col_desc].astype("string") if col_desc else pd.NA
+    saida["VALOR"] = pd.to_numeric(df[col_valor], errors="coerce").astype("float64") if col_valor else float("nan")
+    saida["ARQUIVO_ORIGEM"] = origem.astype("string")
+
+    return saida[COLUNAS]
+
+class EscritorConsolidado:
+    """
+    Grava o consolidado bloco a bloco em CSV (sep=';', decimal=',') e, se o
+    pyarrow estiver disponível, também em Parquet com o esquema fixo.
+    Os arquivos só substituem os anteriores quando fechar() termina com sucesso.
+    """
+
+    def __init__(self, destino_csv, com_parquet=True):
+        self.destino_csv = destino_csv
+        self.destino_parquet = caminho_parquet(destino_csv) if com_parquet and parquet_disponivel() else None
+        self.linhas = 0
+        self._csv = open(destino_csv + ".tmp", "w", encoding="utf-8", newline="")
+        self._parquet = None
+        if self.destino_parquet:
+            self._parquet = pq.ParquetWriter(self.destino_parquet + ".tmp", ESQUEMA)
+
+    def escrever(self, df):
+        if df.empty:
+            return
+        df = df[COLUNAS]
+        df.to_csv(self._csv, header=(self.linhas == 0), index=False, sep=";", decimal=",")
+        if self._parquet is not None:
+            self._parquet.write_table(pa.Table.from_pandas(df, schema=ESQUEMA, preserve_index=False))
+        self.linhas += len(df)
+
+    def anexar(self, outro_csv, outro_parquet=None, linhas=0):
+        """ Anexa um consolidado parcial já gravado (mesmo esquema), sem passar pelo pandas """
+        with open(outro_csv, "r", encoding="utf-8", newline="") as f:
+            cabecalho = f.readline()
+            if self.linhas == 0:
+                self._csv.write(cabecalho)
+            shutil.copyfileobj(f, self._csv, 1024 * 1024)
+        if self._parquet is not None:
+            if outro_parquet:
+                arquivo = pq.ParquetFile(outro_parquet)
+                for i in range(arquivo.num_row_groups):
+                    self._parquet.write_table(arquivo.read_row_group(i))
+            else:
+                # parcial gravado sem Parquet: converte a partir do CSV
+                df = ler_consolidado(caminho_csv=outro_csv)
+                self._parquet.write_table(pa.Table.from_pandas(df, schema=ESQUEMA, preserve_index=False))
+        self.linhas += linhas
+
+    def fechar(self, sucesso=True):
+        self._csv.close()
+        if self._parquet is not None:
+            self._parquet.close()
+
+        pares = [(self.destino_csv + ".tmp", self.destino_csv)]
+        if self.destino_parquet:
+            pares.append((self.destino_parquet + ".tmp", self.destino_parquet))
+        for temporario, destino in pares:
+            if sucesso and self.linhas:
+                os.replace(temporario, destino)
+            elif os.path.exists(temporario):
+                os.remove(temporario)
+
+        antigo = caminho_parquet(self.destino_csv)
+        if not self.destino_parquet and sucesso and self.linhas and os.path.exists(antigo):
+            # sem Parquet nesta execução: remove o antigo para ninguém ler dado desatualizado
+            os.remove(antigo)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_erro, erro, tb):
+        self.fechar(sucesso=tipo_erro is None)
+
+def caminho_parquet(destino_csv):
+    return os.path.splitext(destino_csv)[0] + ".parquet"
+
+def ler_consolidado(colunas=None, caminho_csv=FILE_CONSOLIDADO):
+    """
+    Lê o consolidado já no esquema fixo. Usa o Parquet (memory-map, só as colunas
+    pedidas) quando existir; senão cai para o CSV.
+    """
+    colunas = colunas or COLUNAS
+    parquet = caminho_parquet(caminho_csv)
+
+    if parquet_disponivel() and os.path.exists(parquet):
+        tabela = pq.read_table(parquet, columns=colunas, memory_map=True)
+        return tabela.to_pandas()
+
+    cabecalho = pd.read_csv(caminho_csv, sep=";", nrows=0, encoding="utf-8")
+    if not set(COLUNAS).issubset(cabecalho.columns):
+        # consolidado antigo (colunas originais da ANS): converte para o esquema
+        df = pd.read_csv(caminho_csv, sep=";", decimal=",", encoding="utf-8")
+        df.columns = [c.strip().upper() for c in df.columns]
+        return para_esquema(df)[colunas]
+
+    tipos = {c: t for c, t in TIPOS_CSV.items() if c in colunas}
+    return pd.read_csv(caminho_csv, sep=";", decimal=",", encoding="utf-8", usecols=colunas, dtype=tipos)[colunas]
+
+def ler_consolidado_em_blocos(colunas=None, caminho_csv=FILE_CONSOLIDADO, tamanho=200_000):
+    """ Igual ao ler_consolidado, mas devolve o consolidado em blocos de até `tamanho` linhas """
+    colunas = colunas or COLUNAS
+    parquet = caminho_parquet(caminho_csv)
+
+    if parquet_disponivel() and os.path.exists(parquet):
+        arquivo = pq.ParquetFile(parquet, memory_map=True)
+        for lote in arquivo.iter_batches(batch_size=tamanho, columns=colunas):
+            yield lote.to_pandas()
+        return
+
+    cabecalho = pd.read_csv(caminho_csv, sep=";", nrows=0, encoding="utf-8")
+    if not set(COLUNAS).issubset(cabecalho.columns):
+        yield ler_consolidado(colunas, caminho_csv)
+        return
+
+    tipos = {c: t for c, t in TIPOS_CSV.items() if c in colunas}
+    leitor = pd.read_csv(
+        caminho_csv, sep=";", decimal=",", encoding="utf-8", usecols=colunas, dtype=tipos, chunksize=tamanho
+    )
+    for bloco in leitor:
+        yield bloco[colunas]
@@ -1,8 +1,17 @@
 import os
+import json
+import shutil
+import threading
 import requests
 import zipfile
 import pandas as pd
-from io import BytesIO
+import intermediario
+import particoes
+import valores
+import esquema
+import fontes
+import metricas
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import urllib3
 
 # configurações
@@ -15,114 +24,511 @@ HEADERS = {
 BASE_URL = "https://dadosabertos.ans.gov.br/FTP/PDA/demonstracoes_contabeis/"
 DIR_RAW = "dados_brutos"
 DIR_PROCESSED = "dados_processados"
+DIR_ZIPS = os.path.join(DIR_RAW, "zips")  # cache dos ZIPs baixados
+ARQUIVO_MANIFESTO = os.path.join(DIR_ZIPS, "manifesto.json")
 ANOS = ["2023"] 
 TRIMESTRES = ["1T", "2T", "3T"]
+MAX_DOWNLOADS = 4  # downloads simultâneos
+CHUNK_DOWNLOAD = 1024 * 1024  # grava em blocos de 1 MB, sem segurar o arquivo inteiro na memória
+
+# consolidação: "paralelo" normaliza cada CSV em um processo separado, "streaming" lê cada CSV
+# em blocos (memória constante) em um único processo, "memoria" carrega o arquivo inteiro
+MODO_CONSOLIDACAO = "paralelo"
+MAX_PROCESSOS = None  # None = um processo por núcleo
+CHUNK_LINHAS = 200_000  # linhas por bloco no modo streaming
 
 os.makedirs(DIR_RAW, exist_ok=True)
 os.makedirs(DIR_PROCESSED, exist_ok=True)
 
-def baixar_e_extrair(ano, trimestre):
-    print(f"\n--- Buscando: {ano} / {trimestre} ---")
-    
+# o manifesto é compartilhado entre as threads de download
+_trava_manifesto = threading.Lock()
+
+def carregar_manifesto(caminho=ARQUIVO_MANIFESTO):
+    """ Lê o manifesto (ETag/Last-Modified/tamanho) dos downloads anteriores """
+    if os.path.exists(caminho):
+        try:
+            with open(caminho, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print("⚠️ Manifesto de downloads ilegível, ignorando o cache.")
+    return {}
+
+def salvar_manifesto(manifesto, caminho=ARQUIVO_MANIFESTO):
+    # grava num temporário e troca, para não corromper o manifesto se o processo cair no meio
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    temporario = caminho + ".tmp"
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, indent=2, ensure_ascii=False)
+    os.replace(temporario, caminho)
+
+def _atualizar_manifesto(manifesto, chave, registro, caminho_manifesto):
+    with _trava_manifesto:
+        manifesto[chave] = registro
+        salvar_manifesto(manifesto, caminho_manifesto)
+
+def baixar_arquivo(url, destino, manifesto, chave, caminho_manifesto=ARQUIVO_MANIFESTO):
+    """
+    Baixa a url para o destino em blocos, usando o manifesto para:
+    - pular o download se o servidor responder 304 (ETag/Last-Modified iguais);
+    - retomar um download interrompido (arquivo .part) com Range.
+    Retorna 'cache', 'baixado' ou 'nao_encontrado'.
+    """
+    registro = manifesto.get(chave) or {}
+    if registro.get('url') != url:
+        registro = {}
+
+    parcial = destino + ".part"
+    headers = dict(HEADERS)
+
+    completo = (
+        registro.get('completo')
+        and os.path.exists(destino)
+        and os.path.getsize(destino) == registro.get('tamanho')
+    )
+    inicio = 0
+    if completo:
+        # download condicional: o servidor só manda o corpo se o arquivo mudou
+        if registro.get('etag'):
+            headers['If-None-Match'] = registro['etag']
+        if registro.get('last_modified'):
+            headers['If-Modified-Since'] = registro['last_modified']
+    elif os.path.exists(parcial):
+        inicio = os.path.getsize(parcial)
+        validador = registro.get('etag') or registro.get('last_modified')
+        if inicio and validador:
+            # If-Range: se o arquivo mudou no servidor, ele devolve 200 e recomeçamos do zero
+            headers['Range'] = f"bytes={inicio}-"
+            headers['If-Range'] = validador
+        else:
+            inicio = 0
+
+    with requests.get(url, headers=headers, verify=False, timeout=30, stream=True) as response:
+        if response.status_code == 304:
+            return 'cache'
+        if response.status_code == 404:
+            return 'nao_encontrado'
+        if response.status_code == 416:
+            # o .part já tem mais bytes do que o servidor oferece: descarta e tenta de novo depois
+            os.remove(parcial)
+            raise requests.HTTPError(f"Range inválido para {url}, download parcial descartado")
+        if response.status_code not in (200, 206):
+            raise requests.HTTPError(f"Status {response.status_code}")
+
+        retomando = response.status_code == 206
+        if retomando and not response.headers.get('Content-Range', '').startswith(f"bytes {inicio}-"):
+            os.remove(parcial)
+            raise requests.HTTPError(f"Content-Range inesperado para {url}, download parcial descartado")
+        if not retomando:
+            inicio = 0
+
+        tamanho_corpo = response.headers.get('Content-Length')
+        registro = {
+            'url': url,
+            'arquivo': destino,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'tamanho': inicio + int(tamanho_corpo) if tamanho_corpo else None,
+            'completo': False,
+        }
+        # registra os validadores antes de começar, para conseguir retomar se cair no meio
+        _atualizar_manifesto(manifesto, chave, registro, caminho_manifesto)
+
+        os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+        with open(parcial, 'ab' if retomando else 'wb') as f:
+            for bloco in response.iter_content(chunk_size=CHUNK_DOWNLOAD):
+                f.write(bloco)
+
+    tamanho = os.path.getsize(parcial)
+    if registro['tamanho'] is not None and tamanho != registro['tamanho']:
+        raise requests.HTTPError(f"Download incompleto ({tamanho}/{registro['tamanho']} bytes), será retomado")
+
+    os.replace(parcial, destino)
+    registro = dict(registro, tamanho=tamanho, completo=True)
+    _atualizar_manifesto(manifesto, chave, registro, caminho_manifesto)
+    return 'baixado'
+
+def baixar_trimestre(ano, trimestre, manifesto, base_url=BASE_URL, dir_zips=DIR_ZIPS,
+                     caminho_manifesto=ARQUIVO_MANIFESTO):
+    """ Procura o ZIP do trimestre entre os nomes conhecidos e devolve (caminho, status) """
+    chave = f"{ano}/{trimestre}"
     nomes_possiveis = [
         f"{trimestre}{ano}.zip",           # Ex: 1T2023.zip (Padrão atual)
         f"{trimestre} {ano}.zip",          # Com espaço
         f"Demonstracoes_Contabeis_{trimestre}{ano}.zip",
     ]
 
-    sucesso = False
-    for nome in nomes_possiveis:
-        url = f"{BASE_URL}{ano}/{nome}"
-        print(f"Tentando: {url}")
-        
+    # se já achamos esse trimestre antes, começa pelo nome que funcionou
+    url_conhecida = (manifesto.get(chave) or {}).get('url')
+    urls = [f"{base_url}{ano}/{nome}" for nome in nomes_possiveis]
+    if url_conhecida in urls:
+        urls.remove(url_conhecida)
+        urls.insert(0, url_conhecida)
+
+    for url in urls:
+        destino = os.path.join(dir_zips, ano, url.rsplit('/', 1)[-1])
+        print(f"[{chave}] Tentando: {url}")
         try:
-            response = requests.get(url, headers=HEADERS, verify=False, timeout=30)
-            
-            if response.status_code == 200:
-                print("✅ Arquivo encontrado! Baixando...")
-                try:
-                    with zipfile.ZipFile(BytesIO(response.content)) as z:
-                        z.extractall(DIR_RAW)
-                        print(f"   Extraído em {DIR_RAW}")
-                        sucesso = True
-                        break 
-                except zipfile.BadZipFile:
-                    print("❌ Erro: Arquivo corrompido.")
-            elif response.status_code == 404:
-                pass # Tenta o próximo nome silenciosamente
-            else:
-                print(f"⚠️ Status {response.status_code}")
-                
+            status = baixar_arquivo(url, destino, manifesto, chave, caminho_manifesto)
         except Exception as e:
-            print(f"Erro de conexão: {e}")
+            print(f"[{chave}] Erro de conexão: {e}")
+            continue
 
-    if not sucesso:
-        print(f"❌ ALERTA: Não foi possível achar o arquivo de {trimestre}/{ano}")
+        if status == 'nao_encontrado':
+            continue # Tenta o próximo nome silenciosamente
+        if status == 'cache':
+            print(f"[{chave}] ✅ Sem alterações desde o último download, usando o cache.")
+        else:
+            print(f"[{chave}] ✅ Arquivo baixado em {destino}")
+        return destino, status
 
-def normalizar_arquivo(arquivo_path):
-    # Função para limpar e filtrar os dados
-    try:
-        # Tenta ler com encoding latin1 (padrão Brasil antigo)
-        df = pd.read_csv(arquivo_path, sep=';', encoding='latin1', on_bad_lines='skip')
-        df.columns = [c.strip().upper() for c in df.columns]
-        
-        # Procura coluna que tenha 'DESC' (Descricao)
-        col_desc = next((c for c in df.columns if 'DESC' in c), None)
-        
-        if col_desc:
-            # Filtra apenas o que é EVENTO ou SINISTRO
-            filtro = df[col_desc].str.contains("EVENTO|SINISTRO", na=False, case=False)
-            return df[filtro].copy()
+    print(f"[{chave}] ❌ ALERTA: Não foi possível achar o arquivo de {trimestre}/{ano}")
+    return None, None
+
+def baixar_e_verificar(ano, trimestre, manifesto=None, base_url=BASE_URL, dir_zips=DIR_ZIPS,
+                      caminho_manifesto=ARQUIVO_MANIFESTO):
+    """
+    Baixa o ZIP do trimestre (ou usa o cache) e confere se ele abre. Os CSVs não são
+    extraídos: a consolidação lê os membros direto do ZIP (fontes.py).
+    """
+    print(f"\n--- Buscando: {ano} / {trimestre} ---")
+    if manifesto is None:
+        manifesto = carregar_manifesto(caminho_manifesto)
+
+    caminho_zip, status = baixar_trimestre(ano, trimestre, manifesto, base_url, dir_zips, caminho_manifesto)
+    if caminho_zip is None:
         return None
-    except Exception:
+
+    try:
+        # só o diretório central é lido: confirma que o ZIP está inteiro e tem CSVs
+        with zipfile.ZipFile(caminho_zip) as z:
+            csvs = [n for n in z.namelist() if n.lower().endswith(fontes.EXTENSAO_CSV)]
+        if status != 'cache':
+            print(f"   {len(csvs)} CSV(s) em {caminho_zip}, lidos direto do ZIP")
+        return caminho_zip
+    except zipfile.BadZipFile:
+        print("❌ Erro: Arquivo corrompido.")
+        # invalida o cache para forçar um novo download na próxima execução
+        with _trava_manifesto:
+            manifesto.pop(f"{ano}/{trimestre}", None)
+            salvar_manifesto(manifesto, caminho_manifesto)
+        os.remove(caminho_zip)
         return None
 
-def main():
-    # ETAPA 1: DOWNLOAD
-    for ano in ANOS:
-        for tri in TRIMESTRES:
-            baixar_e_extrair(ano, tri)
-            
-    # ETAPA 2: CONSOLIDAÇÃO
-    print("\n--- Iniciando Consolidação ---")
+def baixar_todos(anos=ANOS, trimestres=TRIMESTRES, max_workers=MAX_DOWNLOADS, base_url=BASE_URL,
+                 dir_zips=DIR_ZIPS):
+    """ Baixa todos os trimestres em paralelo (limitado a max_workers conexões) """
+    caminho_manifesto = os.path.join(dir_zips, os.path.basename(ARQUIVO_MANIFESTO))
+    manifesto = carregar_manifesto(caminho_manifesto)
+    pares = [(ano, tri) for ano in anos for tri in trimestres]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futuros = {
+            (ano, tri): executor.submit(
+                baixar_e_verificar, ano, tri, manifesto, base_url, dir_zips, caminho_manifesto
+            )
+            for ano, tri in pares
+        }
+        return {par: futuro.result() for par, futuro in futuros.items()}
+
+def limpar_valores(df, col_valor):
+    # Converte o valor no formato brasileiro ("1.234,56") numa passada vetorizada;
+    # o que não for número vira NaN. Devolve quantos valores eram inválidos.
+    df[col_valor], invalidos = valores.converter_decimal_br(df[col_valor])
+    return invalidos
+
+def avisar_invalidos(file, invalidos):
+    if invalidos:
+        print(f"   Aviso: {invalidos} valores inválidos em {file} (gravados como vazios)")
+
+def normalizar_arquivo(arquivo_path):
+    # Função para limpar e filtrar os dados. Erro de leitura sobe para quem chamou:
+    # um arquivo que falhou não pode virar uma partição vazia.
+    # separador, encoding e colunas vêm do esquema resolvido uma vez por arquivo
+    df = esquema.ler_csv(arquivo_path, "despesas")
+
+    if 'DESCRICAO' in df.columns:
+        # Filtra apenas o que é EVENTO ou SINISTRO
+        filtro = df['DESCRICAO'].str.contains("EVENTO|SINISTRO", na=False, case=False)
+        return df[filtro].copy()
+    return None
+
+def normalizar_arquivo_em_blocos(arquivo_path, chunksize=CHUNK_LINHAS):
+    """
+    Versão streaming do normalizar_arquivo: lê o CSV em blocos de chunksize linhas,
+    só com as colunas canônicas (esquema.py) e tudo como texto (sem inferência de tipos),
+    e devolve cada bloco já filtrado. A memória fica limitada ao tamanho do bloco.
+    """
+    if "DESCRICAO" not in esquema.resolver(arquivo_path, "despesas")["colunas"]:
+        return
+
+    for bloco in esquema.ler_csv(arquivo_path, "despesas", chunksize=chunksize):
+        filtro = bloco['DESCRICAO'].str.contains("EVENTO|SINISTRO", na=False, case=False)
+        if filtro.any():
+            yield bloco[filtro]
+
+def listar_arquivos_csv(diretorio=DIR_RAW):
+    # Lista os CSVs baixados: soltos ou dentro dos ZIPs do cache (lidos sem extrair)
+    return fontes.listar(diretorio)
+
+def consolidar_em_memoria(arquivos, destino):
     todos = []
+    for caminho_completo in arquivos:
+        file = fontes.nome(caminho_completo)
+        print(f"Processando: {file}")
+        
+        with metricas.medir_etapa("main.normalizar", arquivo=file) as info:
+            df_temp = normalizar_arquivo(caminho_completo)
+            info["linhas"] = 0 if df_temp is None else len(df_temp)
+        if df_temp is not None:
+            # Adiciona coluna para saber de qual arquivo veio
+            df_temp['ARQUIVO_ORIGEM'] = file
+            todos.append(df_temp)
     
-    # Lista arquivos CSV que foram baixados
-    for root, dirs, files in os.walk(DIR_RAW):
-        for file in files:
-            if file.lower().endswith(".csv"):
-                caminho_completo = os.path.join(root, file)
-                print(f"Processando: {file}")
-                
-                df_temp = normalizar_arquivo(caminho_completo)
-                if df_temp is not None:
-                    # Adiciona coluna para saber de qual arquivo veio
-                    df_temp['ARQUIVO_ORIGEM'] = file
-                    todos.append(df_temp)
+    if not todos:
+        return 0
+
+    df_final = pd.concat(todos, ignore_index=True)
+    if 'VALOR' in df_final.columns:
+        avisar_invalidos(os.path.basename(destino), limpar_valores(df_final, 'VALOR'))
     
-    if todos:
-        df_final = pd.concat(todos, ignore_index=True)
-        
-        # Limpeza básica de valores numéricos (trocar vírgula por ponto)
-        # Procura coluna de VALOR ou SALDO
-        col_valor = next((c for c in df_final.columns if 'SALDO' in c or 'VALOR' in c), None)
-        if col_valor:
-            df_final[col_valor] = (
-                df_final[col_valor]
-                .astype(str)
-                .str.replace('.', '', regex=False)
-                .str.replace(',', '.', regex=False)
-            )
-            # Remove o que não for número
-            df_final[col_valor] = pd.to_numeric(df_final[col_valor], errors='coerce')
-        
-        # Salva o arquivo final
-        destino = f"{DIR_PROCESSED}/consolidado_despesas.csv"
-        df_final.to_csv(destino, index=False, sep=';', decimal=',')
+    with intermediario.EscritorConsolidado(destino) as escritor:
+        escritor.escrever(intermediario.para_esquema(df_final))
+    return len(df_final)
+
+def _preparar_bloco(bloco, file):
+    # Adiciona coluna para saber de qual arquivo veio, limpa o valor e aplica o esquema fixo.
+    # Devolve (bloco no esquema, valores inválidos)
+    bloco = bloco.assign(ARQUIVO_ORIGEM=file)
+    invalidos = limpar_valores(bloco, 'VALOR') if 'VALOR' in bloco.columns else 0
+    return intermediario.para_esquema(bloco), invalidos
+
+def consolidar_em_blocos(arquivos, destino, chunksize=CHUNK_LINHAS):
+    """ Filtra e limpa cada bloco e já anexa no consolidado, sem juntar tudo na memória """
+    with intermediario.EscritorConsolidado(destino) as escritor:
+        for caminho_completo in arquivos:
+            file = fontes.nome(caminho_completo)
+            print(f"Processando: {file}")
+            # um erro descarta o consolidado inteiro (o escritor não troca os arquivos)
+            with metricas.medir_etapa("main.normalizar", arquivo=file) as info:
+                antes = escritor.linhas
+                invalidos = 0
+                for bloco in normalizar_arquivo_em_blocos(caminho_completo, chunksize):
+                    preparado, n = _preparar_bloco(bloco, file)
+                    escritor.escrever(preparado)
+                    invalidos += n
+                info.update(linhas=escritor.linhas - antes, invalidos=invalidos)
+            avisar_invalidos(file, invalidos)
+    return escritor.linhas
+
+def processar_arquivo_parcial(caminho_completo, parcial, chunksize=CHUNK_LINHAS):
+    """
+    Executado em um processo separado: normaliza e limpa um arquivo e grava
+    o resultado em um consolidado parcial. Devolve (csv, parquet, linhas).
+    """
+    file = fontes.nome(caminho_completo)
+    invalidos = 0
+    with metricas.medir_etapa("main.normalizar", arquivo=file) as info:
+        with intermediario.EscritorConsolidado(parcial) as escritor:
+            for bloco in normalizar_arquivo_em_blocos(caminho_completo, chunksize):
+                preparado, n = _preparar_bloco(bloco, file)
+                escritor.escrever(preparado)
+                invalidos += n
+        info.update(linhas=escritor.linhas, invalidos=invalidos)
+    avisar_invalidos(file, invalidos)
+    if not escritor.linhas:
+        return None, None, 0
+    return parcial, escritor.destino_parquet, escritor.linhas
+
+def consolidar_em_paralelo(grupos, max_workers=MAX_PROCESSOS, chunksize=CHUNK_LINHAS, dir_parciais=None):
+    """
+    grupos: {destino: [arquivos]}. Cada arquivo é normalizado em um processo do pool
+    e vira um consolidado parcial; o processo principal só junta os parciais de cada
+    destino, em streaming. Devolve ({destino: linhas}, {destino: [arquivos com erro]}).
+    Destinos com algum arquivo com erro não são gravados.
+    """
+    dir_parciais = dir_parciais or os.path.join(DIR_PROCESSED, "parciais")
+    shutil.rmtree(dir_parciais, ignore_errors=True)
+    os.makedirs(dir_parciais)
+
+    # o registro de esquemas é gravado aqui, antes do pool; os workers só o leem
+    esquema.preparar([caminho for arquivos in grupos.values() for caminho in arquivos], "despesas")
+
+    resultado = {}
+    falhas = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futuros = {}
+        i = 0
+        for destino, arquivos in grupos.items():
+            futuros[destino] = []
+            for caminho in arquivos:
+                parcial = os.path.join(dir_parciais, f"{i:05d}_{fontes.nome(caminho)}")
+                futuros[destino].append((caminho, executor.submit(processar_arquivo_parcial, caminho, parcial, chunksize)))
+                i += 1
+
+        for destino, tarefas in futuros.items():
+            erros = []
+            escritor = intermediario.EscritorConsolidado(destino)
+            try:
+                # junta na ordem dos arquivos para o resultado ser igual ao do modo serial
+                for caminho, futuro in tarefas:
+                    try:
+                        parcial_csv, parcial_parquet, linhas = futuro.result()
+                    except Exception as e:
+                        print(f"   Erro ao processar {fontes.nome(caminho)}: {e}")
+                        erros.append(fontes.nome(caminho))
+                        continue
+                    print(f"Processado: {fontes.nome(caminho)} ({linhas} linhas)")
+                    if parcial_csv and not erros:
+                        escritor.anexar(parcial_csv, parcial_parquet, linhas)
+            except BaseException:
+                escritor.fechar(sucesso=False)
+                raise
+            escritor.fechar(sucesso=not erros)
+            if erros:
+                falhas[destino] = erros
+            else:
+                resultado[destino] = escritor.linhas
+
+    shutil.rmtree(dir_parciais, ignore_errors=True)
+    return resultado, falhas
+
+def consolidar_grupos(grupos):
+    """
+    Consolida cada grupo {destino: [arquivos]} no modo configurado.
+    Devolve ({destino: linhas}, {destino: [erros]}) com os destinos que falharam à parte.
+    """
+    if MODO_CONSOLIDACAO == "paralelo":
+        return consolidar_em_paralelo(grupos)
+    consolidar = consolidar_em_blocos if MODO_CONSOLIDACAO == "streaming" else consolidar_em_memoria
+    linhas, falhas = {}, {}
+    for destino, arquivos in grupos.items():
+        try:
+            linhas[destino] = consolidar(arquivos, destino)
+        except Exception as e:
+            print(f"   Erro ao consolidar {os.path.basename(destino)}: {e}")
+            falhas[destino] = [str(e)]
+    return linhas, falhas
+
+def agrupar_por_particao(arquivos):
+    """ Agrupa os CSVs por (ano, trimestre), pelo nome do arquivo """
+    grupos = {}
+    for caminho in arquivos:
+        ano, trimestre = particoes.periodo_do_nome(fontes.nome(caminho))
+        if ano is None:
+            print(f"Ignorando {fontes.nome(caminho)}: não há ano/trimestre no nome do arquivo.")
+            continue
+        grupos.setdefault((ano, trimestre), []).append(caminho)
+    return grupos
+
+def atualizar_particoes(arquivos, controle):
+    """
+    Reprocessa só as partições (ano, trimestre) novas ou cujos arquivos de origem
+    mudaram (hash diferente do registrado). Partições registradas cujos arquivos
+    sumiram das fontes saem do controle e do disco. Devolve a lista de partições
+    refeitas ou removidas. Partição com algum arquivo com erro não é registrada (sai
+    do controle, para ser refeita na próxima execução) e, no final, a função levanta
+    RuntimeError.
+    """
+    grupos = agrupar_por_particao(arquivos)
+    removidas = remover_particoes_sem_fontes(grupos, controle)
+
+    pendentes = {}
+    for (ano, trimestre), arquivos_particao in sorted(grupos.items()):
+        hash_origem = fontes.hash_fontes(arquivos_particao)
+        destino = particoes.caminho_particao(ano, trimestre)
+        registro = particoes.obter(controle, "consolidacao", ano, trimestre)
+        if registro and registro["hash"] == hash_origem and (os.path.exists(destino) or registro["linhas"] == 0):
+            print(f"Partição {trimestre}/{ano} sem alterações, pulando.")
+            continue
+        pendentes[(ano, trimestre)] = (destino, arquivos_particao, hash_origem)
+
+    if not pendentes:
+        return removidas
+
+    os.makedirs(particoes.DIR_PARTICOES, exist_ok=True)
+    for destino, _, _ in pendentes.values():
+        # remove a versão antiga: se a nova vier vazia, não pode sobrar dado velho
+        for antigo in (destino, intermediario.caminho_parquet(destino)):
+            if os.path.exists(antigo):
+                os.remove(antigo)
+
+    linhas, falhas = consolidar_grupos({destino: arqs for destino, arqs, _ in pendentes.values()})
+    with controle:
+        for (ano, trimestre), (destino, _, hash_origem) in pendentes.items():
+            if destino in falhas:
+                particoes.remover(controle, "consolidacao", ano, trimestre)
+            else:
+                particoes.registrar(controle, "consolidacao", ano, trimestre, hash_origem, linhas.get(destino, 0))
+
+    com_erro = [f"{trimestre}/{ano}" for (ano, trimestre), (destino, _, _) in sorted(pendentes.items()) if destino in falhas]
+    if com_erro:
+        raise RuntimeError(f"Partições com erro na consolidação: {', '.join(com_erro)}. Serão refeitas na próxima execução.")
+    return sorted(set(pendentes) | set(removidas))
+
+def remover_particoes_sem_fontes(grupos, controle):
+    """
+    Tira do controle (e apaga os arquivos de) partições consolidadas antes cujo
+    trimestre não está mais nas fontes. Sem nenhuma fonte não remove nada: é mais
+    provável um download quebrado do que o histórico inteiro ter sumido.
+    """
+    if not grupos:
+        return []
+    removidas = []
+    with controle:
+        for p in particoes.listar(controle, "consolidacao"):
+            ano, trimestre = p["ano"], p["trimestre"]
+            if (ano, trimestre) in grupos:
+                continue
+            destino = particoes.caminho_particao(ano, trimestre)
+            for antigo in (destino, intermediario.caminho_parquet(destino)):
+                if os.path.exists(antigo):
+                    os.remove(antigo)
+            particoes.remover(controle, "consolidacao", ano, trimestre)
+            print(f"Partição {trimestre}/{ano} não está mais nas fontes, removida.")
+            removidas.append((ano, trimestre))
+    return removidas
+
+def juntar_particoes(controle, destino):
+    """ Monta o consolidado completo juntando as partições (cópia de texto / row groups) """
+    with intermediario.EscritorConsolidado(destino) as escritor:
+        for p in particoes.listar(controle, "consolidacao"):
+            if not p["linhas"]:
+                continue
+            caminho = particoes.caminho_particao(p["ano"], p["trimestre"])
+            parquet = intermediario.caminho_parquet(caminho)
+            escritor.anexar(caminho, parquet if os.path.exists(parquet) else None, p["linhas"])
+    return escritor.linhas
+
+def consolidar(arquivos, controle):
+    """
+    Atualiza as partições (ano, trimestre) a partir dos CSVs e remonta o consolidado
+    quando alguma mudou. Devolve (partições refeitas, total de linhas do consolidado).
+    """
+    print("\n--- Iniciando Consolidação ---")
+    with metricas.medir_etapa("main.consolidacao") as info:
+        refeitas = atualizar_particoes(arquivos, controle)
+        info["particoes"] = len(refeitas)
+    print(f"Partições reprocessadas: {len(refeitas)}")
+
+    destino = f"{DIR_PROCESSED}/consolidado_despesas.csv"
+    with metricas.medir_etapa("main.juntar_particoes") as info:
+        if refeitas or not os.path.exists(destino):
+            total = juntar_particoes(controle, destino)
+        else:
+            total = sum(p["linhas"] for p in particoes.listar(controle, "consolidacao"))
+        info["linhas"] = total
+
+    if total:
         print(f"\n🏆 SUCESSO! Arquivo gerado: {destino}")
-        print(f"Total de linhas processadas: {len(df_final)}")
+        print(f"Total de linhas processadas: {total}")
     else:
         print("\nNenhum dado foi processado. Verifique se os downloads funcionaram.")
+    return refeitas, total
+
+def main():
+    # download + consolidação pelo pipeline.py, sempre conferindo as partições (como antes)
+    import pipeline
+    pipeline.rodar_script(["download", "fontes", "consolidacao"], dependencias=False, forcar=True)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
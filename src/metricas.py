@@ -0,0 +1,302 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# configurações
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_CONSULTAS = 500  # textos de SQL distintos acompanhados; o que passar disso entra como "outras"
+TAMANHO_ROTULO_SQL = 200  # caracteres do SQL (sem quebras de linha) usados como rótulo
+ARQUIVO_EVENTOS_ETL = os.path.join("dados_processados", "eventos_etl.jsonl")
+
+# linha do EXPLAIN QUERY PLAN que indica leitura da tabela inteira, sem busca por índice:
+# "SCAN despesas", "SCAN d" ou, em versões antigas, "SCAN TABLE despesas AS d". Também
+# "SCAN d USING INDEX x", que percorre a tabela toda só para sair na ordem do índice.
+# Varredura de índice de cobertura (paginação por nome) não conta.
+PADRAO_SCAN_COMPLETO = re.compile(r"SCAN (TABLE )?(\w+)( AS \w+)?( USING INDEX \w+)?")
+# "FROM despesas d" / "JOIN operadoras AS o": o plano mostra só o apelido
+PADRAO_TABELA_APELIDO = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+PALAVRAS_SQL = {"where", "join", "on", "group", "order", "limit", "left", "inner", "cross", "natural", "using", "union"}
+
+class Registro:
+    """
+    Métricas do processo em memória (contadores, gauges e histogramas), exportadas no
+    formato texto do Prometheus. Cada worker do uvicorn tem o seu registro.
+    """
+
+    def __init__(self, buckets=BUCKETS_SEGUNDOS):
+        self.buckets = tuple(buckets)
+        self._trava = threading.Lock()
+        self._ajuda = {}
+        self._tipos = {}
+        self._valores = {}  # (nome, rótulos) -> número, ou [contagens por bucket, soma, total]
+
+    def declarar(self, nome, tipo, ajuda):
+        self._tipos[nome] = tipo
+        self._ajuda[nome] = ajuda
+
+    def somar(self, nome, rotulos, valor=1):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._trava:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def definir(self, nome, rotulos, valor):
+        with self._trava:
+            self._valores[(nome, tuple(sorted(rotulos.items())))] = valor
+
+    def observar(self, nome, rotulos, valor):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._trava:
+            hist = self._valores.get(chave)
+            if hist is None:
+                hist = self._valores[chave] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    hist[0][i] += 1
+            hist[1] += valor
+            hist[2] += 1
+
+    def exportar(self):
+        with self._trava:
+            itens = sorted(self._valores.items(), key=lambda item: item[0])
+            itens = [(chave, valor if not isinstance(valor, list) else [list(valor[0]), valor[1], valor[2]])
+                     for chave, valor in itens]
+
+        linhas = []
+        ultimo = None
+        for (nome, rotulos), valor in itens:
+            if nome != ultimo:
+                linhas.append(f"# HELP {nome} {self._ajuda.get(nome, nome)}")
+                linhas.append(f"# TYPE {nome} {self._tipos.get(nome, 'untyped')}")
+                ultimo = nome
+            if isinstance(valor, list):
+                contagens, soma, total = valor
+                for limite, qtd in zip(self.buckets, contagens):
+                    linhas.append(f"{nome}_bucket{_rotulos(rotulos + (('le', repr(limite)),))} {qtd}")
+                linhas.append(f"{nome}_bucket{_rotulos(rotulos + (('le', '+Inf'),))} {total}")
+                linhas.append(f"{nome}_sum{_rotulos(rotulos)} {soma}")
+                linhas.append(f"{nome}_count{_rotulos(rotulos)} {total}")
+            else:
+                linhas.append(f"{nome}{_rotulos(rotulos)} {valor}")
+        return "\n".join(linhas) + "\n"
+
+def _rotulos(rotulos):
+    if not rotulos:
+        return ""
+    partes = []
+    for nome, valor in rotulos:
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        partes.append(f'{nome}="{valor}"')
+    return "{" + ",".join(partes) + "}"
+
+REGISTRO = Registro()
+REGISTRO.declarar("api_requisicao_segundos", "histogram", "Tempo de resposta por rota (até o último byte)")
+REGISTRO.declarar("sqlite_consulta_segundos", "histogram", "Tempo de execução + leitura de cada consulta SQL")
+REGISTRO.declarar("sqlite_consulta_linhas_total", "counter", "Linhas devolvidas por consulta SQL")
+REGISTRO.declarar("sqlite_consulta_scan_completo", "gauge", "1 se o plano da consulta lê alguma tabela inteira, sem índice")
+
+# ---------------------------------------------------------------------------
+# Requisições HTTP
+# ---------------------------------------------------------------------------
+
+class MedirRequisicoes:
+    """
+    Middleware ASGI que mede cada requisição HTTP até o último pedaço da resposta
+    (vale para streaming) e alimenta o histograma por método, rota e status. A rota é
+    o molde declarado (/api/operadoras/{registro_ans}), não o caminho, para não
+    criar uma série por operadora; caminhos sem rota entram como "desconhecida".
+    """
+
+    def __init__(self, app, rotas=(), registro=REGISTRO):
+        self.app = app
+        self.rotas = rotas  # lista de rotas do app (a mesma lista, então vê as rotas criadas depois)
+        self.registro = registro
+
+    def rota(self, scope):
+        from starlette.routing import Match
+        for rota in self.rotas:
+            encontrada, _ = rota.matches(scope)
+            if encontrada == Match.FULL:
+                return getattr(rota, "path", "desconhecida")
+        return "desconhecida"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        estado = {"status": 500}
+
+        async def enviar(mensagem):
+            if mensagem["type"] == "http.response.start":
+                estado["status"] = mensagem["status"]
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            rotulos = {"metodo": scope["method"], "rota": self.rota(scope), "status": estado["status"]}
+            self.registro.observar("api_requisicao_segundos", rotulos, time.perf_counter() - inicio)
+
+# ---------------------------------------------------------------------------
+# Consultas SQLite
+# ---------------------------------------------------------------------------
+
+_planos = {}  # rótulo do SQL -> tabelas lidas sem índice (uma análise por texto de SQL)
+_trava_planos = threading.Lock()
+
+def rotulo_sql(sql):
+    return " ".join(sql.split())[:TAMANHO_ROTULO_SQL]
+
+def tabelas_sem_indice(conn, sql, params):
+    """ Tabelas que o plano da consulta lê por inteiro (EXPLAIN QUERY PLAN) """
+    try:
+        plano = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error:
+        return []
+    apelidos = {}
+    for tabela, apelido in PADRAO_TABELA_APELIDO.findall(sql):
+        if apelido and apelido.lower() not in PALAVRAS_SQL:
+            apelidos[apelido] = tabela
+    tabelas = []
+    for linha in plano:
+        encontrado = PADRAO_SCAN_COMPLETO.fullmatch(linha[-1])
+        if encontrado:
+            tabelas.append(apelidos.get(encontrado.group(2), encontrado.group(2)))
+    return tabelas
+
+class CursorMedido(sqlite3.Cursor):
+    """
+    Cursor que mede cada consulta: tempo do execute somado ao das leituras (fetch*) e
+    linhas devolvidas. A medida é fechada quando o resultado acaba, no próximo execute
+    ou quando o cursor é fechado/descartado. Na primeira vez que vê um SQL, roda o
+    EXPLAIN QUERY PLAN e marca se ele lê alguma tabela inteira.
+    """
+
+    _consulta = None
+
+    def execute(self, sql, params=()):
+        self._finalizar()
+        rotulo = rotulo_sql(sql)
+        with _trava_planos:
+            novo = rotulo not in _planos and len(_planos) < MAX_CONSULTAS
+            if novo:
+                _planos[rotulo] = None  # reserva; o plano é analisado fora da trava
+        if rotulo not in _planos:
+            rotulo = "outras"
+        elif novo:
+            tabelas = tabelas_sem_indice(self.connection, sql, params)
+            _planos[rotulo] = tabelas
+            REGISTRO.definir("sqlite_consulta_scan_completo",
+                             {"consulta": rotulo, "tabelas": ",".join(tabelas)}, int(bool(tabelas)))
+
+        inicio = time.perf_counter()
+        super().execute(sql, params)
+        self._consulta = [rotulo, time.perf_counter() - inicio, 0]
+        return self
+
+    def _medir(self, leitura, *args):
+        inicio = time.perf_counter()
+        linhas = leitura(*args)
+        if self._consulta is not None:
+            self._consulta[1] += time.perf_counter() - inicio
+        return linhas
+
+    def fetchone(self):
+        linha = self._medir(super().fetchone)
+        if linha is None:
+            self._finalizar()
+        elif self._consulta is not None:
+            self._consulta[2] += 1
+        return linha
+
+    def fetchmany(self, size=None):
+        tamanho = self.arraysize if size is None else size
+        linhas = self._medir(super().fetchmany, tamanho)
+        if self._consulta is not None:
+            self._consulta[2] += len(linhas)
+            if len(linhas) < tamanho:
+                self._finalizar()
+        return linhas
+
+    def fetchall(self):
+        linhas = self._medir(super().fetchall)
+        if self._consulta is not None:
+            self._consulta[2] += len(linhas)
+        self._finalizar()
+        return linhas
+
+    def __next__(self):
+        # for linha in conn.execute(...)
+        try:
+            linha = self._medir(super().__next__)
+        except StopIteration:
+            self._finalizar()
+            raise
+        if self._consulta is not None:
+            self._consulta[2] += 1
+        return linha
+
+    def close(self):
+        self._finalizar()
+        super().close()
+
+    def __del__(self):
+        self._finalizar()
+
+    def _finalizar(self):
+        consulta, self._consulta = self._consulta, None
+        if consulta is None:
+            return
+        rotulo, segundos, linhas = consulta
+        REGISTRO.observar("sqlite_consulta_segundos", {"consulta": rotulo}, segundos)
+        REGISTRO.somar("sqlite_consulta_linhas_total", {"consulta": rotulo}, linhas)
+
+class ConexaoMedida(sqlite3.Connection):
+    """ Conexão cujos cursores (inclusive os de conn.execute) são CursorMedido """
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+# ---------------------------------------------------------------------------
+# Eventos das etapas do ETL
+# ---------------------------------------------------------------------------
+
+def evento(etapa, destino=ARQUIVO_EVENTOS_ETL, **campos):
+    """
+    Anexa um evento JSON (uma linha) ao arquivo de eventos do ETL. Os workers dos pools
+    de processos escrevem no mesmo arquivo: cada evento é um único write em modo append.
+    """
+    registro = {"momento": datetime.now().isoformat(timespec="milliseconds"), "etapa": etapa,
+                "pid": os.getpid(), **campos}
+    os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+    with open(destino, "a", encoding="utf-8") as f:
+        f.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+
+@contextmanager
+def medir_etapa(etapa, **campos):
+    """
+    Mede o bloco e grava um evento com a duração e o status (ok/erro). O dict
+    devolvido recebe os números da etapa (ex: info["linhas"] = 1000), que vão no evento.
+    """
+    info = dict(campos)
+    inicio = time.perf_counter()
+    status = "ok"
+    try:
+        yield info
+    except BaseException as e:
+        status = f"erro: {type(e).__name__}: {e}"
+        raise
+    finally:
+        segundos = time.perf_counter() - inicio
+        if info.get("linhas") and segundos > 0:
+            info["linhas_por_segundo"] = round(info["linhas"] / segundos, 1)
+        evento(etapa, status=status, segundos=round(segundos, 4), **info)
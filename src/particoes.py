@@ -0,0 +1,82 @@
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+# configurações
+DIR_PROCESSED = "dados_processados"
+DIR_PARTICOES = os.path.join(DIR_PROCESSED, "particoes")
+ARQUIVO_CONTROLE = os.path.join(DIR_PROCESSED, "controle_etl.db")
+
+# Cada etapa do ETL registra aqui quais partições (ano, trimestre) já processou e
+# com qual hash de origem. A mesma tabela é criada dentro do intuitive_care.db
+# para controlar a carga no banco.
+SQL_CONTROLE = """
+CREATE TABLE IF NOT EXISTS controle_particoes (
+    etapa TEXT,
+    ano INTEGER,
+    trimestre TEXT,
+    hash TEXT,
+    linhas INTEGER,
+    atualizado_em TEXT,
+    PRIMARY KEY (etapa, ano, trimestre)
+);
+"""
+
+def garantir_tabela(conn):
+    conn.executescript(SQL_CONTROLE)
+
+def abrir_controle(caminho=ARQUIVO_CONTROLE):
+    """ Abre (e cria, se preciso) o banco de controle das etapas do ETL """
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    conn = sqlite3.connect(caminho)
+    garantir_tabela(conn)
+    return conn
+
+def periodo_do_nome(nome):
+    """ Extrai (ano, trimestre) do nome do arquivo da ANS. Ex: 1T2023.csv -> (2023, '1T') """
+    m = re.search(r"([1-4])T\s*(\d{4})", nome, re.IGNORECASE)
+    if not m:
+        return None, None
+    return int(m.group(2)), f"{m.group(1)}T"
+
+def caminho_particao(ano, trimestre, diretorio=DIR_PARTICOES):
+    return os.path.join(diretorio, f"{ano}_{trimestre}.csv")
+
+def obter(conn, etapa, ano, trimestre):
+    linha = conn.execute(
+        "SELECT hash, linhas FROM controle_particoes WHERE etapa = ? AND ano = ? AND trimestre = ?",
+        (etapa, ano, trimestre)
+    ).fetchone()
+    if linha is None:
+        return None
+    return {"hash": linha[0], "linhas": linha[1]}
+
+def listar(conn, etapa):
+    """ Partições registradas pela etapa, em ordem de ano/trimestre """
+    linhas = conn.execute(
+        "SELECT ano, trimestre, hash, linhas FROM controle_particoes WHERE etapa = ? ORDER BY ano, trimestre",
+        (etapa,)
+    ).fetchall()
+    return [{"ano": a, "trimestre": t, "hash": h, "linhas": n} for a, t, h, n in linhas]
+
+def registrar(conn, etapa, ano, trimestre, hash_origem, linhas):
+    # não faz commit: quem chama decide a transação (ex: junto com o DELETE/INSERT da partição)
+    conn.execute(
+        """
+        INSERT INTO controle_particoes (etapa, ano, trimestre, hash, linhas, atualizado_em)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(etapa, ano, trimestre) DO UPDATE SET
+            hash = excluded.hash,
+            linhas = excluded.linhas,
+            atualizado_em = excluded.atualizado_em
+        """,
+        (etapa, ano, trimestre, hash_origem, linhas, datetime.now().isoformat(timespec="seconds"))
+    )
+
+def remover(conn, etapa, ano, trimestre):
+    # partição que falhou (a próxima execução a refaz) ou que saiu das fontes
+    conn.execute(
+        "DELETE FROM controle_particoes WHERE etapa = ? AND ano = ? AND trimestre = ?",
+        (etapa, ano, trimestre)
+    )
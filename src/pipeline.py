@@ -0,0 +1,336 @@
+import os
+import sys
+import time
+import hashlib
+import argparse
+from datetime import datetime
+
+import fontes
+import particoes
+import metricas
+import main
+import transformacao
+import banco_de_dados
+import gerar_mock
+
+# configurações
+DIR_SQL = banco_de_dados.DIR_SQL
+FILE_CADASTRO = transformacao.FILE_CADASTRO_LOCAL
+FILE_CONSOLIDADO = f"{main.DIR_PROCESSED}/consolidado_despesas.csv"
+FILE_AGREGADO = os.path.join(transformacao.DIR_PROCESSED, "despesas_agregadas.csv")
+
+# Assinatura das entradas de cada etapa na última execução bem-sucedida. Fica no mesmo
+# controle_etl.db das partições: se a assinatura não mudou e as saídas existem, a etapa é pulada.
+SQL_CONTROLE_PIPELINE = """
+CREATE TABLE IF NOT EXISTS controle_pipeline (
+    etapa TEXT PRIMARY KEY,
+    entrada TEXT,
+    segundos REAL,
+    atualizado_em TEXT
+);
+"""
+
+# O ETL inteiro num processo só: cada etapa recebe em memória o que as anteriores
+# devolveram (lista de fontes, partições, cadastro já lido) e o import do pandas é pago
+# uma vez. As partições continuam em disco (Parquet), porque são elas que deixam a
+# próxima execução incremental e são lidas pelos workers dos pools de processos.
+
+class FalhaEtapa(Exception):
+    """ A etapa terminou sem o resultado completo (a função da etapa avisou a falha) """
+
+def _sha256(*partes):
+    h = hashlib.sha256()
+    for parte in partes:
+        h.update(str(parte).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def hash_arquivos(caminhos, bloco=1024 * 1024):
+    """ sha256 do conteúdo dos arquivos (os que não existem entram como ausentes) """
+    h = hashlib.sha256()
+    for caminho in caminhos:
+        h.update(caminho.encode("utf-8"))
+        if not os.path.exists(caminho):
+            h.update(b"ausente")
+            continue
+        with open(caminho, "rb") as f:
+            for parte in iter(lambda: f.read(bloco), b""):
+                h.update(parte)
+    return h.hexdigest()
+
+# ---------------------------------------------------------------------------
+# Etapas: executar(execucao) devolve o valor passado às seguintes; carregar(execucao)
+# obtém o mesmo valor do disco quando a etapa é pulada ou não foi pedida.
+# ---------------------------------------------------------------------------
+
+def executar_download(execucao):
+    if not execucao.baixar:
+        print("Download desativado: usando os ZIPs/CSVs que já estão em dados_brutos.")
+        return {}
+    return main.baixar_todos()
+
+def carregar_fontes(execucao):
+    return main.listar_arquivos_csv(main.DIR_RAW)
+
+def assinatura_fontes(execucao):
+    # só os CSVs que a consolidação usa (com ano/trimestre no nome; o Relatorio_Cadop.csv
+    # fica de fora). Membros de ZIP entram pelo CRC do diretório central: não descomprime nada
+    dados = [f for f in execucao.valor("fontes") if particoes.periodo_do_nome(fontes.nome(f))[0] is not None]
+    return fontes.hash_fontes(dados)
+
+def executar_consolidacao(execucao):
+    try:
+        main.consolidar(execucao.valor("fontes"), execucao.controle)
+    except RuntimeError as e:
+        # partições com erro (atualizar_particoes): as boas ficam registradas, as outras serão refeitas
+        raise FalhaEtapa(f"consolidacao: {e}") from e
+    return particoes.listar(execucao.controle, "consolidacao")
+
+def carregar_consolidacao(execucao):
+    return particoes.listar(execucao.controle, "consolidacao")
+
+def assinatura_consolidacao(execucao):
+    # os hashes de origem de cada partição, como registrados pela própria consolidação
+    return _sha256(*(f"{p['ano']}_{p['trimestre']}:{p['hash']}:{p['linhas']}" for p in execucao.valor("consolidacao")))
+
+def saidas_consolidacao(execucao):
+    return [FILE_CONSOLIDADO] + [particoes.caminho_particao(p["ano"], p["trimestre"])
+                                 for p in execucao.valor("consolidacao") if p["linhas"]]
+
+def executar_cadastro(execucao):
+    if execucao.mock and gerar_mock.cadastro_derivado() and os.path.exists(FILE_CONSOLIDADO):
+        # cadastro fictício de uma consolidação anterior: refaz para incluir as operadoras novas
+        gerar_mock.gerar_cadastro_fake()
+    df = transformacao.obter_cadastro_operadoras()
+    if df is None and execucao.mock and os.path.exists(FILE_CONSOLIDADO):
+        # mesmo fallback do README: cadastro fictício com as operadoras do consolidado
+        gerar_mock.gerar_cadastro_fake()
+        df = transformacao.obter_cadastro_operadoras()
+    return df
+
+def carregar_cadastro(execucao):
+    return transformacao.obter_cadastro_operadoras()
+
+def assinatura_cadastro(execucao):
+    return hash_arquivos([FILE_CADASTRO])
+
+def entrada_cadastro(execucao):
+    # o cadastro fictício sai do consolidado: muda junto com ele (o real só depende do arquivo)
+    if gerar_mock.cadastro_derivado():
+        return _sha256(assinatura_cadastro(execucao), execucao.assinatura("consolidacao"))
+    return assinatura_cadastro(execucao)
+
+def executar_agregacao(execucao):
+    agregado = transformacao.transformar(execucao.controle, execucao.valor("cadastro"))
+    if agregado is None:
+        raise FalhaEtapa("agregacao: nenhuma partição consolidada para agregar")
+    return agregado
+
+def carregar_agregacao(execucao):
+    return None
+
+def executar_carga(execucao):
+    geracao = banco_de_dados.carregar_banco(execucao.valor("cadastro"))
+    if geracao is None:
+        raise FalhaEtapa("carga: carga incompleta, nenhum snapshot publicado")
+    return geracao
+
+def carregar_carga(execucao):
+    return None
+
+def saidas_carga(execucao):
+    # o snapshot publicado também é saída: se foi apagado, a carga roda de novo e publica outro
+    snapshot = banco_de_dados.snapshot_publicado()
+    return [banco_de_dados.DB_NAME, banco_de_dados.ARQUIVO_VERSAO, snapshot or banco_de_dados.ARQUIVO_SNAPSHOT]
+
+def entrada_carga(execucao):
+    # o esquema do banco também é entrada: um .sql alterado refaz a carga
+    arquivos_sql = sorted(os.path.join(DIR_SQL, a) for a in os.listdir(DIR_SQL) if a.endswith(".sql"))
+    return _sha256(execucao.assinatura("consolidacao"), execucao.assinatura("cadastro"), hash_arquivos(arquivos_sql))
+
+# Grafo das etapas. A ordem do dict já é uma ordem topológica. "sempre": a etapa roda em
+# toda execução (download e listagem das fontes são o que detecta mudanças). "entrada":
+# assinatura das entradas; o padrão é combinar as assinaturas das dependências.
+# "assinatura": o que a etapa entrega às seguintes, calculada a partir do estado em disco.
+ETAPAS = {
+    "download": {
+        "depende": [],
+        "sempre": True,
+        "executar": executar_download,
+        "carregar": lambda execucao: {},
+    },
+    "fontes": {
+        "depende": ["download"],
+        "sempre": True,
+        "executar": carregar_fontes,
+        "carregar": carregar_fontes,
+        "assinatura": assinatura_fontes,
+    },
+    "consolidacao": {
+        "depende": ["fontes"],
+        "executar": executar_consolidacao,
+        "carregar": carregar_consolidacao,
+        "assinatura": assinatura_consolidacao,
+        "saidas": saidas_consolidacao,
+    },
+    "cadastro": {
+        # depende da consolidação só por causa do cadastro fictício (gerar_mock.py)
+        "depende": ["consolidacao"],
+        "entrada": entrada_cadastro,
+        "executar": executar_cadastro,
+        "carregar": carregar_cadastro,
+        "assinatura": assinatura_cadastro,
+        "saidas": lambda execucao: [FILE_CADASTRO],
+    },
+    "agregacao": {
+        "depende": ["consolidacao", "cadastro"],
+        "executar": executar_agregacao,
+        "carregar": carregar_agregacao,
+        "saidas": lambda execucao: [FILE_AGREGADO],
+    },
+    "carga": {
+        "depende": ["consolidacao", "cadastro"],
+        "entrada": entrada_carga,
+        "executar": executar_carga,
+        "carregar": carregar_carga,
+        "saidas": saidas_carga,
+    },
+}
+
+def com_dependencias(nomes):
+    """ As etapas pedidas e todas as anteriores de que dependem, na ordem do grafo """
+    pendentes = list(nomes)
+    escolhidas = set()
+    while pendentes:
+        nome = pendentes.pop()
+        if nome not in ETAPAS:
+            raise ValueError(f"Etapa desconhecida: {nome}. Use: {', '.join(ETAPAS)}")
+        if nome not in escolhidas:
+            escolhidas.add(nome)
+            pendentes.extend(ETAPAS[nome]["depende"])
+    return [nome for nome in ETAPAS if nome in escolhidas]
+
+class Execucao:
+    """
+    Estado de uma execução do pipeline: valores entregues por cada etapa, assinaturas já
+    calculadas e o tempo de cada uma. Valores de etapas que não rodaram são carregados do
+    disco só se alguma etapa seguinte precisar deles.
+    """
+
+    def __init__(self, controle, baixar=True, mock=True):
+        self.controle = controle
+        self.baixar = baixar
+        self.mock = mock
+        self.valores = {}
+        self._assinaturas = {}
+        self.tempos = []  # (etapa, status, segundos)
+
+    def valor(self, nome):
+        if nome not in self.valores:
+            self.valores[nome] = ETAPAS[nome]["carregar"](self)
+        return self.valores[nome]
+
+    def assinatura(self, nome):
+        if nome not in self._assinaturas:
+            etapa = ETAPAS[nome]
+            self._assinaturas[nome] = etapa["assinatura"](self) if "assinatura" in etapa else self.entrada(nome)
+        return self._assinaturas[nome]
+
+    def entrada(self, nome):
+        etapa = ETAPAS[nome]
+        if "entrada" in etapa:
+            return etapa["entrada"](self)
+        return _sha256(*(f"{dep}:{self.assinatura(dep)}" for dep in etapa["depende"] if dep != "download"))
+
+    def pode_pular(self, nome):
+        etapa = ETAPAS[nome]
+        linha = self.controle.execute("SELECT entrada FROM controle_pipeline WHERE etapa = ?", (nome,)).fetchone()
+        if etapa.get("sempre") or linha is None or linha[0] != self.entrada(nome):
+            return False
+        return all(os.path.exists(caminho) for caminho in etapa.get("saidas", lambda execucao: [])(self))
+
+    def rodar(self, nome, forcar=False):
+        if not forcar and self.pode_pular(nome):
+            print(f"\n[pipeline] {nome}: entradas sem alterações, pulando.")
+            metricas.evento(f"pipeline.{nome}", status="pulada", segundos=0.0)
+            self.tempos.append((nome, "pulada", 0.0))
+            return
+
+        print(f"\n[pipeline] {nome}")
+        inicio = time.perf_counter()
+        try:
+            with metricas.medir_etapa(f"pipeline.{nome}"):
+                self.valores[nome] = ETAPAS[nome]["executar"](self)
+        except BaseException:
+            # etapa com erro não pode ser pulada depois: apaga a assinatura da última execução boa
+            self.tempos.append((nome, "falhou", time.perf_counter() - inicio))
+            with self.controle:
+                self.controle.execute("DELETE FROM controle_pipeline WHERE etapa = ?", (nome,))
+            raise
+        segundos = time.perf_counter() - inicio
+        self.tempos.append((nome, "executada", segundos))
+
+        # a saída da etapa mudou: descarta as assinaturas calculadas antes dela
+        self._assinaturas.pop(nome, None)
+        if not ETAPAS[nome].get("sempre"):
+            with self.controle:
+                self.controle.execute(
+                    """
+                    INSERT INTO controle_pipeline (etapa, entrada, segundos, atualizado_em) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(etapa) DO UPDATE SET
+                        entrada = excluded.entrada,
+                        segundos = excluded.segundos,
+                        atualizado_em = excluded.atualizado_em
+                    """,
+                    (nome, self.entrada(nome), round(segundos, 4), datetime.now().isoformat(timespec="seconds"))
+                )
+
+    def relatorio(self):
+        print("\n--- TEMPOS DO PIPELINE ---")
+        for nome, status, segundos in self.tempos:
+            print(f"{nome:<14} {status:<10} {segundos:>9.2f}s")
+        print(f"{'total':<25} {sum(s for _, _, s in self.tempos):>9.2f}s")
+
+def executar(etapas=None, dependencias=True, forcar=False, baixar=True, mock=True):
+    """
+    Roda as etapas pedidas (todas, por padrão) na ordem do grafo, no processo atual.
+    Com dependencias=True entram também as etapas anteriores; as que tiverem as mesmas
+    entradas da última execução são puladas, a menos que forcar=True. Devolve a Execucao
+    (valores de cada etapa e tempos).
+    """
+    nomes = list(ETAPAS) if not etapas else list(etapas)
+    ordem = com_dependencias(nomes) if dependencias else [nome for nome in ETAPAS if nome in nomes]
+    if not dependencias and len(ordem) != len(set(nomes)):
+        raise ValueError(f"Etapa desconhecida em {nomes}. Use: {', '.join(ETAPAS)}")
+
+    controle = particoes.abrir_controle()
+    controle.executescript(SQL_CONTROLE_PIPELINE)
+    execucao = Execucao(controle, baixar=baixar, mock=mock)
+    try:
+        for nome in ordem:
+            execucao.rodar(nome, forcar=forcar)
+    finally:
+        controle.close()
+        execucao.relatorio()
+    return execucao
+
+def rodar_script(etapas, **opcoes):
+    """ Para os scripts (main.py etc.): falha de etapa sai com código 1, sem traceback """
+    try:
+        return executar(etapas, **opcoes)
+    except FalhaEtapa as e:
+        print(f"\n❌ {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Roda o ETL inteiro (ou parte dele) num processo só")
+    parser.add_argument("--etapas", default="",
+                        help=f"etapas pedidas, separadas por vírgula ({','.join(ETAPAS)}); as anteriores entram junto")
+    parser.add_argument("--forcar", action="store_true", help="roda mesmo as etapas cujas entradas não mudaram")
+    parser.add_argument("--sem-download", action="store_true", help="usa só o que já está em dados_brutos")
+    parser.add_argument("--sem-mock", action="store_true",
+                        help="não gera o cadastro fictício quando o da ANS não estiver disponível")
+    args = parser.parse_args()
+
+    rodar_script([e for e in args.etapas.split(",") if e], forcar=args.forcar,
+                 baixar=not args.sem_download, mock=not args.sem_mock)
@@ -1,32 +1,38 @@
+import numpy as np
 import pandas as pd
 import requests
 import os
-from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
 import urllib3
+import agregacao
+import intermediario
+import particoes
+import valores
+import esquema
+import metricas
 
 # configurações
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 DIR_RAW = "dados_brutos"
 DIR_PROCESSED = "dados_processados"
-FILE_CONSOLIDADO = os.path.join(DIR_PROCESSED, "consolidado_despesas.csv")
+DIR_AGREGADOS = os.path.join(DIR_PROCESSED, "agregados_particao")  # parciais por (ano, trimestre)
+# Os parciais somam centavos inteiros (sem erro de arredondamento de float). O nome da etapa
+# mudou junto com a unidade, então parciais antigos (em reais) são refeitos uma vez.
+ETAPA_AGREGACAO = "agregacao_centavos"
 FILE_CADASTRO_LOCAL = os.path.join(DIR_RAW, "Relatorio_Cadop.csv")
 URL_CADASTRO = "https://dadosabertos.ans.gov.br/FTP/PDA/operadoras_de_plano_de_saude_ativas/Relatorio_Cadop.csv"
-
-def encontrar_coluna_inteligente(df, possiveis_nomes):
-    """ Busca coluna por palavra-chave (ignora maiúsculas/minúsculas) """
-    colunas_map = {c.upper().strip(): c for c in df.columns}
-    for nome_upper in colunas_map:
-        for chave in possiveis_nomes:
-            if chave in nome_upper:
-                return colunas_map[nome_upper]
-    return None
+MAX_PROCESSOS = None  # partições agregadas em paralelo; None = um processo por núcleo
+TAMANHO_BLOCO = 200_000  # linhas lidas por vez de cada partição
+LIMITE_MAPA_CHAVES = 1 << 24  # registros ANS até aqui usam o mapa em array (64 MB no pior caso); acima, pd.Index
 
 def obter_cadastro_operadoras():
     """
     Lógica Híbrida:
     1. Verifica se já existe o arquivo local (criado pelo mock ou download anterior).
     2. Se não existir, tenta baixar da ANS.
+    O arquivo é lido uma vez só, com separador/encoding/colunas do esquema.py
+    (colunas canônicas REGISTRO_ANS, RAZAO_SOCIAL, UF, ...).
     """
     print("\n--- Obtendo Cadastro de Operadoras ---")
     
@@ -34,12 +40,7 @@ def obter_cadastro_operadoras():
     if os.path.exists(FILE_CADASTRO_LOCAL):
         print(f"-> Arquivo encontrado localmente: {FILE_CADASTRO_LOCAL}")
         try:
-            # Tenta ler com ponto e vírgula
-            df = pd.read_csv(FILE_CADASTRO_LOCAL, sep=';', on_bad_lines='skip', encoding='latin1')
-            
-            if df.shape[1] < 2:
-                 df = pd.read_csv(FILE_CADASTRO_LOCAL, sep=',', on_bad_lines='skip', encoding='latin1')
-            
+            df = esquema.ler_csv(FILE_CADASTRO_LOCAL, "cadastro")
             print("-> Leitura local: SUCESSO.")
             return df
         except Exception as e:
@@ -58,11 +59,7 @@ def obter_cadastro_operadoras():
             with open(FILE_CADASTRO_LOCAL, 'wb') as f:
                 f.write(response.content)
             print(f"-> Download salvo em {FILE_CADASTRO_LOCAL}")
-            
-            df = pd.read_csv(StringIO(response.text), sep=';', on_bad_lines='skip', encoding='latin1')
-            if df.shape[1] < 2:
-                 df = pd.read_csv(StringIO(response.text), sep=',', on_bad_lines='skip', encoding='latin1')
-            return df
+            return esquema.ler_csv(FILE_CADASTRO_LOCAL, "cadastro")
         else:
             print(f"-> Falha no Download. Status Code: {response.status_code}")
             return None
@@ -71,60 +68,137 @@ def obter_cadastro_operadoras():
         print(f"-> Erro crítico de conexão: {e}")
         return None
 
-def main():
-    print("--- INICIANDO FASE 2: TRANSFORMAÇÃO ---")
-
-    if not os.path.exists(FILE_CONSOLIDADO):
-        print(f"Erro: Arquivo {FILE_CONSOLIDADO} não existe. Rode o main.py primeiro.")
-        return
+def chaves_int32(serie):
+    """ Registro ANS como int32 (-1 onde não é número), sem passar por float """
+    return pd.to_numeric(serie, errors='coerce').astype('Int32').fillna(-1).to_numpy('int32')
 
-    df_despesas = pd.read_csv(FILE_CONSOLIDADO, sep=';', decimal=',', encoding='utf-8')
-    
-    # Identifica colunas dinamicamente
-    col_chave_desp = encontrar_coluna_inteligente(df_despesas, ["REG", "CD_OPS", "CNPJ"])
-    col_valor = encontrar_coluna_inteligente(df_despesas, ["VALOR", "SALDO", "DESPESA"])
-    
-    print(f"Colunas Despesas -> ID: '{col_chave_desp}' | Valor: '{col_valor}'")
+def posicoes_no_cadastro(chaves_cadastro, chaves):
+    """
+    Para cada chave, a linha correspondente do cadastro (-1 se não existir). Os registros
+    ANS são inteiros pequenos, então o índice é um array: posicao[registro] = linha.
+    Chaves muito grandes caem no pd.Index.get_indexer.
+    """
+    maior = int(max(chaves_cadastro.max(initial=-1), chaves.max(initial=-1)))
+    if maior < LIMITE_MAPA_CHAVES:
+        mapa = np.full(maior + 2, -1, dtype=np.int32)  # última posição: destino das chaves -1
+        validas = chaves_cadastro >= 0
+        mapa[chaves_cadastro[validas]] = np.flatnonzero(validas)
+        return mapa[np.where(chaves >= 0, chaves, maior + 1)]
+    return pd.Index(chaves_cadastro).get_indexer(chaves)
+
+def enriquecer_operadoras(df, cadastro, col_chave, padrao_razao='OPERADORA DESCONHECIDA', padrao_uf='ND'):
+    """
+    Acrescenta Razao_Social e UF (categóricas) a um frame que já está agrupado por
+    operadora (registro ANS inteiro). Substitui o merge genérico: o cadastro vira um
+    mapa chave -> linha e os nomes entram como códigos de categoria.
+    """
+    cadastro = cadastro.assign(_chave=chaves_int32(cadastro['REGISTRO_ANS']))
+    cadastro = cadastro[cadastro['_chave'] >= 0].drop_duplicates('_chave', keep='last')
+    posicoes = posicoes_no_cadastro(cadastro['_chave'].to_numpy(), chaves_int32(df[col_chave]))
+
+    resultado = df.copy()
+    resultado[col_chave] = pd.to_numeric(df[col_chave], errors='coerce').astype('Int32')
+    for coluna, origem, padrao in (('Razao_Social', 'RAZAO_SOCIAL', padrao_razao), ('UF', 'UF', padrao_uf)):
+        valores_cad = cadastro[origem] if origem in cadastro.columns else pd.Series(pd.NA, index=cadastro.index)
+        categorias = pd.Categorical(valores_cad.fillna(padrao))
+        if padrao not in categorias.categories:
+            categorias = categorias.add_categories([padrao])
+        # posição -1 (sem cadastro) pega o último elemento: o código do valor padrão
+        codigos = np.append(categorias.codes, categorias.categories.get_loc(padrao))[posicoes]
+        resultado[coluna] = pd.Categorical.from_codes(codigos, categories=categorias.categories)
+    return resultado
+
+def agregar_particao(ano, trimestre, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Executado em um processo separado: lê a partição em blocos de tamanho_bloco linhas
+    e devolve o parcial (qtd/soma/m2 por registro_ans, em centavos). A memória fica
+    limitada a um bloco mais o estado por operadora.
+    """
+    agregador = agregacao.AgregadorStreaming(["REGISTRO_ANS"], "CENTAVOS")
+    blocos = intermediario.ler_consolidado_em_blocos(
+        ["REGISTRO_ANS", "VALOR"], particoes.caminho_particao(ano, trimestre), tamanho_bloco
+    )
+    with metricas.medir_etapa("transformacao.agregar_particao", ano=ano, trimestre=trimestre) as info:
+        linhas = 0
+        for bloco in blocos:
+            linhas += len(bloco)
+            # VALOR já vem numérico do main.py (esquema fixo); aqui só passa para centavos
+            bloco = bloco[bloco["VALOR"] > 0]
+            agregador.adicionar(bloco.assign(CENTAVOS=valores.para_centavos(bloco["VALOR"]).astype("int64")))
+        parcial = agregador.parcial()
+        info.update(linhas=linhas, operadoras=len(parcial))
+    return parcial
+
+def agregar_particoes(controle, max_workers=MAX_PROCESSOS):
+    """
+    Mantém um agregado parcial (qtd/soma/m2 por registro_ans, em centavos) para cada partição
+    (ano, trimestre) do consolidado. Só as partições novas ou alteradas são relidas, em
+    paralelo e em blocos; as demais reaproveitam o parcial salvo. Devolve o parcial
+    combinado de todas.
+    """
+    os.makedirs(DIR_AGREGADOS, exist_ok=True)
+    total = agregacao.AgregadorStreaming(["REGISTRO_ANS"], "CENTAVOS")
+    pendentes = []
+    for p in particoes.listar(controle, "consolidacao"):
+        ano, trimestre = p["ano"], p["trimestre"]
+        arquivo_parcial = os.path.join(DIR_AGREGADOS, f"{ano}_{trimestre}.csv")
+        registro = particoes.obter(controle, ETAPA_AGREGACAO, ano, trimestre)
+
+        if registro and registro["hash"] == p["hash"] and os.path.exists(arquivo_parcial):
+            total.combinar(pd.read_csv(arquivo_parcial, sep=';'))
+        else:
+            pendentes.append((p, arquivo_parcial))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futuros = []
+        for p, arquivo_parcial in pendentes:
+            print(f"Agregando partição {p['trimestre']}/{p['ano']}...")
+            futuro = executor.submit(agregar_particao, p["ano"], p["trimestre"]) if p["linhas"] else None
+            futuros.append((p, arquivo_parcial, futuro))
+
+        for p, arquivo_parcial, futuro in futuros:
+            if futuro is not None:
+                parcial = futuro.result()
+            else:
+                parcial = pd.DataFrame(columns=["REGISTRO_ANS"] + agregacao.COLUNAS_PARCIAIS)
+            parcial.to_csv(arquivo_parcial, index=False, sep=';')
+            with controle:
+                particoes.registrar(controle, ETAPA_AGREGACAO, p["ano"], p["trimestre"], p["hash"], len(parcial))
+            total.combinar(parcial)
+
+    return total.parcial()
+
+def transformar(controle, df_cadastro):
+    """
+    Agrega as despesas por operadora (Razao_Social, UF) e grava despesas_agregadas.csv.
+    O cadastro chega já lido (DataFrame canônico do esquema.py, ou None se não houver).
+    Devolve o agregado, ou None se ainda não houver partições consolidadas.
+    """
+    print("--- INICIANDO FASE 2: TRANSFORMAÇÃO ---")
 
-    if not col_chave_desp or not col_valor:
-        print("Erro: Colunas não identificadas no arquivo de despesas.")
-        return
+    if not particoes.listar(controle, "consolidacao"):
+        print(f"Erro: Nenhuma partição consolidada em {particoes.DIR_PARTICOES}. Rode o main.py primeiro.")
+        return None
 
-    # Limpeza de valores
-    df_despesas[col_valor] = pd.to_numeric(df_despesas[col_valor], errors='coerce')
-    df_despesas = df_despesas[df_despesas[col_valor] > 0]
+    # parciais por operadora: qtd, soma e m2 dos valores positivos
+    col_chave_desp = "REGISTRO_ANS"
+    with metricas.medir_etapa("transformacao.agregacao") as info:
+        df_despesas = agregar_particoes(controle)
+        info["operadoras"] = len(df_despesas)
 
-    # OBTER CADASTRO (Local ou Download)
-    df_cadastro = obter_cadastro_operadoras()
-    
     if df_cadastro is not None:
-        # Identifica colunas do cadastro
-        col_chave_cad = encontrar_coluna_inteligente(df_cadastro, ["REGISTRO", "REG", "CD_OPS"])
-        col_razao = encontrar_coluna_inteligente(df_cadastro, ["RAZAO", "NOME", "DENOMINACAO"])
-        col_uf = encontrar_coluna_inteligente(df_cadastro, ["UF", "ESTADO"])
+        # colunas já vêm com os nomes canônicos do esquema.py
+        col_chave_cad = "REGISTRO_ANS" if "REGISTRO_ANS" in df_cadastro.columns else None
+        col_razao = "RAZAO_SOCIAL" if "RAZAO_SOCIAL" in df_cadastro.columns else None
+        col_uf = "UF" if "UF" in df_cadastro.columns else None
 
         print(f"Colunas Cadastro -> ID: '{col_chave_cad}' | Nome: '{col_razao}' | UF: '{col_uf}'")
 
         if col_chave_cad and col_razao:
-            # Prepara chaves para numérico
-            df_despesas[col_chave_desp] = pd.to_numeric(df_despesas[col_chave_desp], errors='coerce')
-            df_cadastro[col_chave_cad] = pd.to_numeric(df_cadastro[col_chave_cad], errors='coerce')
-
-            # Renomeia para padronizar
-            df_cadastro = df_cadastro.rename(columns={col_razao: 'Razao_Social', col_uf: 'UF'})
-
-            print("Cruzando dados (Merge)...")
-            df_final = pd.merge(
-                df_despesas,
-                df_cadastro[[col_chave_cad, 'Razao_Social', 'UF']],
-                left_on=col_chave_desp,
-                right_on=col_chave_cad,
-                how='left'
-            )
-            
-            # Preenche quem não deu match
-            df_final['Razao_Social'] = df_final['Razao_Social'].fillna('OPERADORA DESCONHECIDA')
-            df_final['UF'] = df_final['UF'].fillna('ND')
+            # os parciais já estão agrupados pelo registro (int); os nomes entram só agora,
+            # uma vez por operadora, e quem não está no cadastro vira OPERADORA DESCONHECIDA / ND
+            print("Cruzando dados (mapa de registros)...")
+            df_final = enriquecer_operadoras(df_despesas, df_cadastro, col_chave_desp)
         else:
             print("Aviso: Colunas vitais não encontradas no cadastro.")
             df_final = df_despesas
@@ -140,18 +214,23 @@ def main():
     if 'UF' not in df_final.columns: df_final['UF'] = 'ND'
     
     print("Gerando estatísticas...")
-    agregado = df_final.groupby(['Razao_Social', 'UF'])[col_valor].agg(
-        Total_Despesas='sum',
-        Media_Trimestral='mean',
-        Desvio_Padrao='std'
-    ).reset_index().sort_values(by='Total_Despesas', ascending=False)
-    
     arquivo_saida = os.path.join(DIR_PROCESSED, "despesas_agregadas.csv")
-    agregado.to_csv(arquivo_saida, index=False, sep=';', decimal=',')
+    with metricas.medir_etapa("transformacao.estatisticas", arquivo=arquivo_saida) as info:
+        # junta os parciais por operadora no nível (Razao_Social, UF)
+        parcial = agregacao.combinar_parciais(df_final, ['Razao_Social', 'UF'])
+        agregado = agregacao.finalizar(parcial, escala=100).sort_values(by='Total_Despesas', ascending=False)
+        agregado.to_csv(arquivo_saida, index=False, sep=';', decimal=',')
+        info["linhas"] = len(agregado)
     
     print(f"\n✅ SUCESSO! Arquivo salvo em: {arquivo_saida}")
     print("Top 3 Operadoras:")
     print(agregado.head(3))
+    return agregado
+
+def main():
+    # cadastro + agregação pelo pipeline.py (o cadastro é lido uma vez e passado em memória)
+    import pipeline
+    pipeline.rodar_script(["cadastro", "agregacao"], dependencias=False, forcar=True, mock=False)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
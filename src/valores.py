@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+# pyarrow é opcional: com ele a conversão roda nos kernels do Arrow, sem objetos Python por linha
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+# número válido depois de tirar os pontos de milhar e trocar a vírgula decimal por ponto
+PADRAO_NUMERO = r"[+-]?(\d+(\.\d*)?|\.\d+)"
+
+def converter_decimal_br(valores, centavos=False):
+    """
+    Converte uma coluna de texto no formato brasileiro ("1.234.567,89") para número.
+    Devolve (serie, invalidos): a série em float64 (ou Int64 em centavos, se
+    centavos=True) com NaN/NA onde o texto não é número, e quantos valores
+    preenchidos não puderam ser convertidos.
+    """
+    if pd.api.types.is_numeric_dtype(valores):
+        # já numérica (ex: lida sem dtype=str): nada para limpar
+        numeros, invalidos = valores.astype("float64"), 0
+    elif pd.api.types.infer_dtype(valores, skipna=True) not in ("string", "empty"):
+        numeros, invalidos = _converter_misto(valores)
+    elif pa is not None:
+        numeros, invalidos = _converter_arrow(valores)
+    else:
+        numeros, invalidos = _converter_pandas(valores)
+
+    if centavos:
+        return para_centavos(numeros), invalidos
+    return numeros, invalidos
+
+def _converter_arrow(valores):
+    texto = pa.array(valores, type=pa.string(), from_pandas=True)
+    texto = pc.utf8_trim_whitespace(texto)
+    texto = pc.replace_substring(texto, ".", "")
+    texto = pc.replace_substring(texto, ",", ".")
+
+    validos = pc.match_substring_regex(texto, f"^{PADRAO_NUMERO}$")
+    numeros = pc.cast(pc.if_else(validos, texto, pa.scalar(None, pa.string())), pa.float64())
+
+    preenchidos = pc.and_(pc.is_valid(texto), pc.not_equal(texto, ""))
+    invalidos = pc.sum(pc.and_(preenchidos, pc.invert(validos))).as_py() or 0
+    return pd.Series(numeros.to_numpy(zero_copy_only=False), index=valores.index, name=valores.name), invalidos
+
+def _converter_pandas(valores):
+    texto = (
+        valores.astype("string")
+        .str.strip()
+        .str.replace(".", "", regex=False)
+        .str.replace(",", ".", regex=False)
+    )
+    validos = texto.str.fullmatch(PADRAO_NUMERO).fillna(False).astype(bool)
+    numeros = pd.to_numeric(texto.where(validos), errors="coerce").astype("float64")
+    invalidos = int((texto.notna() & (texto != "") & ~validos).sum())
+    return numeros, invalidos
+
+def _converter_misto(valores):
+    # coluna object com números e textos misturados: os números ficam como estão,
+    # só os textos passam pela conversão (caso raro, vale o custo do isinstance por linha)
+    e_texto = valores.map(lambda v: isinstance(v, str)).astype(bool)
+    numeros = pd.to_numeric(valores.where(~e_texto), errors="coerce").astype("float64")
+    convertidos, invalidos = converter_decimal_br(valores[e_texto].astype("string"))
+    numeros[e_texto] = convertidos
+    return numeros, invalidos
+
+def para_centavos(numeros):
+    """
+    Valor em reais (float64) -> centavos em Int64 (NA onde não há valor). Exato para
+    valores com até 2 casas e abaixo de ~90 trilhões, o que cobre os saldos da ANS.
+    Somar centavos inteiros não acumula erro de arredondamento como somar floats.
+    """
+    centavos = np.rint(np.asarray(numeros, dtype="float64") * 100)
+    return pd.Series(centavos, index=getattr(numeros, "index", None)).astype("Int64")